@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the MCP server.
+
+Starts fake_google.py and the server (serve.py) as separate processes on a
+fresh database, seeds tokens for --users users, then drives each scenario
+at each concurrency level for --duration seconds:
+
+    send_email, create_event   HTTP tool calls against the server
+    get_token, save_token      the token store functions, called in this
+                               process with the token cache disabled
+
+and reports requests/s, p50/p95/p99 latency and memory (server RSS, or this
+process's for the token functions). Results are written as JSON; pass an
+earlier file to --compare to see the change per scenario:
+
+    python bench_load.py --concurrency 1 8 32 --duration 10 --json after.json --compare before.json
+    DATABASE_URL=postgresql://... python bench_load.py --backend sqlite postgres
+    python bench_load.py --backend sqlite sqlite-wal --sqlite-shards 4
+
+The load generator is a Python thread pool on the same machine, so absolute
+numbers include its overhead; compare runs made on the same machine.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+HTTP_SCENARIOS = {
+    "send_email": ("/tools/send-email", lambda user: {
+        "user_id": user, "to": "bench@example.com", "subject": "Load test", "body": "Hello from bench_load.py",
+    }),
+    "create_event": ("/tools/create-event", lambda user: {
+        "user_id": user, "summary": "Load test", "start_time": "2025-01-06T10:00:00-05:00", "end_time": "2025-01-06T11:00:00-05:00",
+    }),
+}
+SCENARIOS = tuple(HTTP_SCENARIOS) + ("get_token", "save_token")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, path, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", path)
+            if conn.getresponse().status < 500:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing answered on port {port} within {timeout}s")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+def process_tree(pid):
+    """pid and all its descendants (Linux /proc)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, ()))
+    return tree
+
+
+def memory_kb(pids):
+    """(current RSS, peak RSS) in KiB summed over `pids`."""
+    rss = peak = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1])
+                    elif line.startswith("VmHWM:"):
+                        peak += int(line.split()[1])
+        except OSError:
+            continue
+    return rss, peak
+
+
+def run_load(call, concurrency, duration):
+    """Call `call(worker_index)` from `concurrency` threads for `duration` seconds."""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(concurrency + 1)
+    deadline = [None]
+
+    def worker(index):
+        local, failed = [], 0
+        start_barrier.wait()
+        while time.perf_counter() < deadline[0]:
+            started = time.perf_counter()
+            try:
+                ok = call(index)
+            except Exception:
+                ok = False
+            local.append(time.perf_counter() - started)
+            failed += not ok
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    deadline[0] = time.perf_counter() + duration
+    started = time.perf_counter()
+    start_barrier.wait()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), sum(errors), time.perf_counter() - started
+
+
+def summarize(scenario, backend, concurrency, latencies, errors, elapsed, memory):
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        "backend": backend,
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+        "rss_mb": round(memory[0] / 1024, 1),
+        "peak_rss_mb": round(memory[1] / 1024, 1),
+    }
+
+
+def post_json(port, path, payload):
+    # serve.py answers HTTP/1.0, one request per connection
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request("POST", path, json.dumps(payload), {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        return response.status < 400
+    finally:
+        conn.close()
+
+
+def bench_backend(backend, args, tmp):
+    env = dict(os.environ, JOB_WORKERS="0", RATE_LIMIT_ENABLED="false", TOKEN_REFRESH_ENABLED="false",
+               WARMUP_HTTP="false", PYTHONUNBUFFERED="1")
+    if backend.startswith("sqlite"):
+        env.pop("DATABASE_URL", None)
+        env["SQLITE_DB_PATH"] = os.path.join(tmp, "bench.db")
+        if backend == "sqlite-wal":
+            env.update(SQLITE_STORE_MODE="wal", SQLITE_TOKEN_SHARDS=str(args.sqlite_shards))
+    elif not env.get("DATABASE_URL"):
+        print("Skipping postgres: DATABASE_URL is not set")
+        return []
+
+    google_port, server_port = free_port(), free_port()
+    env["GOOGLE_API_BASE_URL"] = f"http://127.0.0.1:{google_port}"
+    env["GOOGLE_TOKEN_URL"] = f"http://127.0.0.1:{google_port}/token"
+    # The token functions run in this process against the same database
+    os.environ.update({key: env[key] for key in ("SQLITE_DB_PATH", "SQLITE_STORE_MODE", "SQLITE_TOKEN_SHARDS",
+                                                 "GOOGLE_API_BASE_URL", "GOOGLE_TOKEN_URL") if key in env})
+    os.environ.update(JOB_WORKERS="0", TOKEN_REFRESH_ENABLED="false", TOKEN_CACHE_SIZE="0")
+    if backend.startswith("sqlite"):
+        os.environ.pop("DATABASE_URL", None)
+    import mcp_server
+    if backend == "postgres" and not mcp_server.PSYCOPG2_AVAILABLE:
+        print("Skipping postgres: psycopg2 is not installed")
+        return []
+
+    users = [f"bench-{i}" for i in range(args.users)]
+    mcp_server.save_tokens_bulk((user, "google", {"access_token": f"ya29.{user}", "refresh_token": "r", "expires_in": 3600})
+                                for user in users)
+
+    quiet = subprocess.DEVNULL
+    google = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_google.py"), "--port", str(google_port),
+                               "--latency", str(args.google_latency)], env=env, stdout=quiet, stderr=quiet)
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, "serve.py"), "--host", "127.0.0.1", "--port", str(server_port),
+                               "--workers", str(args.workers), "--threads", str(args.threads)],
+                              env=env, stdout=quiet, stderr=quiet)
+    results = []
+    try:
+        wait_for(google_port, "/")
+        wait_for(server_port, "/health")
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                if scenario in HTTP_SCENARIOS:
+                    path, payload = HTTP_SCENARIOS[scenario]
+                    call = lambda index: post_json(server_port, path, payload(random.choice(users)))
+                    pids = process_tree(server.pid)
+                elif scenario == "get_token":
+                    call = lambda index: mcp_server.get_token(random.choice(users), "google") is not None
+                    pids = [os.getpid()]
+                else:
+                    call = lambda index: mcp_server.save_token(
+                        random.choice(users), "google", {"access_token": f"ya29.{time.time()}", "refresh_token": "r", "expires_in": 3600})
+                    pids = [os.getpid()]
+                run_load(call, concurrency, min(1.0, args.duration))  # warm up
+                latencies, errors, elapsed = run_load(call, concurrency, args.duration)
+                result = summarize(scenario, backend, concurrency, latencies, errors, elapsed, memory_kb(pids))
+                results.append(result)
+                print(format_result(result))
+    finally:
+        for process in (server, google):
+            process.terminate()
+        for process in (server, google):
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        mcp_server.reset_db_state()
+    return results
+
+
+def format_result(result):
+    return (f"{result['backend']:<10} {result['scenario']:<13} c={result['concurrency']:<4} "
+            f"{result['requests_per_second']:>9.1f} req/s  p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f}  "
+            f"p99 {result['p99_ms']:>8.2f} ms  errors {result['errors']:<5} rss {result['rss_mb']:>7.1f} MB")
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r["backend"], r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+    change = lambda new, old: f"{(new - old) / old * 100:+6.1f}%" if old else "   n/a"
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        old = baseline.get((result["backend"], result["scenario"], result["concurrency"]))
+        if old is None:
+            continue
+        print(f"{result['backend']:<10} {result['scenario']:<13} c={result['concurrency']:<4} "
+              f"req/s {change(result['requests_per_second'], old['requests_per_second'])}  "
+              f"p95 {change(result['p95_ms'], old['p95_ms'])}  p99 {change(result['p99_ms'], old['p99_ms'])}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", nargs="+", choices=("sqlite", "sqlite-wal", "postgres"), default=["sqlite"])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per scenario and concurrency level")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=2, help="serve.py worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="Threads per worker")
+    parser.add_argument("--sqlite-shards", type=int, default=1, help="SQLITE_TOKEN_SHARDS for the sqlite-wal backend")
+    parser.add_argument("--google-latency", type=float, default=0.0, help="Seconds the fake Google adds per call")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--child", nargs=2, metavar=("BACKEND", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        backend, output = args.child
+        with tempfile.TemporaryDirectory() as tmp:
+            results = bench_backend(backend, args, tmp)
+        with open(output, "w") as f:
+            json.dump(results, f)
+        return
+
+    # Each backend runs in its own interpreter, since mcp_server reads its
+    # database settings at import
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backend:
+            output = os.path.join(tmp, f"{backend}.json")
+            child_args = [arg for arg in sys.argv[1:]]
+            subprocess.run([sys.executable, os.path.abspath(__file__), *child_args, "--child", backend, output], check=True)
+            if os.path.exists(output):
+                with open(output) as f:
+                    results.extend(json.load(f))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "settings": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+                "results": results,
+            }, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for sending emails with attachments.
+
+Sends messages with growing attachments through send_gmail_message() against
+fake_google.py and reports the peak Python memory (tracemalloc) of each send,
+next to what building the same message in memory costs. The streaming path
+should stay flat while the in-memory one grows with the payload. The fake
+server runs in-process, so its request buffers are included in the peaks:
+
+    python bench_mime.py --sizes-mb 1 4 16 24 --json results.json
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_google import start_fake_google
+
+
+def write_attachment(path, size, block=1024 * 1024):
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(os.urandom(min(block, remaining)))
+            remaining -= block
+
+
+def measure(fn):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 4, 16, 24])
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    fake = start_fake_google()
+    # Keep nothing from uploads in the fake server so it doesn't skew the numbers
+    fake.app.config["UPLOAD_KEEP_BYTES"] = 0
+    os.environ["GOOGLE_API_BASE_URL"] = fake.url
+    os.environ["GOOGLE_TOKEN_URL"] = fake.url + "/token"
+    os.environ.setdefault("JOB_WORKERS", "0")
+    os.environ.setdefault("TOKEN_REFRESH_ENABLED", "false")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    import mcp_server
+    from mime_stream import Attachment
+
+    # Peak for a plain one-line email: the fixed cost of any send
+    _, baseline, _ = measure(lambda: mcp_server.send_gmail_message("bench", "ya29.bench", "bench@example.com", "Benchmark", "Hi"))
+    print(f"baseline (no attachment) peak={baseline / 1048576:.2f} MB")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in args.sizes_mb:
+            size = int(size_mb * 1024 * 1024)
+            path = os.path.join(tmp, f"attachment-{size}.bin")
+            write_attachment(path, size)
+
+            def streaming():
+                with open(path, "rb") as f:
+                    attachment = Attachment(os.path.basename(path), f, size=size)
+                    return mcp_server.send_gmail_message("bench", "ya29.bench", "bench@example.com", "Benchmark", "Hi", attachments=[attachment])
+
+            def in_memory():
+                # What the old single-string approach would need for the same message
+                with open(path, "rb") as f:
+                    content = base64.encodebytes(f.read())
+                message = b"To: bench@example.com\nSubject: Benchmark\n\nHi\n" + content
+                return len(base64.urlsafe_b64encode(message))
+
+            response, peak, elapsed = measure(streaming)
+            _, naive_peak, _ = measure(in_memory)
+            upload = fake.last_upload() or {}
+            results.append({
+                "attachment_bytes": size,
+                "message_bytes": upload.get("bytes"),
+                "upload_type": upload.get("type"),
+                "status": response.status_code,
+                "seconds": round(elapsed, 3),
+                "peak_bytes": peak,
+                "peak_over_baseline_bytes": peak - baseline,
+                "in_memory_peak_bytes": naive_peak,
+            })
+            print(
+                f"{size_mb:>7.1f} MB  {upload.get('type') or '-':<10} status={response.status_code} "
+                f"streaming peak={peak / 1048576:7.2f} MB  in-memory peak={naive_peak / 1048576:7.2f} MB  "
+                f"{elapsed:6.2f}s"
+            )
+    fake.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"chunk_size": mcp_server.GMAIL_UPLOAD_CHUNK_SIZE, "baseline_peak_bytes": baseline, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
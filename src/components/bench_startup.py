@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the MCP server.
+
+Starts fresh interpreters and measures, in each, how long importing
+mcp_server takes, the first request that doesn't touch the database
+(/health), the first one that does (/test-db, which includes the schema
+check), and a second one for comparison. Runs against a new SQLite file
+(schema gets created) and then an existing one (schema_version row is
+current, so the check is one query). Finally it times the imports that are
+deferred to first use, i.e. what every cold start used to pay up front:
+
+    python bench_startup.py --runs 5 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def child():
+    """Measure one cold start; prints a JSON line."""
+    timings = {}
+    start = time.perf_counter()
+    import mcp_server
+    timings["import"] = time.perf_counter() - start
+    client = mcp_server.create_app().test_client()
+    for name, path in (("first_request", "/health"), ("first_db_request", "/test-db"), ("second_db_request", "/test-db")):
+        start = time.perf_counter()
+        status = client.get(path).status_code
+        timings[name] = time.perf_counter() - start
+        if status != 200:
+            raise SystemExit(f"{path} returned {status}")
+    loaded = sorted(name for name in ("requests", "oauthlib", "psycopg2", "dotenv") if name in sys.modules)
+    start = time.perf_counter()
+    import requests  # noqa: F401
+    import oauthlib.oauth2  # noqa: F401
+    timings["deferred_imports"] = time.perf_counter() - start
+    mcp_server.stop_background(timeout=1)
+    print(json.dumps({"seconds": timings, "loaded_at_startup": loaded}))
+
+
+def run_child(env):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child"],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    keys = samples[0]["seconds"].keys()
+    return {key: {"median_ms": round(statistics.median(s["seconds"][key] for s in samples) * 1000, 2),
+                  "max_ms": round(max(s["seconds"][key] for s in samples) * 1000, 2)} for key in keys}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, JOB_WORKERS="0", TOKEN_REFRESH_ENABLED="false")
+        env.pop("DATABASE_URL", None)
+        # Compile bytecode (and create the "existing" database) first so the
+        # runs measure imports, not compilation
+        run_child(dict(env, SQLITE_DB_PATH=os.path.join(tmp, "existing.db")))
+        for label in ("new_database", "existing_database"):
+            samples = []
+            for run in range(args.runs):
+                path = os.path.join(tmp, f"{label}-{run}.db" if label == "new_database" else "existing.db")
+                samples.append(run_child(dict(env, SQLITE_DB_PATH=path)))
+            results[label] = summarize(samples)
+            results[label]["loaded_at_startup"] = samples[-1]["loaded_at_startup"]
+
+    for label, summary in results.items():
+        print(label)
+        for key, value in summary.items():
+            if key != "loaded_at_startup":
+                print(f"  {key:<20} median {value['median_ms']:8.2f} ms   max {value['max_ms']:8.2f} ms")
+        print(f"  heavy modules loaded at startup: {', '.join(summary['loaded_at_startup']) or 'none'}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"runs": args.runs, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Circuit breaker used to pick the token store backend.
+
+After `failure_threshold` consecutive connection failures the breaker opens
+and callers go straight to the fallback backend. A background thread then
+probes the primary backend with exponential backoff and closes the breaker
+again once a probe succeeds, so no request ever waits on a dead backend.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Tracks the health of one backend: closed -> open -> half_open -> closed."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, probe, failure_threshold=3, backoff_initial=1.0, backoff_max=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self._probe = probe
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._state = self.CLOSED
+        self._failures = 0
+        self._backoff = backoff_initial
+        self._opened_at = None
+        self._next_probe_at = None
+        self._last_error = None
+        self._transitions = collections.Counter()
+        self._stats = collections.Counter()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow(self):
+        """Return True if requests may use the backend right now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            self._stats["short_circuited"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._last_error = str(error) if error is not None else None
+            if self._state != self.CLOSED:
+                return
+            self._failures += 1
+            self._stats["failures"] += 1
+            if self._failures < self.failure_threshold:
+                return
+            self._transition(self.OPEN)
+            self._opened_at = time.time()
+            self._backoff = self.backoff_initial
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._probe_loop, name=f"{self.name}-breaker-probe", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        """Stop the background probe thread (used on shutdown)."""
+        self._stop.set()
+
+    def reset(self):
+        """Close the breaker and drop the probe thread (e.g. state inherited across fork)."""
+        self._stop.set()
+        with self._lock:
+            self._stop = threading.Event()
+            self._thread = None
+            self._state = self.CLOSED
+            self._failures = 0
+            self._backoff = self.backoff_initial
+            self._opened_at = None
+            self._next_probe_at = None
+
+    def stats(self):
+        with self._lock:
+            next_probe_in = None
+            if self._next_probe_at is not None and self._state == self.OPEN:
+                next_probe_in = round(max(0.0, self._next_probe_at - time.monotonic()), 3)
+            return {
+                "name": self.name,
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "opened_at": self._opened_at,
+                "backoff_seconds": self._backoff if self._state != self.CLOSED else None,
+                "next_probe_in": next_probe_in,
+                "last_error": self._last_error,
+                "failures": self._stats["failures"],
+                "short_circuited": self._stats["short_circuited"],
+                "probes": self._stats["probes"],
+                "probe_failures": self._stats["probe_failures"],
+                "transitions": dict(self._transitions),
+            }
+
+    def _transition(self, new_state):
+        # Caller holds the lock
+        old_state = self._state
+        if old_state == new_state:
+            return
+        self._state = new_state
+        self._transitions[f"{old_state}->{new_state}"] += 1
+        logger.warning("Circuit breaker '%s': %s -> %s", self.name, old_state, new_state)
+
+    def _probe_loop(self):
+        # reset() swaps in a new event; this thread keeps watching the one it started with
+        stop = self._stop
+        while True:
+            with self._lock:
+                delay = self._backoff
+                self._next_probe_at = time.monotonic() + delay
+            if stop.wait(delay):
+                return
+            with self._lock:
+                self._transition(self.HALF_OPEN)
+                self._stats["probes"] += 1
+            try:
+                self._probe()
+                error = None
+            except Exception as e:
+                error = e
+            with self._lock:
+                if error is None:
+                    self._transition(self.CLOSED)
+                    self._failures = 0
+                    self._opened_at = None
+                    self._next_probe_at = None
+                    self._thread = None
+                    return
+                self._stats["probe_failures"] += 1
+                self._last_error = str(error)
+                self._transition(self.OPEN)
+                self._backoff = min(self._backoff * 2, self.backoff_max)
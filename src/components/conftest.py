@@ -0,0 +1,79 @@
+"""
+Shared setup for the server tests.
+
+mcp_server reads its configuration at import time, so the fake Google and
+OpenRouter servers are started and the environment is pointed at them (and
+at a throwaway SQLite database) before any test module imports it.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_google import start_fake_google
+from fake_openrouter import start_fake_openrouter
+
+fake_google_server = start_fake_google()
+fake_openrouter_server = start_fake_openrouter()
+test_dir = tempfile.mkdtemp(prefix="mcp-test-")
+
+os.environ.pop("DATABASE_URL", None)
+os.environ.update({
+    "SQLITE_DB_PATH": os.path.join(test_dir, "tokens.db"),
+    "GOOGLE_CLIENT_ID": "test-client",
+    "GOOGLE_CLIENT_SECRET": "test-secret",
+    "GOOGLE_TOKEN_URL": f"{fake_google_server.url}/token",
+    "GOOGLE_API_BASE_URL": fake_google_server.url,
+    "OPENROUTER_API_KEY": "test-key",
+    "OPENROUTER_API_URL": f"{fake_openrouter_server.url}/api/v1",
+    "UPSTREAM_BACKOFF_FACTOR": "0",
+    "RATE_LIMIT_ENABLED": "false",
+    # Background work is started by the tests that need it
+    "TOKEN_REFRESH_ENABLED": "false",
+    "JOB_WORKERS": "0",
+})
+
+
+@pytest.fixture
+def fake_google():
+    app = fake_google_server.app
+    app.config.update(
+        LATENCY=0.0, THROTTLE_NEXT=0, RETRY_AFTER=1, FAIL_NEXT=0, UPLOAD_DROP_NEXT=0, UPLOAD_SHORT_NEXT=0,
+        REQUEST_COUNTS={}, LAST_UPLOAD=None,
+    )
+    yield fake_google_server
+
+
+@pytest.fixture
+def fake_openrouter():
+    app = fake_openrouter_server.app
+    app.config.update(FIRST_TOKEN_DELAY=0.0, TOKEN_DELAY=0.0, FAIL_NEXT=0, TRUNCATE_NEXT=0, MALFORMED_NEXT=0, REQUEST_COUNTS={})
+    yield fake_openrouter_server
+
+
+@pytest.fixture
+def server():
+    import mcp_server
+    return mcp_server
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+# A stored Google token for `user_id` that the fake accepts
+@pytest.fixture
+def google_user(server):
+    user_id = "test-user"
+    server.save_token(user_id, "google", {
+        "access_token": "ya29.test",
+        "refresh_token": "1//test-refresh",
+        "expires_in": 3600,
+        "token_type": "Bearer",
+    })
+    return user_id
@@ -0,0 +1,287 @@
+"""
+Connection pooling for the MCP server token store.
+
+PostgreSQL connections live in a bounded, thread-safe pool so requests reuse
+an already authenticated connection instead of paying a TCP + auth handshake
+per call. SQLite connections are kept open per thread, because a sqlite3
+connection may only be used from the thread that created it.
+"""
+
+import collections
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available before the timeout."""
+
+
+class PooledConnection:
+    """Proxy around a DB-API connection; close() hands it back to its pool."""
+
+    def __init__(self, pool, raw, backend):
+        self._pool = pool
+        self._released = False
+        self.raw = raw
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self.raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Bounded pool with checkout timeout, liveness checks and idle recycling."""
+
+    def __init__(self, connect, backend="postgres", min_size=1, max_size=10,
+                 timeout=5.0, max_idle=300.0, max_lifetime=3600.0, ping_after=30.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self._connect = connect
+        self.backend = backend
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+
+        # Idle entries are (raw, created_at, last_used); checkout pops from the
+        # right so the most recently used (warmest) connection is reused first.
+        self._idle = collections.deque()
+        self._created_at = {}
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = collections.Counter()
+
+    def fill(self):
+        """Open connections until the pool holds min_size of them."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                raw = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            now = time.monotonic()
+            with self._cond:
+                self._stats["created"] += 1
+                self._idle.append((raw, now, now))
+                self._cond.notify()
+
+    def getconn(self):
+        """Check out a connection, waiting up to `timeout` seconds for one."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            raw, created_at, last_used = self._checkout(deadline)
+            now = time.monotonic()
+            if raw is None:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._stats["connect_errors"] += 1
+                        self._cond.notify()
+                    raise
+                created_at = now
+                with self._cond:
+                    self._stats["created"] += 1
+            elif now - last_used >= self.ping_after and not self._is_alive(raw):
+                with self._cond:
+                    self._stats["liveness_failures"] += 1
+                self._discard(raw)
+                continue
+            with self._cond:
+                self._created_at[id(raw)] = created_at
+                self._stats["checkouts"] += 1
+            return PooledConnection(self, raw, self.backend)
+
+    def release(self, raw):
+        """Return a checked-out connection, discarding it if it is unusable."""
+        now = time.monotonic()
+        healthy = not getattr(raw, "closed", False)
+        if healthy:
+            try:
+                # Never hand the next caller a connection mid-transaction
+                raw.rollback()
+            except Exception:
+                healthy = False
+        with self._cond:
+            created_at = self._created_at.pop(id(raw), now)
+            expired = now - created_at >= self.max_lifetime
+            if healthy and not expired and not self._closed:
+                self._idle.append((raw, created_at, now))
+                self._cond.notify()
+                return
+            if expired:
+                self._stats["recycled"] += 1
+        self._discard(raw)
+
+    def closeall(self):
+        """Close every idle connection and refuse to pool returned ones."""
+        with self._cond:
+            self._closed = True
+            idle = [entry[0] for entry in self._idle]
+            self._idle.clear()
+        for raw in idle:
+            self._discard(raw)
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "backend": self.backend,
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": self._stats["checkouts"],
+                "waits": self._stats["waits"],
+                "timeouts": self._stats["timeouts"],
+                "created": self._stats["created"],
+                "closed": self._stats["closed"],
+                "recycled": self._stats["recycled"],
+                "liveness_failures": self._stats["liveness_failures"],
+                "connect_errors": self._stats["connect_errors"],
+            }
+
+    def _checkout(self, deadline):
+        # Returns an idle entry, or (None, None, None) once a slot has been
+        # reserved for a new connection that the caller must open.
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("connection pool is closed")
+                expired = self._expire_idle_locked()
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    entry = (None, None, None)
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"no connection available within {self.timeout}s "
+                        f"(max_size={self.max_size})"
+                    )
+                self._stats["waits"] += 1
+                self._cond.wait(remaining)
+        for raw in expired:
+            self._close_raw(raw)
+        return entry
+
+    def _expire_idle_locked(self):
+        # Drop connections that sat idle past max_idle (down to min_size) or
+        # outlived max_lifetime; the oldest idle entries are on the left.
+        now = time.monotonic()
+        expired = []
+        while self._idle:
+            raw, created_at, last_used = self._idle[0]
+            too_idle = now - last_used >= self.max_idle and self._size > self.min_size
+            too_old = now - created_at >= self.max_lifetime
+            if not (too_idle or too_old):
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self._stats["recycled"] += 1
+            self._stats["closed"] += 1
+            expired.append(raw)
+        return expired
+
+    def _is_alive(self, raw):
+        if getattr(raw, "closed", False):
+            return False
+        try:
+            cursor = raw.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            raw.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, raw):
+        with self._cond:
+            self._size -= 1
+            self._stats["closed"] += 1
+            self._cond.notify()
+        self._close_raw(raw)
+
+    @staticmethod
+    def _close_raw(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+
+class ThreadLocalConnections:
+    """One persistent connection per thread, reused across calls."""
+
+    def __init__(self, connect, backend="sqlite"):
+        self._connect = connect
+        self.backend = backend
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def getconn(self):
+        raw = getattr(self._local, "conn", None)
+        if raw is None:
+            raw = self._connect()
+            self._local.conn = raw
+            with self._lock:
+                self._stats["created"] += 1
+        with self._lock:
+            self._stats["checkouts"] += 1
+        return PooledConnection(self, raw, self.backend)
+
+    def release(self, raw):
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+        except Exception:
+            # The connection is unusable; let this thread open a fresh one
+            self._local.conn = None
+            with self._lock:
+                self._stats["closed"] += 1
+            try:
+                raw.close()
+            except Exception:
+                pass
+
+    def closeall(self):
+        raw = getattr(self._local, "conn", None)
+        if raw is not None:
+            self._local.conn = None
+            raw.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "created": self._stats["created"],
+                "closed": self._stats["closed"],
+                "checkouts": self._stats["checkouts"],
+            }
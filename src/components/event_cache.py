@@ -0,0 +1,274 @@
+"""
+Per-user cache of Google Calendar events kept current with incremental sync.
+
+The first read of a user's calendar pages through events.list and keeps the
+nextSyncToken from the last page; later reads send that token and only get
+the events that changed since (cancelled ones are dropped). Pages are
+fetched and applied one at a time, so a large calendar never has to be held
+as one response. If Google expires the token (410 Gone) the cache is thrown
+away and rebuilt with a full sync.
+
+Window queries (list and free/busy) go through an IntervalIndex over the
+cached events, rebuilt lazily after a sync changed something.
+"""
+
+import bisect
+import collections
+import datetime
+import threading
+import time
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+
+class CalendarSyncError(Exception):
+    """Google refused an events.list call."""
+
+    def __init__(self, status, details):
+        self.status = status
+        self.details = details
+        super().__init__(f"Calendar sync failed with {status}: {details}")
+
+
+def parse_time(value, time_zone=None):
+    """Epoch seconds for an RFC 3339 timestamp or a YYYY-MM-DD date (None if unparseable)."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        tz = datetime.timezone.utc
+        if time_zone and ZoneInfo is not None:
+            try:
+                tz = ZoneInfo(time_zone)
+            except Exception:
+                pass
+        parsed = parsed.replace(tzinfo=tz)
+    return parsed.timestamp()
+
+
+def format_time(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def event_span(event):
+    """(start, end) epoch seconds of an event, or None for events without usable times."""
+    start, end = event.get("start") or {}, event.get("end") or {}
+    begin = parse_time(start.get("dateTime") or start.get("date"), start.get("timeZone"))
+    finish = parse_time(end.get("dateTime") or end.get("date"), end.get("timeZone"))
+    if begin is None:
+        return None
+    if finish is None or finish < begin:
+        finish = begin
+    return begin, finish
+
+
+class IntervalIndex:
+    """
+    Static overlap index over (start, end, item) triples.
+
+    Intervals are sorted by start and covered by a max-end segment tree, so an
+    overlap query walks only the subtrees that can contain a match:
+    O(log n + k) for k results instead of a scan of every interval.
+    """
+
+    def __init__(self, intervals):
+        self._intervals = sorted(intervals, key=lambda interval: interval[0])
+        self._starts = [interval[0] for interval in self._intervals]
+        size = 1
+        while size < len(self._intervals):
+            size *= 2
+        self._size = size
+        self._max_end = [float("-inf")] * (2 * size)
+        for i, interval in enumerate(self._intervals):
+            self._max_end[size + i] = interval[1]
+        for node in range(size - 1, 0, -1):
+            self._max_end[node] = max(self._max_end[2 * node], self._max_end[2 * node + 1])
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def overlapping(self, start, end):
+        """Intervals with start < `end` and end > `start`, in start order.
+
+        Zero-length intervals (instants) match when they fall inside the window.
+        """
+        # Only intervals starting before the window ends can overlap it
+        limit = bisect.bisect_left(self._starts, end)
+        results = []
+        stack = [(1, 0, self._size)]
+        while stack:
+            node, low, high = stack.pop()
+            if low >= limit or self._max_end[node] < start:
+                continue
+            if high - low == 1:
+                interval = self._intervals[low]
+                if interval[1] > start or (interval[0] == interval[1] and interval[0] >= start):
+                    results.append(interval)
+                continue
+            middle = (low + high) // 2
+            # Right child first so the left one is popped (and emitted) first
+            stack.append((2 * node + 1, middle, high))
+            stack.append((2 * node, low, middle))
+        return results
+
+
+def merge_busy(intervals, window_start, window_end):
+    """Merge overlapping intervals, clipped to the window."""
+    busy = []
+    for start, end, _ in intervals:
+        start, end = max(start, window_start), min(end, window_end)
+        if end <= start:
+            continue
+        if busy and start <= busy[-1][1]:
+            busy[-1][1] = max(busy[-1][1], end)
+        else:
+            busy.append([start, end])
+    return busy
+
+
+class _CalendarState:
+    __slots__ = ("events", "sync_token", "index", "synced_at", "lock")
+
+    def __init__(self):
+        self.events = {}
+        self.sync_token = None
+        self.index = None
+        self.synced_at = 0.0
+        self.lock = threading.Lock()
+
+
+class EventCache:
+    """Users' calendars, each synced incrementally and indexed by time."""
+
+    def __init__(self, fetch_page, max_users=1000, min_sync_interval=10.0, max_pages=100):
+        # fetch_page(user_id, access_token, sync_token, page_token) -> (status, body)
+        self._fetch_page = fetch_page
+        self.max_users = max_users
+        self.min_sync_interval = min_sync_interval
+        self.max_pages = max_pages
+        self._calendars = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def sync(self, user_id, access_token, force=False):
+        """Bring the user's cache up to date; returns what the sync did."""
+        state = self._state(user_id)
+        with state.lock:
+            if not force and state.sync_token and time.monotonic() - state.synced_at < self.min_sync_interval:
+                return {"mode": "cached", "pages": 0, "changes": 0}
+            try:
+                result = self._sync(user_id, access_token, state)
+            except CalendarSyncError as e:
+                if e.status != 410:
+                    raise
+                # Sync token expired: start over with a full sync
+                state.events.clear()
+                state.sync_token = None
+                state.index = None
+                with self._lock:
+                    self._stats["token_expired"] += 1
+                result = self._sync(user_id, access_token, state)
+            state.synced_at = time.monotonic()
+        with self._lock:
+            self._stats[f"{result['mode']}_syncs"] += 1
+            self._stats["pages"] += result["pages"]
+            self._stats["changes"] += result["changes"]
+        return result
+
+    def list_events(self, user_id, time_min=None, time_max=None):
+        """Cached events overlapping [time_min, time_max), in start order."""
+        index = self._index(user_id)
+        start = time_min if time_min is not None else float("-inf")
+        end = time_max if time_max is not None else float("inf")
+        return [event for _, _, event in index.overlapping(start, end)]
+
+    def free_busy(self, user_id, time_min, time_max):
+        """Merged busy periods in the window; transparent ("free") events are ignored."""
+        index = self._index(user_id)
+        busy = [interval for interval in index.overlapping(time_min, time_max)
+                if interval[2].get("transparency") != "transparent"]
+        return merge_busy(busy, time_min, time_max)
+
+    def mark_stale(self, user_id):
+        """Make the next read sync even inside min_sync_interval (after a local write)."""
+        with self._lock:
+            state = self._calendars.get(user_id)
+        if state is not None:
+            state.synced_at = 0.0
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._calendars.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["users"] = len(self._calendars)
+            stats["events"] = sum(len(state.events) for state in self._calendars.values())
+            return stats
+
+    def _state(self, user_id):
+        with self._lock:
+            state = self._calendars.get(user_id)
+            if state is None:
+                state = self._calendars[user_id] = _CalendarState()
+                while len(self._calendars) > self.max_users:
+                    self._calendars.popitem(last=False)
+            else:
+                self._calendars.move_to_end(user_id)
+            return state
+
+    def _sync(self, user_id, access_token, state):
+        mode = "incremental" if state.sync_token else "full"
+        page_token = None
+        pages = changes = 0
+        try:
+            while True:
+                status, body = self._fetch_page(user_id, access_token, state.sync_token, page_token)
+                if status != 200:
+                    raise CalendarSyncError(status, body)
+                pages += 1
+                # Apply each page as it arrives rather than collecting the whole listing
+                for event in body.get("items") or []:
+                    if not event.get("id"):
+                        continue
+                    changes += 1
+                    state.index = None
+                    if event.get("status") == "cancelled":
+                        state.events.pop(event["id"], None)
+                    else:
+                        state.events[event["id"]] = event
+                page_token = body.get("nextPageToken")
+                if not page_token:
+                    if body.get("nextSyncToken"):
+                        state.sync_token = body["nextSyncToken"]
+                    break
+                if pages >= self.max_pages:
+                    raise CalendarSyncError(502, f"Calendar listing exceeded {self.max_pages} pages")
+        except Exception:
+            if mode == "full":
+                # A partial full sync can't tell which events were deleted; drop it
+                state.events.clear()
+                state.index = None
+            raise
+        return {"mode": mode, "pages": pages, "changes": changes}
+
+    def _index(self, user_id):
+        state = self._state(user_id)
+        with state.lock:
+            if state.index is None:
+                intervals = []
+                for event in state.events.values():
+                    span = event_span(event)
+                    if span is not None:
+                        intervals.append((span[0], span[1], event))
+                state.index = IntervalIndex(intervals)
+                with self._lock:
+                    self._stats["index_builds"] += 1
+            return state.index
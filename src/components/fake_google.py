@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Google endpoints used by the MCP server.
+
+Point the server at it with GOOGLE_TOKEN_URL=<url>/token and
+GOOGLE_API_BASE_URL=<url> to exercise the OAuth flows and tool calls without
+network access:
+
+    python fake_google.py --port 5055
+
+or start it in-process from a test or benchmark with start_fake_google().
+"""
+
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import urllib.parse
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, redirect, request
+from werkzeug.serving import make_server
+
+from google_batch import decode_http_request, decode_multipart, encode_http_response, encode_multipart, new_boundary
+
+
+def create_app(expires_in=3600, latency=0.0):
+    app = Flask(__name__)
+    app.config["EXPIRES_IN"] = expires_in
+    # Seconds every API call sleeps, to simulate a slow upstream
+    app.config["LATENCY"] = latency
+    # Number of upcoming API calls answered with 429 + Retry-After
+    app.config["THROTTLE_NEXT"] = 0
+    app.config["RETRY_AFTER"] = 1
+    # Number of upcoming API calls that fail with FAIL_STATUS
+    app.config["FAIL_NEXT"] = 0
+    app.config["FAIL_STATUS"] = 503
+    app.config["REQUEST_COUNTS"] = {}
+    # Uploaded messages up to this size are kept whole in LAST_UPLOAD["message"]
+    app.config["UPLOAD_KEEP_BYTES"] = 2 * 1024 * 1024
+    app.config["LAST_UPLOAD"] = None
+    # Number of upcoming resumable chunks that are acknowledged (308) but not
+    # persisted, and that are only half persisted
+    app.config["UPLOAD_DROP_NEXT"] = 0
+    app.config["UPLOAD_SHORT_NEXT"] = 0
+    uploads = {}
+    # The fake account's primary calendar: id -> event, with a change sequence
+    # number per event so syncTokens can list what changed since
+    app.config["SYNC_TOKEN_MIN"] = 0
+    calendar = {}
+    calendar_lock = threading.Lock()
+    change_seq = itertools.count(1)
+    counts_lock = threading.Lock()
+    token_seq = itertools.count(1)
+
+    def count(name):
+        with counts_lock:
+            counts = app.config["REQUEST_COUNTS"]
+            counts[name] = counts.get(name, 0) + 1
+
+    def take(name):
+        with counts_lock:
+            if app.config[name] > 0:
+                app.config[name] -= 1
+                return True
+            return False
+
+    # OAuth consent screen: approves immediately and redirects back with a code.
+    # Point GOOGLE_AUTH_URL at <url>/o/oauth2/auth to use it.
+    @app.route("/o/oauth2/auth")
+    def auth():
+        count("auth")
+        redirect_uri = request.args.get("redirect_uri")
+        if not redirect_uri or request.args.get("response_type") != "code":
+            return jsonify({"error": "invalid_request"}), 400
+        # The code carries the PKCE challenge so /token can check the verifier
+        code = f"fake-code-{uuid.uuid4().hex}"
+        if request.args.get("code_challenge_method") == "S256":
+            code += f".{request.args.get('code_challenge', '')}"
+        params = {"code": code, "state": request.args.get("state", "")}
+        return redirect(f"{redirect_uri}?{urllib.parse.urlencode(params)}")
+
+    # OAuth token endpoint: authorization_code and refresh_token grants
+    @app.route("/token", methods=["POST"])
+    def token():
+        grant_type = request.form.get("grant_type")
+        count(f"token:{grant_type}")
+        if grant_type == "authorization_code":
+            code = request.form.get("code")
+            if not code:
+                return jsonify({"error": "invalid_request"}), 400
+            if "." in code:
+                verifier = request.form.get("code_verifier", "")
+                challenge = base64.urlsafe_b64encode(hashlib.sha256(verifier.encode()).digest()).rstrip(b"=").decode()
+                if challenge != code.split(".", 1)[1]:
+                    return jsonify({"error": "invalid_grant", "error_description": "Invalid code verifier."}), 400
+            return jsonify({
+                "access_token": f"ya29.fake-{next(token_seq)}",
+                "refresh_token": f"1//fake-refresh-{uuid.uuid4().hex}",
+                "expires_in": app.config["EXPIRES_IN"],
+                "token_type": "Bearer",
+                "scope": "https://www.googleapis.com/auth/gmail.send https://www.googleapis.com/auth/calendar.events",
+            })
+        if grant_type == "refresh_token":
+            if not request.form.get("refresh_token", "").startswith("1//"):
+                return jsonify({"error": "invalid_grant"}), 400
+            return jsonify({
+                "access_token": f"ya29.fake-{next(token_seq)}",
+                "expires_in": app.config["EXPIRES_IN"],
+                "token_type": "Bearer",
+            })
+        return jsonify({"error": "unsupported_grant_type"}), 400
+
+    def authorized():
+        return request.headers.get("Authorization", "").startswith("Bearer ya29.")
+
+    @app.before_request
+    def simulate_latency():
+        if request.path.startswith("/_") or request.path == "/token":
+            return None
+        if app.config["LATENCY"]:
+            time.sleep(app.config["LATENCY"])
+        with counts_lock:
+            throttle = app.config["THROTTLE_NEXT"] > 0
+            if throttle:
+                app.config["THROTTLE_NEXT"] -= 1
+        if throttle:
+            count("throttled")
+            response = jsonify({"error": {"code": 429, "message": "Rate Limit Exceeded"}})
+            response.headers["Retry-After"] = str(app.config["RETRY_AFTER"])
+            return response, 429
+        if take("FAIL_NEXT"):
+            count("failed")
+            status = app.config["FAIL_STATUS"]
+            return jsonify({"error": {"code": status, "message": "Backend Error"}}), status
+        return None
+
+    # Gmail: users.messages.send
+    @app.route("/gmail/v1/users/me/messages/send", methods=["POST"])
+    def gmail_send():
+        count("gmail.send")
+        if not authorized():
+            return jsonify({"error": {"code": 401, "message": "Invalid Credentials"}}), 401
+        if not (request.get_json(silent=True) or {}).get("raw"):
+            return jsonify({"error": {"code": 400, "message": "'raw' RFC822 payload message string required"}}), 400
+        return jsonify(sent_message())
+
+    def sent_message():
+        return {"id": uuid.uuid4().hex[:16], "threadId": uuid.uuid4().hex[:16], "labelIds": ["SENT"]}
+
+    def new_upload(upload_type):
+        return {"type": upload_type, "bytes": 0, "sha256": hashlib.sha256(), "kept": bytearray()}
+
+    def add_to_upload(upload, data):
+        upload["bytes"] += len(data)
+        upload["sha256"].update(data)
+        if upload["kept"] is not None:
+            if len(upload["kept"]) + len(data) <= app.config["UPLOAD_KEEP_BYTES"]:
+                upload["kept"] += data
+            else:
+                upload["kept"] = None
+
+    def finish_upload(upload):
+        kept = upload["kept"]
+        app.config["LAST_UPLOAD"] = {
+            "type": upload["type"],
+            "bytes": upload["bytes"],
+            "sha256": upload["sha256"].hexdigest(),
+            "message": bytes(kept) if kept is not None else None,
+        }
+        return jsonify(sent_message())
+
+    # Gmail: users.messages.send through the media upload endpoint. The body
+    # is read in small pieces so large uploads don't sit in memory.
+    @app.route("/upload/gmail/v1/users/me/messages/send", methods=["POST", "PUT"])
+    def gmail_upload():
+        if not authorized():
+            return jsonify({"error": {"code": 401, "message": "Invalid Credentials"}}), 401
+        upload_type = request.args.get("uploadType")
+        if request.method == "POST" and upload_type == "multipart":
+            count("gmail.upload")
+            upload = new_upload("multipart")
+            boundary = request.mimetype_params.get("boundary", "")
+            # Keep the last bytes around to check the closing delimiter
+            tail = b""
+            while True:
+                data = request.stream.read(64 * 1024)
+                if not data:
+                    break
+                add_to_upload(upload, data)
+                tail = (tail + data)[-(len(boundary) + 8):]
+            if not boundary or not tail.rstrip().endswith(f"--{boundary}--".encode()):
+                return jsonify({"error": {"code": 400, "message": "Malformed multipart body"}}), 400
+            return finish_upload(upload)
+        if request.method == "POST" and upload_type == "resumable":
+            count("gmail.upload")
+            upload_id = uuid.uuid4().hex
+            uploads[upload_id] = new_upload("resumable")
+            response = jsonify({})
+            response.headers["Location"] = f"{request.base_url}?uploadType=resumable&upload_id={upload_id}"
+            return response
+        if request.method == "PUT" and request.args.get("upload_id") in uploads:
+            count("gmail.upload_chunk")
+            upload_id = request.args["upload_id"]
+            upload = uploads[upload_id]
+            # Content-Range: bytes <first>-<last>/<total or *>, or bytes */<total>
+            span, _, total = request.headers.get("Content-Range", "").replace("bytes ", "").partition("/")
+            data = request.get_data()
+            if span != "*":
+                first = int(span.split("-")[0])
+                if first != upload["bytes"] or take("UPLOAD_DROP_NEXT"):
+                    data = b""
+                elif take("UPLOAD_SHORT_NEXT"):
+                    data = data[:len(data) // 2]
+                add_to_upload(upload, data)
+            if total != "*" and upload["bytes"] == int(total):
+                del uploads[upload_id]
+                return finish_upload(upload)
+            response = Response(status=308)
+            # Like Google, no Range until some bytes are persisted
+            if upload["bytes"]:
+                response.headers["Range"] = f"bytes=0-{upload['bytes'] - 1}"
+            return response
+        return jsonify({"error": {"code": 400, "message": "Unsupported upload request"}}), 400
+
+    def store_event(event):
+        with calendar_lock:
+            seq = next(change_seq)
+            event["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+            calendar[event["id"]] = (seq, event)
+        return event
+
+    def insert_event(event):
+        event = dict(event)
+        event.update({"kind": "calendar#event", "id": uuid.uuid4().hex, "status": "confirmed"})
+        return store_event(event)
+
+    # Calendar: events.list, with pageToken paging and syncToken incremental sync
+    @app.route("/calendar/v3/calendars/primary/events", methods=["GET"])
+    def calendar_list():
+        count("calendar.list")
+        if not authorized():
+            return jsonify({"error": {"code": 401, "message": "Invalid Credentials"}}), 401
+        max_results = min(int(request.args.get("maxResults", 250)), 2500)
+        sync_token = request.args.get("syncToken")
+        page_token = request.args.get("pageToken")
+        if page_token:
+            # pageToken = "<offset>:<since>:<snapshot>"
+            offset, since, snapshot = (int(part) for part in page_token.split(":"))
+        else:
+            offset = 0
+            with calendar_lock:
+                snapshot = max((seq for seq, _ in calendar.values()), default=0)
+            if sync_token:
+                if not sync_token.isdigit() or int(sync_token) < app.config["SYNC_TOKEN_MIN"]:
+                    return jsonify({"error": {"code": 410, "message": "Sync token is no longer valid, a full sync is required."}}), 410
+                since = int(sync_token)
+            else:
+                since = 0
+        with calendar_lock:
+            changed = sorted(
+                (seq, event) for seq, event in calendar.values()
+                if since < seq <= snapshot and (since or event.get("status") != "cancelled")
+            )
+        page = [event for _, event in changed[offset:offset + max_results]]
+        body = {"kind": "calendar#events", "items": page}
+        if offset + max_results < len(changed):
+            body["nextPageToken"] = f"{offset + max_results}:{since}:{snapshot}"
+        else:
+            body["nextSyncToken"] = str(snapshot)
+        return jsonify(body)
+
+    # Calendar: events.delete (the event stays visible to syncs as cancelled)
+    @app.route("/calendar/v3/calendars/primary/events/<event_id>", methods=["DELETE"])
+    def calendar_delete(event_id):
+        count("calendar.delete")
+        if not authorized():
+            return jsonify({"error": {"code": 401, "message": "Invalid Credentials"}}), 401
+        with calendar_lock:
+            entry = calendar.get(event_id)
+        if entry is None or entry[1].get("status") == "cancelled":
+            return jsonify({"error": {"code": 410, "message": "Resource has been deleted"}}), 410
+        store_event({"kind": "calendar#event", "id": event_id, "status": "cancelled"})
+        return Response(status=204)
+
+    # Calendar: events.insert
+    @app.route("/calendar/v3/calendars/primary/events", methods=["POST"])
+    def calendar_insert():
+        count("calendar.insert")
+        if not authorized():
+            return jsonify({"error": {"code": 401, "message": "Invalid Credentials"}}), 401
+        return jsonify(insert_event(request.get_json(silent=True) or {}))
+
+    # Calendar batch endpoint (multipart/mixed of embedded HTTP requests)
+    @app.route("/batch/calendar/v3", methods=["POST"])
+    def calendar_batch():
+        count("calendar.batch")
+        if not authorized():
+            return jsonify({"error": {"code": 401, "message": "Invalid Credentials"}}), 401
+        try:
+            parts = decode_multipart(request.get_data(), request.content_type)
+        except ValueError as e:
+            return jsonify({"error": {"code": 400, "message": str(e)}}), 400
+        if len(parts) > 50:
+            return jsonify({"error": {"code": 400, "message": "Too many requests in batch"}}), 400
+        responses = []
+        for headers, payload in parts:
+            content_id = headers.get("content-id", "").strip("<>")
+            method, path, _, body = decode_http_request(payload)
+            if method == "POST" and path.split("?")[0] == "/calendar/v3/calendars/primary/events":
+                event = json.loads(body) if body.strip() else {}
+                if event.get("summary") == "fail":
+                    http = encode_http_response(400, "Bad Request", {"error": {"code": 400, "message": "Bad Request"}})
+                else:
+                    count("calendar.insert")
+                    http = encode_http_response(200, "OK", insert_event(event))
+            else:
+                http = encode_http_response(404, "Not Found", {"error": {"code": 404, "message": "Not Found"}})
+            responses.append(({"Content-Type": "application/http", "Content-ID": f"<response-{content_id}>"}, http))
+        boundary = new_boundary()
+        return Response(encode_multipart(responses, boundary), content_type=f"multipart/mixed; boundary={boundary}")
+
+    @app.route("/_stats")
+    def stats():
+        with counts_lock:
+            return jsonify(dict(app.config["REQUEST_COUNTS"]))
+
+    return app
+
+
+class FakeGoogleServer:
+    """Runs the fake Google app on a background thread."""
+
+    def __init__(self, host="127.0.0.1", port=0, **app_options):
+        self.app = create_app(**app_options)
+        self._server = make_server(host, port, self.app, threaded=True)
+        self.url = f"http://{host}:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def request_counts(self):
+        return dict(self.app.config["REQUEST_COUNTS"])
+
+    def last_upload(self):
+        return self.app.config["LAST_UPLOAD"]
+
+
+def start_fake_google(host="127.0.0.1", port=0, **app_options):
+    return FakeGoogleServer(host, port, **app_options).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API call")
+    args = parser.parse_args()
+    create_app(latency=args.latency).run(host=args.host, port=args.port, threaded=True)
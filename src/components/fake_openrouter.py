@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenRouter chat completions API.
+
+Point the server at it with OPENROUTER_API_URL=<url>/api/v1 to exercise
+/tools/llm without network access or API credits:
+
+    python fake_openrouter.py --port 5056
+
+or start it in-process with start_fake_openrouter(). The reply echoes the
+last user message word by word, so responses are deterministic.
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+
+def create_app(token_delay=0.0, first_token_delay=0.0):
+    app = Flask(__name__)
+    # Seconds before the first token and between tokens, to simulate generation
+    app.config["FIRST_TOKEN_DELAY"] = first_token_delay
+    app.config["TOKEN_DELAY"] = token_delay
+    # Number of upcoming requests that fail with this status before streaming
+    app.config["FAIL_NEXT"] = 0
+    app.config["FAIL_STATUS"] = 502
+    # Number of upcoming streams cut off after the first token (no finish_reason
+    # or [DONE]), and that send a chunk that isn't JSON after the first token
+    app.config["TRUNCATE_NEXT"] = 0
+    app.config["MALFORMED_NEXT"] = 0
+    app.config["REQUEST_COUNTS"] = {}
+    counts_lock = threading.Lock()
+    completion_seq = itertools.count(1)
+
+    def count(name):
+        with counts_lock:
+            counts = app.config["REQUEST_COUNTS"]
+            counts[name] = counts.get(name, 0) + 1
+
+    def take(name):
+        with counts_lock:
+            if app.config[name] > 0:
+                app.config[name] -= 1
+                return True
+            return False
+
+    def reply_tokens(messages):
+        prompt = next((m.get("content") for m in reversed(messages) if m.get("role") == "user"), "")
+        words = str(prompt).split() or ["..."]
+        return [f"{'' if i == 0 else ' '}{word}" for i, word in enumerate(["Echo:"] + words)]
+
+    @app.route("/api/v1/chat/completions", methods=["POST"])
+    def chat_completions():
+        count("chat.completions")
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return jsonify({"error": {"code": 401, "message": "No auth credentials found"}}), 401
+        if take("FAIL_NEXT"):
+            status = app.config["FAIL_STATUS"]
+            return jsonify({"error": {"code": status, "message": "Provider returned error"}}), status
+
+        payload = request.get_json(silent=True) or {}
+        if not payload.get("model") or not payload.get("messages"):
+            return jsonify({"error": {"code": 400, "message": "model and messages are required"}}), 400
+        tokens = reply_tokens(payload["messages"])
+        if payload.get("max_tokens"):
+            tokens = tokens[:int(payload["max_tokens"])]
+        completion_id = f"gen-{next(completion_seq)}-{uuid.uuid4().hex[:8]}"
+        usage = {"prompt_tokens": sum(len(str(m.get("content", "")).split()) for m in payload["messages"]),
+                 "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not payload.get("stream"):
+            return jsonify({
+                "id": completion_id,
+                "model": payload["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        truncate = payload.get("stream") and take("TRUNCATE_NEXT")
+        malformed = payload.get("stream") and take("MALFORMED_NEXT")
+
+        def stream():
+            yield ": OPENROUTER PROCESSING\n\n"
+            time.sleep(app.config["FIRST_TOKEN_DELAY"])
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(app.config["TOKEN_DELAY"])
+                chunk = {"id": completion_id, "model": payload["model"],
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if truncate:
+                    return
+                if malformed:
+                    yield 'data: {"id": "%s", "choices": [{"delta"\n\n' % completion_id
+                    return
+            final = {"id": completion_id, "model": payload["model"],
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return Response(stream(), mimetype="text/event-stream")
+
+    @app.route("/_stats")
+    def stats():
+        with counts_lock:
+            return jsonify(dict(app.config["REQUEST_COUNTS"]))
+
+    return app
+
+
+class FakeOpenRouterServer:
+    """Runs the fake OpenRouter app on a background thread."""
+
+    def __init__(self, host="127.0.0.1", port=0, **app_options):
+        self.app = create_app(**app_options)
+        self._server = make_server(host, port, self.app, threaded=True)
+        self.url = f"http://{host}:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def request_counts(self):
+        return dict(self.app.config["REQUEST_COUNTS"])
+
+
+def start_fake_openrouter(host="127.0.0.1", port=0, **app_options):
+    return FakeOpenRouterServer(host, port, **app_options).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    args = parser.parse_args()
+    create_app(token_delay=args.token_delay).run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,131 @@
+"""
+Encoder/decoder for Google's multipart/mixed batch HTTP protocol.
+
+A batch request is a multipart/mixed body whose parts each carry one
+embedded HTTP request (Content-Type: application/http). The response is a
+multipart/mixed body with one embedded HTTP response per part, tagged with
+"response-" + the Content-ID of the request it answers.
+
+See https://developers.google.com/calendar/api/guides/batch
+"""
+
+import json
+import re
+import uuid
+
+CRLF = "\r\n"
+
+
+def new_boundary():
+    return f"batch_{uuid.uuid4().hex}"
+
+
+def encode_multipart(parts, boundary):
+    """Encode [(headers_dict, body_str)] as a multipart/mixed body (bytes)."""
+    chunks = []
+    for headers, body in parts:
+        chunks.append(f"--{boundary}{CRLF}")
+        for name, value in headers.items():
+            chunks.append(f"{name}: {value}{CRLF}")
+        chunks.append(CRLF)
+        chunks.append(body)
+        chunks.append(CRLF)
+    chunks.append(f"--{boundary}--{CRLF}")
+    return "".join(chunks).encode("utf-8")
+
+
+def decode_multipart(body, content_type):
+    """Split a multipart/mixed body into [(headers_dict, body_str)]."""
+    match = re.search(r'boundary="?([^";]+)"?', content_type or "")
+    if not match:
+        raise ValueError(f"No multipart boundary in Content-Type: {content_type!r}")
+    boundary = match.group(1)
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    parts = []
+    for section in body.split(f"--{boundary}")[1:]:
+        if section.startswith("--"):
+            break
+        headers, payload = split_head(section.lstrip("\r\n"))
+        parts.append((headers, payload.rstrip("\r\n")))
+    return parts
+
+
+def split_head(message):
+    """Split 'Header: value' lines from the payload at the first blank line."""
+    match = re.search(r"\r?\n\r?\n", message)
+    if match is None:
+        head, payload = message, ""
+    else:
+        head, payload = message[:match.start()], message[match.end():]
+    headers = {}
+    for line in head.splitlines():
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    return headers, payload
+
+
+def encode_http_request(method, path, body=None, headers=None):
+    """Embedded HTTP request used as the body of one batch part."""
+    lines = [f"{method} {path} HTTP/1.1"]
+    payload = ""
+    if body is not None:
+        payload = json.dumps(body)
+        lines.append("Content-Type: application/json; charset=UTF-8")
+    for name, value in (headers or {}).items():
+        lines.append(f"{name}: {value}")
+    return CRLF.join(lines) + CRLF + CRLF + payload
+
+
+def decode_http_request(message):
+    """Parse an embedded HTTP request into (method, path, headers, body_str)."""
+    request_line, _, rest = message.partition("\n")
+    method, path = request_line.strip().split()[:2]
+    headers, body = split_head(rest) if rest.strip() else ({}, "")
+    return method, path, headers, body
+
+
+def encode_http_response(status, reason, body):
+    lines = [f"HTTP/1.1 {status} {reason}", "Content-Type: application/json; charset=UTF-8"]
+    return CRLF.join(lines) + CRLF + CRLF + json.dumps(body)
+
+
+def decode_http_response(message):
+    """Parse an embedded HTTP response into (status_code, body)."""
+    status_line, _, rest = message.partition("\n")
+    status = int(status_line.split()[1])
+    _, payload = split_head(rest) if rest.strip() else ({}, "")
+    try:
+        body = json.loads(payload) if payload.strip() else None
+    except ValueError:
+        body = payload
+    return status, body
+
+
+def build_batch_request(requests, boundary=None):
+    """
+    Build a batch body from [(content_id, method, path, json_body)].
+
+    Returns (body_bytes, content_type).
+    """
+    boundary = boundary or new_boundary()
+    parts = [
+        (
+            {"Content-Type": "application/http", "Content-ID": f"<{content_id}>"},
+            encode_http_request(method, path, body),
+        )
+        for content_id, method, path, body in requests
+    ]
+    return encode_multipart(parts, boundary), f"multipart/mixed; boundary={boundary}"
+
+
+def parse_batch_response(body, content_type):
+    """Map each request Content-ID to its (status_code, body)."""
+    results = {}
+    for headers, payload in decode_multipart(body, content_type):
+        content_id = headers.get("content-id", "").strip("<>")
+        if content_id.startswith("response-"):
+            content_id = content_id[len("response-"):]
+        results[content_id] = decode_http_response(payload.lstrip("\r\n"))
+    return results
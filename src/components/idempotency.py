@@ -0,0 +1,325 @@
+"""
+Idempotency-Key support for tool endpoints.
+
+The first request carrying a key runs normally and its response is stored
+for `ttl` seconds, in memory and in an `idempotency_keys` table so every
+worker process sees it. A retry with the same key gets the stored response
+back without calling the tool again. Requests that arrive while the first
+one is still running wait for it (single-flight) instead of making their own
+upstream call; a request that reuses the key with a different body gets
+IdempotencyConflict, in flight or not. Transient failures (429 and 5xx) are
+not stored, so the client's next retry runs the tool again.
+
+A claim on a key is a lease: if the worker holding it dies before storing a
+response, another request takes the key over once the claim is
+`lease_timeout` seconds old. A worker whose lease was taken over doesn't
+store its (late) response.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used with a different request body."""
+
+
+class IdempotencyInProgress(Exception):
+    """Another worker is still processing the key and didn't finish in time."""
+
+
+def _fingerprint_value(value):
+    # Uploaded files (werkzeug FileStorage) count by their content, read in
+    # chunks and rewound for the tool
+    stream = getattr(value, "stream", None)
+    if stream is None or not hasattr(value, "filename"):
+        return str(value)
+    digest = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(64 * 1024), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return {"filename": value.filename, "content_type": value.content_type, "size": size, "sha256": digest.hexdigest()}
+
+
+def request_fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=_fingerprint_value).encode()).hexdigest()
+
+
+def is_cacheable(status):
+    return status < 500 and status != 429
+
+
+class _Flight:
+    __slots__ = ("fingerprint", "done", "result", "error")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class IdempotencyStore:
+    """Memory + database result store with in-process single-flight."""
+
+    def __init__(self, get_connection, is_postgres, ttl=86400.0, memory_size=10000,
+                 wait_timeout=30.0, poll_interval=0.1, lease_timeout=300.0):
+        self._get_connection = get_connection
+        self._is_postgres = is_postgres
+        self.ttl = ttl
+        self.lease_timeout = lease_timeout
+        self.memory_size = memory_size
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._memory = collections.OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def init_schema(self):
+        conn = self._get_connection()
+        if not conn:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    status_code INTEGER,
+                    response TEXT,
+                    created_at DOUBLE PRECISION NOT NULL,
+                    expires_at DOUBLE PRECISION NOT NULL,
+                    claimed_at DOUBLE PRECISION
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at)")
+            conn.commit()
+            # Tables created before claims were leases lack claimed_at
+            try:
+                cursor.execute("SELECT claimed_at FROM idempotency_keys WHERE 1 = 0")
+            except Exception:
+                conn.rollback()
+                cursor = conn.cursor()
+                cursor.execute("ALTER TABLE idempotency_keys ADD COLUMN claimed_at DOUBLE PRECISION")
+                conn.commit()
+            return True
+        except Exception as e:
+            logger.error("Idempotency store initialization error: %s", e)
+            return False
+        finally:
+            conn.close()
+
+    def execute(self, key, fingerprint, fn):
+        """
+        Run fn() -> (body, status) at most once per key.
+
+        Returns (body, status, replayed).
+        """
+        cached = self._memory_get(key, fingerprint)
+        if cached is not None:
+            return cached[0], cached[1], True
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(fingerprint)
+        if not leader:
+            if flight.fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            # Collapse onto the request already running in this process
+            with self._lock:
+                self._stats["collapsed"] += 1
+            if not flight.done.wait(self.wait_timeout):
+                raise IdempotencyInProgress(key)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result[0], flight.result[1], True
+
+        try:
+            flight.result = self._execute_leader(key, fingerprint, fn)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["in_flight"] = len(self._flights)
+            return stats
+
+    def _placeholder(self, conn):
+        return "%s" if self._is_postgres(conn) else "?"
+
+    def _execute_leader(self, key, fingerprint, fn):
+        lease, stored = self._claim(key, fingerprint)
+        if stored is not None:
+            body, status = stored
+            self._memory_put(key, fingerprint, body, status)
+            with self._lock:
+                self._stats["replayed"] += 1
+            return body, status, True
+
+        try:
+            body, status = fn()
+        except Exception:
+            self._release(key, lease)
+            raise
+        if is_cacheable(status):
+            self._complete(key, lease, body, status)
+            self._memory_put(key, fingerprint, body, status)
+            with self._lock:
+                self._stats["stored"] += 1
+        else:
+            # Let the client's next retry run the tool again
+            self._release(key, lease)
+        return body, status, False
+
+    def _claim(self, key, fingerprint):
+        """
+        Claim `key` for this request or find a stored response to replay.
+
+        Returns (lease, None) for a claim, where `lease` identifies it in
+        _complete and _release, or (None, (body, status)) for a replay.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            now = time.time()
+            conn = self._get_connection()
+            if not conn:
+                # No shared store available; fall back to memory-only behaviour
+                return None, None
+            try:
+                p = self._placeholder(conn)
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"INSERT INTO idempotency_keys (key, fingerprint, created_at, expires_at, claimed_at) "
+                    f"VALUES ({p}, {p}, {p}, {p}, {p}) ON CONFLICT (key) DO NOTHING",
+                    (key, fingerprint, now, now + self.ttl, now)
+                )
+                claimed = cursor.rowcount == 1
+                row = None
+                if not claimed:
+                    cursor.execute(
+                        f"SELECT fingerprint, status_code, response, expires_at, COALESCE(claimed_at, created_at) "
+                        f"FROM idempotency_keys WHERE key = {p}",
+                        (key,)
+                    )
+                    row = cursor.fetchone()
+                    if row is not None and row[3] <= now:
+                        # Expired: drop it and claim the key afresh
+                        cursor.execute(f"DELETE FROM idempotency_keys WHERE key = {p} AND expires_at <= {p}", (key, now))
+                        conn.commit()
+                        continue
+                    if (row is not None and row[0] == fingerprint and row[1] is None
+                            and row[4] <= now - self.lease_timeout):
+                        # The worker holding the key died mid-call; take it over
+                        cursor.execute(
+                            f"UPDATE idempotency_keys SET claimed_at = {p} WHERE key = {p} AND status_code IS NULL "
+                            f"AND COALESCE(claimed_at, created_at) = {p}",
+                            (now, key, row[4])
+                        )
+                        claimed = cursor.rowcount == 1
+                        if claimed:
+                            logger.warning("Took over stale idempotency claim on %s", key)
+                if claimed and self._stats["claims"] % 100 == 0:
+                    cursor.execute(f"DELETE FROM idempotency_keys WHERE expires_at <= {p}", (now,))
+                conn.commit()
+            finally:
+                conn.close()
+
+            if claimed:
+                with self._lock:
+                    self._stats["claims"] += 1
+                    if row is not None:
+                        self._stats["taken_over"] += 1
+                return now, None
+            if row is None:
+                # Deleted between our INSERT and SELECT; try again
+                continue
+            stored_fingerprint, status, response = row[0], row[1], row[2]
+            if stored_fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            if status is not None:
+                return None, (json.loads(response), status)
+            # Another worker holds the key; wait for it to finish
+            if time.monotonic() >= deadline:
+                raise IdempotencyInProgress(key)
+            with self._lock:
+                self._stats["waited"] += 1
+            time.sleep(self.poll_interval)
+
+    def _complete(self, key, lease, body, status):
+        conn = self._get_connection()
+        if not conn:
+            return
+        try:
+            p = self._placeholder(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE idempotency_keys SET status_code = {p}, response = {p} WHERE key = {p} AND claimed_at = {p}",
+                (status, json.dumps(body), key, lease)
+            )
+            if cursor.rowcount == 0 and lease is not None:
+                logger.warning("Idempotency claim on %s was taken over; response not stored", key)
+            conn.commit()
+        except Exception as e:
+            logger.error("Error storing idempotent response: %s", e)
+        finally:
+            conn.close()
+
+    def _release(self, key, lease):
+        conn = self._get_connection()
+        if not conn:
+            return
+        try:
+            p = self._placeholder(conn)
+            conn.cursor().execute(
+                f"DELETE FROM idempotency_keys WHERE key = {p} AND status_code IS NULL AND claimed_at = {p}",
+                (key, lease)
+            )
+            conn.commit()
+        except Exception as e:
+            logger.error("Error releasing idempotency key: %s", e)
+        finally:
+            conn.close()
+
+    def _memory_get(self, key, fingerprint):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            stored_fingerprint, body, status, expires_at = entry
+            if expires_at <= time.time():
+                del self._memory[key]
+                return None
+            if stored_fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            self._memory.move_to_end(key)
+            self._stats["replayed"] += 1
+            return body, status
+
+    def _memory_put(self, key, fingerprint, body, status):
+        if self.memory_size <= 0:
+            return
+        with self._lock:
+            self._memory[key] = (fingerprint, body, status, time.time() + self.ttl)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
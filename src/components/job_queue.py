@@ -0,0 +1,360 @@
+"""
+Durable job queue for tool calls, stored in the token database.
+
+Jobs live in a `jobs` table next to `tokens`. Worker threads claim queued
+jobs atomically (FOR UPDATE SKIP LOCKED on PostgreSQL, a single UPDATE ...
+RETURNING on SQLite), run the registered handler, and either record the
+result, schedule a retry with exponential backoff, or dead-letter the job
+once it has used up its attempts. 5xx results are only retried for kinds
+marked idempotent, since the failed attempt may still have taken effect. While a handler runs, its worker renews
+the job's lock every `lock_timeout / 3` seconds, so only jobs left "running"
+by a crashed (or stalled) worker are picked up again after `lock_timeout`
+seconds. Each claim bumps `attempts`, and a worker only records the outcome
+of the attempt it claimed, so a stalled worker can't overwrite the result
+of the one that took over.
+
+Finished jobs (succeeded, failed or dead) are deleted `retention` seconds
+after they finished.
+"""
+
+import collections
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+DEAD = "dead"
+
+
+class RetryableJobError(Exception):
+    """Raised (or returned as a status) by handlers for transient failures."""
+
+
+def is_retryable_status(status, idempotent=True):
+    # A 429 was refused outright; after a 5xx the call may have taken effect
+    return status == 429 or (idempotent and status >= 500)
+
+
+class JobQueue:
+    """Database-backed queue drained by a pool of worker threads."""
+
+    def __init__(self, get_connection, is_postgres, handlers, workers=2, poll_interval=0.5,
+                 max_attempts=5, retry_backoff=2.0, retry_backoff_max=300.0, lock_timeout=300.0,
+                 retention=7 * 86400.0, prune_interval=3600.0, idempotent_kinds=None):
+        # handlers: kind -> callable(payload) -> (status_code, result_body)
+        # idempotent_kinds: kinds whose handlers may run again after a 5xx
+        # result (None: all of them); the others only retry 429 results and
+        # RetryableJobError
+        self._get_connection = get_connection
+        self._is_postgres = is_postgres
+        self.handlers = dict(handlers)
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.lock_timeout = lock_timeout
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.idempotent_kinds = None if idempotent_kinds is None else set(idempotent_kinds)
+        self._next_prune = 0.0
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def init_schema(self):
+        conn = self._get_connection()
+        if not conn:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    result TEXT,
+                    result_status INTEGER,
+                    error TEXT,
+                    run_after DOUBLE PRECISION NOT NULL,
+                    locked_at DOUBLE PRECISION,
+                    created_at DOUBLE PRECISION NOT NULL,
+                    updated_at DOUBLE PRECISION NOT NULL
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_updated_at ON jobs (status, updated_at)")
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error("Job queue initialization error: %s", e)
+            return False
+        finally:
+            conn.close()
+
+    def enqueue(self, kind, payload, max_attempts=None):
+        """Store a job and return its id, or None if it could not be stored."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._get_connection()
+        if not conn:
+            return None
+        try:
+            p = self._placeholder(conn)
+            conn.cursor().execute(
+                f"INSERT INTO jobs (id, kind, payload, status, attempts, max_attempts, run_after, created_at, updated_at) "
+                f"VALUES ({p}, {p}, {p}, {p}, 0, {p}, {p}, {p}, {p})",
+                (job_id, kind, json.dumps(payload), QUEUED, max_attempts or self.max_attempts, now, now, now)
+            )
+            conn.commit()
+        except Exception as e:
+            logger.error("Error enqueuing job: %s", e)
+            return None
+        finally:
+            conn.close()
+        with self._lock:
+            self._stats["enqueued"] += 1
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        conn = self._get_connection()
+        if not conn:
+            return None
+        try:
+            p = self._placeholder(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, kind, status, attempts, max_attempts, result, result_status, error, "
+                f"run_after, created_at, updated_at FROM jobs WHERE id = {p}",
+                (job_id,)
+            )
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(zip(
+            ("id", "kind", "status", "attempts", "max_attempts", "result", "result_status", "error",
+             "run_after", "created_at", "updated_at"),
+            tuple(row)
+        ))
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        if job["status"] != QUEUED:
+            job.pop("run_after")
+        return job
+
+    def start(self):
+        for i in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stop the workers; with a timeout, wait that long for running jobs to finish."""
+        self._stop.set()
+        self._wakeup.set()
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+            for thread in self._threads:
+                thread.join(max(0.0, deadline - time.monotonic()))
+
+    def run_pending(self):
+        """Run claimable jobs on the calling thread until none are left (for tests and tools)."""
+        ran = 0
+        while self._run_one():
+            ran += 1
+        return ran
+
+    def prune(self, older_than=None):
+        """Delete jobs that finished more than `older_than` (default: retention) seconds ago."""
+        older_than = self.retention if older_than is None else older_than
+        conn = self._get_connection()
+        if not conn:
+            return 0
+        try:
+            p = self._placeholder(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                f"DELETE FROM jobs WHERE status IN ({p}, {p}, {p}) AND updated_at < {p}",
+                (SUCCEEDED, FAILED, DEAD, time.time() - older_than)
+            )
+            deleted = cursor.rowcount
+            conn.commit()
+        except Exception as e:
+            logger.error("Error pruning jobs: %s", e)
+            return 0
+        finally:
+            conn.close()
+        with self._lock:
+            self._stats["pruned"] += deleted
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["workers"] = len(self._threads)
+        return stats
+
+    def _placeholder(self, conn):
+        return "%s" if self._is_postgres(conn) else "?"
+
+    def _claim(self):
+        now = time.time()
+        conn = self._get_connection()
+        if not conn:
+            return None
+        try:
+            p = self._placeholder(conn)
+            skip_locked = " FOR UPDATE SKIP LOCKED" if self._is_postgres(conn) else ""
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE jobs SET status = {p}, attempts = attempts + 1, locked_at = {p}, updated_at = {p} "
+                f"WHERE id = (SELECT id FROM jobs WHERE (status = {p} AND run_after <= {p}) "
+                f"OR (status = {p} AND locked_at < {p}) ORDER BY run_after LIMIT 1{skip_locked}) "
+                f"RETURNING id, kind, payload, attempts, max_attempts",
+                (RUNNING, now, now, QUEUED, now, RUNNING, now - self.lock_timeout)
+            )
+            row = cursor.fetchone()
+            conn.commit()
+            return tuple(row) if row else None
+        except Exception as e:
+            logger.error("Error claiming job: %s", e)
+            return None
+        finally:
+            conn.close()
+
+    def _renew(self, job_id, attempt):
+        """Push back the lock of a job this worker is still running; False if it lost the claim."""
+        conn = self._get_connection()
+        if not conn:
+            return True
+        try:
+            p = self._placeholder(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE jobs SET locked_at = {p} WHERE id = {p} AND status = {p} AND attempts = {p}",
+                (time.time(), job_id, RUNNING, attempt)
+            )
+            renewed = cursor.rowcount == 1
+            conn.commit()
+            return renewed
+        except Exception as e:
+            logger.warning("Error renewing lock on job %s: %s", job_id, e)
+            return True
+        finally:
+            conn.close()
+
+    def _heartbeat(self, job_id, attempt, done):
+        while not done.wait(self.lock_timeout / 3):
+            try:
+                renewed = self._renew(job_id, attempt)
+            except Exception as e:
+                # No connection this time (pool exhausted, say); try again next beat
+                logger.warning("Error renewing lock on job %s: %s", job_id, e)
+                continue
+            if not renewed:
+                logger.warning("Job %s attempt %s lost its lock while running", job_id, attempt)
+                return
+
+    def _finish(self, job_id, attempt, status, result_status=None, result=None, error=None, run_after=None):
+        now = time.time()
+        conn = self._get_connection()
+        if not conn:
+            return
+        try:
+            p = self._placeholder(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE jobs SET status = {p}, result_status = {p}, result = {p}, error = {p}, "
+                f"run_after = COALESCE({p}, run_after), locked_at = NULL, updated_at = {p} "
+                f"WHERE id = {p} AND attempts = {p}",
+                (status, result_status, json.dumps(result) if result is not None else None, error,
+                 run_after, now, job_id, attempt)
+            )
+            if cursor.rowcount == 0:
+                logger.warning("Job %s attempt %s was claimed again before it finished; result dropped", job_id, attempt)
+            conn.commit()
+        except Exception as e:
+            logger.error("Error updating job %s: %s", job_id, e)
+        finally:
+            conn.close()
+
+    def _run_one(self):
+        claimed = self._claim()
+        if claimed is None:
+            return False
+        job_id, kind, payload, attempts, max_attempts = claimed
+        handler = self.handlers.get(kind)
+        result_status, result, error = None, None, None
+        if handler is None:
+            error, retryable = f"No handler for job kind '{kind}'", False
+        else:
+            done = threading.Event()
+            heartbeat = threading.Thread(
+                target=self._heartbeat, args=(job_id, attempts, done), name=f"job-heartbeat-{job_id[:8]}", daemon=True
+            )
+            heartbeat.start()
+            try:
+                result_status, result = handler(json.loads(payload))
+                retryable = is_retryable_status(
+                    result_status, self.idempotent_kinds is None or kind in self.idempotent_kinds
+                )
+                if result_status >= 400:
+                    error = f"Tool returned status {result_status}"
+            except RetryableJobError as e:
+                error, retryable = str(e), True
+            except Exception as e:
+                error, retryable = f"{type(e).__name__}: {e}", False
+            finally:
+                done.set()
+
+        if error is None:
+            self._finish(job_id, attempts, SUCCEEDED, result_status, result)
+            counter = "succeeded"
+        elif retryable and attempts < max_attempts:
+            delay = min(self.retry_backoff * 2 ** (attempts - 1), self.retry_backoff_max)
+            delay *= random.uniform(0.8, 1.2)
+            self._finish(job_id, attempts, QUEUED, result_status, result, error, run_after=time.time() + delay)
+            counter = "retried"
+        elif retryable:
+            # Out of attempts: dead-letter it so it stays inspectable
+            self._finish(job_id, attempts, DEAD, result_status, result, error)
+            counter = "dead_lettered"
+        else:
+            self._finish(job_id, attempts, FAILED, result_status, result, error)
+            counter = "failed"
+        with self._lock:
+            self._stats[counter] += 1
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._run_one():
+                    continue
+            except Exception as e:
+                logger.exception("Job worker error: %s", e)
+            # Idle: a good time to clear out old finished jobs
+            if self.retention > 0 and time.time() >= self._next_prune:
+                self._next_prune = time.time() + self.prune_interval
+                self.prune()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
@@ -0,0 +1,86 @@
+"""
+JSON-RPC 2.0 dispatcher for the MCP endpoint.
+
+Handles single requests and batch arrays. The calls in a batch run
+concurrently on an executor and their responses come back in request order.
+Notifications (requests without an id) are run but get no response.
+"""
+
+import contextvars
+
+JSONRPC_VERSION = "2.0"
+
+# Standard JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class RpcError(Exception):
+    """Raised by method handlers to return a JSON-RPC error object."""
+
+    def __init__(self, code, message, data=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+def error_response(request_id, code, message, data=None):
+    error = {"code": code, "message": message}
+    if data is not None:
+        error["data"] = data
+    return {"jsonrpc": JSONRPC_VERSION, "id": request_id, "error": error}
+
+
+class JsonRpcDispatcher:
+    """Maps method names to handlers taking the request's params."""
+
+    def __init__(self, methods, executor, max_batch=100):
+        self.methods = dict(methods)
+        self.executor = executor
+        self.max_batch = max_batch
+
+    def handle(self, payload, prepare_batch=None):
+        """
+        Process a decoded request body. Returns the response body, or None when
+        nothing should be sent back (only notifications). `prepare_batch(requests)`
+        runs once before a batch is dispatched, inside the context the calls run in.
+        """
+        if isinstance(payload, list):
+            if not payload:
+                return error_response(None, INVALID_REQUEST, "Empty batch")
+            if len(payload) > self.max_batch:
+                return error_response(None, INVALID_REQUEST, f"Batch exceeds {self.max_batch} requests")
+            context = contextvars.copy_context()
+            if prepare_batch:
+                context.run(prepare_batch, payload)
+            # Each call gets its own copy of the prepared context
+            futures = [self.executor.submit(context.copy().run, self.handle_one, item) for item in payload]
+            responses = [future.result() for future in futures]
+            responses = [response for response in responses if response is not None]
+            return responses or None
+        return self.handle_one(payload)
+
+    def handle_one(self, request):
+        if not isinstance(request, dict) or request.get("jsonrpc") != JSONRPC_VERSION \
+                or not isinstance(request.get("method"), str):
+            return error_response(None, INVALID_REQUEST, "Invalid Request")
+        request_id = request.get("id")
+        is_notification = "id" not in request
+        handler = self.methods.get(request["method"])
+        params = request.get("params", {})
+        if handler is None:
+            response = error_response(request_id, METHOD_NOT_FOUND, f"Method not found: {request['method']}")
+        elif not isinstance(params, (dict, list)):
+            response = error_response(request_id, INVALID_PARAMS, "params must be an object or array")
+        else:
+            try:
+                response = {"jsonrpc": JSONRPC_VERSION, "id": request_id, "result": handler(params)}
+            except RpcError as e:
+                response = error_response(request_id, e.code, e.message, e.data)
+            except Exception as e:
+                response = error_response(request_id, INTERNAL_ERROR, "Internal error", f"{type(e).__name__}: {e}")
+        return None if is_notification else response
@@ -0,0 +1,58 @@
+"""
+Deferred imports for heavy dependencies.
+
+    requests = LazyModule("requests")
+
+binds a stand-in whose first attribute access imports the real module, so a
+cold start only pays for libraries once a request actually needs them.
+Submodules that the package doesn't import itself (psycopg2.extras) are
+imported on access as well.
+"""
+
+import importlib
+import importlib.util
+import threading
+
+
+def module_available(name):
+    """True if `name` can be imported, without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LazyModule:
+    """Module proxy that imports `name` on first attribute access."""
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def __getattr__(self, attr):
+        module = self._load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            try:
+                return importlib.import_module(f"{self._name}.{attr}")
+            except ModuleNotFoundError:
+                raise AttributeError(f"module {self._name!r} has no attribute {attr!r}") from None
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self.__dict__["_module"] = importlib.import_module(self._name)
+                module = self._module
+        return module
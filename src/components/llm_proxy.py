@@ -0,0 +1,171 @@
+"""
+Helpers for proxying chat completions to OpenRouter.
+
+Requests are normalized into an OpenAI-style payload (model, messages and a
+whitelist of sampling parameters), which also gives a stable content address
+for the response cache: the same model, prompt and parameters always hash to
+the same key however the client formatted them. Streamed responses are read
+as Server-Sent Events and turned into plain text deltas.
+"""
+
+import collections
+import hashlib
+import json
+import threading
+import time
+
+# Parameters forwarded upstream; they are part of the cache key
+SAMPLING_PARAMS = (
+    "temperature", "top_p", "top_k", "max_tokens", "stop", "seed",
+    "frequency_penalty", "presence_penalty", "repetition_penalty", "response_format",
+)
+
+
+class LLMRequestError(ValueError):
+    """The tool call doesn't describe a valid completion request."""
+
+
+class UpstreamLLMError(Exception):
+    """OpenRouter answered with an error, before or during the stream."""
+
+    def __init__(self, status, details):
+        self.status = status
+        self.details = details
+        super().__init__(f"OpenRouter returned {status}: {details}")
+
+
+def normalize_content(content):
+    if isinstance(content, str):
+        return content.replace("\r\n", "\n").strip()
+    return content
+
+
+def build_chat_request(data, default_model):
+    """OpenRouter payload for a /tools/llm call ({"prompt"} or {"messages"})."""
+    messages = data.get("messages")
+    if messages is None:
+        prompt = data.get("prompt")
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise LLMRequestError("Either 'prompt' or 'messages' is required")
+        messages = [{"role": "user", "content": prompt}]
+        if data.get("system"):
+            messages.insert(0, {"role": "system", "content": data["system"]})
+    if not isinstance(messages, list) or not messages:
+        raise LLMRequestError("'messages' must be a non-empty list")
+    normalized = []
+    for message in messages:
+        if not isinstance(message, dict) or not message.get("role") or "content" not in message:
+            raise LLMRequestError("Every message needs a 'role' and 'content'")
+        normalized.append({"role": str(message["role"]).strip().lower(), "content": normalize_content(message["content"])})
+    payload = {"model": data.get("model") or default_model, "messages": normalized}
+    for param in SAMPLING_PARAMS:
+        if data.get(param) is not None:
+            payload[param] = data[param]
+    return payload
+
+
+def cache_key(payload):
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def iter_completion(response):
+    """
+    Yield text deltas from a streamed chat completion response.
+
+    Returns (via StopIteration.value) {"content", "model", "finish_reason",
+    "usage", "complete"}, where "complete" says whether the stream ended
+    with a finish_reason or [DONE] rather than being cut off. Raises
+    UpstreamLLMError for error payloads and undecodable chunks.
+    """
+    summary = {"content": "", "model": None, "finish_reason": None, "usage": None, "complete": False}
+    parts = []
+    for line in response.iter_lines(chunk_size=None):
+        # Blank lines end an event; lines starting with ":" are keep-alive comments
+        if not line or line.startswith(b":") or not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            summary["complete"] = True
+            break
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            raise UpstreamLLMError(502, f"Malformed stream chunk: {data[:200]!r}")
+        if chunk.get("error"):
+            error = chunk["error"]
+            raise UpstreamLLMError(error.get("code", 502) if isinstance(error, dict) else 502, error)
+        summary["model"] = chunk.get("model") or summary["model"]
+        if chunk.get("usage"):
+            summary["usage"] = chunk["usage"]
+        for choice in chunk.get("choices") or []:
+            if choice.get("finish_reason"):
+                summary["finish_reason"] = choice["finish_reason"]
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                parts.append(content)
+                yield content
+    summary["content"] = "".join(parts)
+    summary["complete"] = summary["complete"] or summary["finish_reason"] is not None
+    return summary
+
+
+def collect(generator):
+    """Run a generator to the end and return its return value."""
+    while True:
+        try:
+            next(generator)
+        except StopIteration as stop:
+            return stop.value
+
+
+class ResponseCache:
+    """LRU of completed responses bounded by entry count, total bytes and TTL."""
+
+    def __init__(self, max_entries=1000, max_bytes=16 * 1024 * 1024, ttl=3600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                    self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"entries": len(self._entries), "bytes": self._bytes,
+                          "max_entries": self.max_entries, "max_bytes": self.max_bytes})
+            return stats
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
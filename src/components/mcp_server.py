@@ -1,24 +1,80 @@
-from flask import Flask, request, redirect, url_for, jsonify
-import requests
+from flask import Flask, Response, request, redirect, url_for, jsonify, send_file
+import hmac
 import json
+import logging
 import os
 import base64
 import sqlite3
 import datetime
+import glob
+import threading
+import time
+import queue
+import uuid
+import contextvars
+import itertools
+import tempfile
+import ipaddress
+import socket
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
-# Try to import psycopg2, but don't fail if it's not available
-try:
-    import psycopg2
-    import psycopg2.extras
-    PSYCOPG2_AVAILABLE = True
-except ImportError:
-    print("psycopg2 not available, falling back to SQLite for local development")
-    PSYCOPG2_AVAILABLE = False
-from oauthlib.oauth2 import WebApplicationClient
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+from circuit_breaker import CircuitBreaker
+from db_pool import ConnectionPool, PoolTimeout, ThreadLocalConnections
+from event_cache import CalendarSyncError, EventCache, format_time, parse_time
+from google_batch import build_batch_request, parse_batch_response
+from idempotency import IdempotencyConflict, IdempotencyInProgress, IdempotencyStore, request_fingerprint
+from job_queue import JobQueue, RetryableJobError
+from llm_proxy import LLMRequestError, ResponseCache, UpstreamLLMError, build_chat_request, cache_key, collect, iter_completion
+from oauth_state import OAuthStateStore, code_challenge, new_code_verifier
+from profiler import ProfileStore, ProfilingMiddleware
+from mime_stream import Attachment, MessageTooLarge, MimeMessage, StreamingBody, iter_fixed_chunks, limit_chunks
+from lazy_import import LazyModule, module_available
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from json_rpc import INVALID_PARAMS, JsonRpcDispatcher, PARSE_ERROR, RpcError, error_response
+from rate_limiter import AdaptiveRateLimiter, RateLimited, parse_retry_after
+from sqlite_store import SQLiteShards, apply_pragmas, shard_index
+import structured_logging
+from token_cache import SQLiteInvalidationChannel, TokenCache, token_expires_at
+from token_refresher import TokenRefresher
+from tool_registry import ToolRegistry
+from upstream import UpstreamClient, is_connect_error
+from workflow_engine import WorkflowError, run_workflow, validate_workflow
+
+# Heavy dependencies are imported on first use, not at startup
+requests = LazyModule("requests")
+oauth2 = LazyModule("oauthlib.oauth2")
+
+# psycopg2 is optional; without it we fall back to SQLite
+PSYCOPG2_AVAILABLE = module_available("psycopg2")
+psycopg2 = LazyModule("psycopg2")
+
+# The .env file python-dotenv would find: the nearest one in this file's
+# directory or above
+def find_env_file():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+# Load environment variables (python-dotenv is only imported if there's a file to load)
+ENV_FILE = find_env_file()
+if ENV_FILE:
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
+
+# Logs go through a queue to a background writer (LOG_LEVEL, LOG_FORMAT, ...)
+structured_logging.setup()
+logger = logging.getLogger(__name__)
+
+if not PSYCOPG2_AVAILABLE:
+    logger.info("psycopg2 not available, falling back to SQLite for local development")
 
 app = Flask(__name__)
 
@@ -26,18 +82,137 @@ app = Flask(__name__)
 CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
 REDIRECT_URI = os.environ.get("GOOGLE_REDIRECT_URI")
-AUTH_URL = "https://accounts.google.com/o/oauth2/auth"
-TOKEN_URL = "https://oauth2.googleapis.com/token"
+AUTH_URL = os.environ.get("GOOGLE_AUTH_URL", "https://accounts.google.com/o/oauth2/auth")
+TOKEN_URL = os.environ.get("GOOGLE_TOKEN_URL", "https://oauth2.googleapis.com/token")
 SCOPE = ["https://www.googleapis.com/auth/gmail.send", "https://www.googleapis.com/auth/calendar.events"]
 
-# OpenRouter API configuration
+# Google API endpoints (GOOGLE_API_BASE_URL lets tests point at fake_google.py)
+GOOGLE_API_BASE_URL = os.environ.get("GOOGLE_API_BASE_URL", "https://www.googleapis.com").rstrip("/")
+GMAIL_SEND_URL = f"{GOOGLE_API_BASE_URL}/gmail/v1/users/me/messages/send"
+GMAIL_UPLOAD_URL = f"{GOOGLE_API_BASE_URL}/upload/gmail/v1/users/me/messages/send"
+CALENDAR_EVENTS_PATH = "/calendar/v3/calendars/primary/events"
+CALENDAR_EVENTS_URL = f"{GOOGLE_API_BASE_URL}{CALENDAR_EVENTS_PATH}"
+CALENDAR_BATCH_URL = f"{GOOGLE_API_BASE_URL}/batch/calendar/v3"
+
+# Upstream HTTP client configuration
+UPSTREAM_POOL_CONNECTIONS = int(os.environ.get("UPSTREAM_POOL_CONNECTIONS", 10))
+UPSTREAM_POOL_MAXSIZE = int(os.environ.get("UPSTREAM_POOL_MAXSIZE", 20))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", 30))
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", 2))
+UPSTREAM_BACKOFF_FACTOR = float(os.environ.get("UPSTREAM_BACKOFF_FACTOR", 0.3))
+
+# Batch email configuration
+EMAIL_BATCH_CONCURRENCY = int(os.environ.get("EMAIL_BATCH_CONCURRENCY", 8))
+EMAIL_BATCH_MAX_ITEMS = int(os.environ.get("EMAIL_BATCH_MAX_ITEMS", 500))
+
+# Batch calendar configuration (Google accepts at most 50 calls per Calendar batch)
+CALENDAR_BATCH_LIMIT = min(int(os.environ.get("CALENDAR_BATCH_LIMIT", 50)), 50)
+CALENDAR_BATCH_CONCURRENCY = int(os.environ.get("CALENDAR_BATCH_CONCURRENCY", 4))
+CALENDAR_BATCH_MAX_ITEMS = int(os.environ.get("CALENDAR_BATCH_MAX_ITEMS", 500))
+
+# Local calendar cache for /tools/list-events and /tools/free-busy
+CALENDAR_SYNC_PAGE_SIZE = min(int(os.environ.get("CALENDAR_SYNC_PAGE_SIZE", 250)), 2500)
+# Reads within this many seconds of the last sync are answered from the cache alone
+CALENDAR_SYNC_MIN_INTERVAL = float(os.environ.get("CALENDAR_SYNC_MIN_INTERVAL", 10))
+CALENDAR_CACHE_USERS = int(os.environ.get("CALENDAR_CACHE_USERS", 1000))
+CALENDAR_LIST_MAX_RESULTS = 2500
+
+# Async job queue configuration (JOB_WORKERS=0 only enqueues; another process drains)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 0.5))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_BACKOFF = float(os.environ.get("JOB_RETRY_BACKOFF", 2))
+JOB_LOCK_TIMEOUT = float(os.environ.get("JOB_LOCK_TIMEOUT", 300))
+# Finished jobs are deleted this many seconds after they finish (0 keeps them)
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", 7 * 86400))
+JOB_PRUNE_INTERVAL = float(os.environ.get("JOB_PRUNE_INTERVAL", 3600))
+
+# Outgoing email size handling. Messages up to GMAIL_RAW_MAX_BYTES are sent
+# as base64 JSON; bigger ones (or ones with attachments) are streamed through
+# the media upload endpoint, in one multipart request up to
+# GMAIL_RESUMABLE_THRESHOLD and in resumable chunks beyond that.
+GMAIL_RAW_MAX_BYTES = int(os.environ.get("GMAIL_RAW_MAX_BYTES", 512 * 1024))
+GMAIL_RESUMABLE_THRESHOLD = int(os.environ.get("GMAIL_RESUMABLE_THRESHOLD", 5 * 1024 * 1024))
+# Resumable chunks must be a multiple of 256 KiB
+GMAIL_UPLOAD_CHUNK_SIZE = max(1, int(os.environ.get("GMAIL_UPLOAD_CHUNK_SIZE", 1024 * 1024)) // (256 * 1024)) * 256 * 1024
+# Gmail's limit for messages sent through the upload endpoint
+GMAIL_MAX_MESSAGE_BYTES = int(os.environ.get("GMAIL_MAX_MESSAGE_BYTES", 35 * 1024 * 1024))
+# Attachment URLs are fetched server-side. When ATTACHMENT_ALLOWED_HOSTS is
+# set, only those hosts are fetched (internal ones included); otherwise any
+# host that resolves to public addresses only.
+ATTACHMENT_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.environ.get("ATTACHMENT_ALLOWED_HOSTS", "").split(",") if host.strip()
+}
+ATTACHMENT_MAX_REDIRECTS = int(os.environ.get("ATTACHMENT_MAX_REDIRECTS", 5))
+
+# Idempotency-Key handling for /tools/send-email and /tools/create-event
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", 86400))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 10000))
+# How long a duplicate waits for the original request before getting a 409
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get("IDEMPOTENCY_WAIT_TIMEOUT", 30))
+# Age at which a claim with no stored response (its worker died) can be taken over
+IDEMPOTENCY_LEASE_TIMEOUT = float(os.environ.get("IDEMPOTENCY_LEASE_TIMEOUT", 300))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Per-user rate limits for Google APIs (requests/second and burst size).
+# Gmail allows 250 quota units/s per user and messages.send costs 100 units.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_GMAIL_RATE = float(os.environ.get("RATE_LIMIT_GMAIL_RATE", 2.5))
+RATE_LIMIT_GMAIL_BURST = float(os.environ.get("RATE_LIMIT_GMAIL_BURST", 10))
+RATE_LIMIT_CALENDAR_RATE = float(os.environ.get("RATE_LIMIT_CALENDAR_RATE", 10))
+RATE_LIMIT_CALENDAR_BURST = float(os.environ.get("RATE_LIMIT_CALENDAR_BURST", 50))
+# Longest a call may wait for its bucket before it is rejected locally;
+# batch endpoints are expected to take a while and may wait longer
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 2))
+RATE_LIMIT_BATCH_MAX_WAIT = float(os.environ.get("RATE_LIMIT_BATCH_MAX_WAIT", 30))
+
+# Workflow engine configuration
+WORKFLOW_CONCURRENCY = int(os.environ.get("WORKFLOW_CONCURRENCY", 8))
+WORKFLOW_MAX_NODES = int(os.environ.get("WORKFLOW_MAX_NODES", 100))
+
+# JSON-RPC (MCP) endpoint configuration
+MCP_CONCURRENCY = int(os.environ.get("MCP_CONCURRENCY", 8))
+MCP_MAX_BATCH = int(os.environ.get("MCP_MAX_BATCH", 100))
+MCP_PROTOCOL_VERSION = "2025-03-26"
+
+# OpenRouter API configuration (OPENROUTER_API_URL lets tests point at fake_openrouter.py)
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
+OPENROUTER_API_URL = os.environ.get("OPENROUTER_API_URL", "https://openrouter.ai/api/v1").rstrip("/")
+LLM_DEFAULT_MODEL = os.environ.get("LLM_DEFAULT_MODEL", "openai/gpt-4o-mini")
+# Longest gap allowed between streamed chunks
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 120))
+# Completed responses cached by model + normalized prompt + parameters
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", 1000))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 3600))
+
+# Per-worker warmup (serve.py): recently active tokens to load and whether
+# to open a connection to Google before taking traffic
+WARMUP_TOKENS = int(os.environ.get("WARMUP_TOKENS", 100))
+WARMUP_HTTP = os.environ.get("WARMUP_HTTP", "true").lower() in ("1", "true", "yes")
 
 # Database configuration
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
-# For local testing, use SQLite as fallback
-DB_PATH = os.path.join(os.path.dirname(__file__), 'tokens.db')
+# For local testing, use SQLite as fallback (SQLITE_DB_PATH moves the file)
+DB_PATH = os.environ.get("SQLITE_DB_PATH", os.path.join(os.path.dirname(__file__), 'tokens.db'))
+
+# SQLite store mode. "wal" puts SQLite connections in WAL mode with the
+# pragmas below and sends token writes through one group-commit writer
+# thread per file; tokens are then spread by user_id over
+# SQLITE_TOKEN_SHARDS files (1 keeps them in DB_PATH).
+SQLITE_STORE_MODE = os.environ.get("SQLITE_STORE_MODE", "default").lower()
+SQLITE_WAL = SQLITE_STORE_MODE == "wal"
+SQLITE_TOKEN_SHARDS = max(1, int(os.environ.get("SQLITE_TOKEN_SHARDS", 1)))
+SQLITE_BUSY_TIMEOUT = float(os.environ.get("SQLITE_BUSY_TIMEOUT", 5))
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", 16384))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+# Most writes per group commit, and how long the writer waits for more
+# before committing (0: commit whatever queued up during the last commit)
+SQLITE_GROUP_COMMIT_MAX = int(os.environ.get("SQLITE_GROUP_COMMIT_MAX", 256))
+SQLITE_GROUP_COMMIT_DELAY = float(os.environ.get("SQLITE_GROUP_COMMIT_DELAY", 0))
 
 # Parse individual database credentials
 DB_USERNAME = os.environ.get("database_username")
@@ -46,47 +221,370 @@ DB_HOST = os.environ.get("database_host")
 DB_PORT = os.environ.get("database_port")
 DB_NAME = os.environ.get("database_name")
 
-client = WebApplicationClient(CLIENT_ID)
+# Connection pool configuration
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", 300))
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", 3600))
+DB_POOL_PING_AFTER = float(os.environ.get("DB_POOL_PING_AFTER", 30))
 
-# Database connection function
-def get_db_connection():
+# PostgreSQL circuit breaker configuration
+DB_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("DB_BREAKER_FAILURE_THRESHOLD", 3))
+DB_BREAKER_BACKOFF_INITIAL = float(os.environ.get("DB_BREAKER_BACKOFF_INITIAL", 1))
+DB_BREAKER_BACKOFF_MAX = float(os.environ.get("DB_BREAKER_BACKOFF_MAX", 60))
+
+# Token cache configuration (TOKEN_CACHE_SIZE=0 disables the cache)
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 1024))
+TOKEN_CACHE_DEFAULT_TTL = float(os.environ.get("TOKEN_CACHE_DEFAULT_TTL", 300))
+TOKEN_CACHE_EXPIRY_SKEW = float(os.environ.get("TOKEN_CACHE_EXPIRY_SKEW", 30))
+# Shared SQLite file used to invalidate cached tokens across worker processes
+TOKEN_CACHE_INVALIDATION_PATH = os.environ.get("TOKEN_CACHE_INVALIDATION_PATH")
+TOKEN_CACHE_INVALIDATION_POLL = float(os.environ.get("TOKEN_CACHE_INVALIDATION_POLL", 1))
+
+# Proactive token refresh configuration
+TOKEN_REFRESH_ENABLED = os.environ.get("TOKEN_REFRESH_ENABLED", "true").lower() in ("1", "true", "yes")
+TOKEN_REFRESH_INTERVAL = float(os.environ.get("TOKEN_REFRESH_INTERVAL", 60))
+TOKEN_REFRESH_LEAD_TIME = float(os.environ.get("TOKEN_REFRESH_LEAD_TIME", 600))
+TOKEN_REFRESH_WORKERS = int(os.environ.get("TOKEN_REFRESH_WORKERS", 4))
+TOKEN_REFRESH_JITTER = float(os.environ.get("TOKEN_REFRESH_JITTER", 10))
+
+# How long a user has to finish the Google consent screen
+OAUTH_STATE_TTL = float(os.environ.get("OAUTH_STATE_TTL", 600))
+
+rate_limiter = AdaptiveRateLimiter(
+    {
+        "gmail": (RATE_LIMIT_GMAIL_RATE, RATE_LIMIT_GMAIL_BURST),
+        "calendar": (RATE_LIMIT_CALENDAR_RATE, RATE_LIMIT_CALENDAR_BURST),
+    } if RATE_LIMIT_ENABLED else {},
+    max_wait=RATE_LIMIT_MAX_WAIT,
+)
+
+# Prometheus metrics, served at /metrics
+metrics = Registry()
+DB_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+http_requests = metrics.counter(
+    "mcp_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")
+)
+http_request_duration = metrics.histogram(
+    "mcp_http_request_duration_seconds", "Time to produce the response (streams excluded)", ("route", "method")
+)
+db_acquire_duration = metrics.histogram(
+    "mcp_db_connection_acquire_seconds", "Time to get a database connection", ("backend",), buckets=DB_LATENCY_BUCKETS
+)
+token_query_duration = metrics.histogram(
+    "mcp_token_query_seconds", "Token store query latency", ("operation", "backend"), buckets=DB_LATENCY_BUCKETS
+)
+upstream_duration = metrics.histogram(
+    "mcp_upstream_request_duration_seconds", "Upstream HTTP call latency", ("endpoint",)
+)
+upstream_responses = metrics.counter(
+    "mcp_upstream_responses_total", "Upstream HTTP responses by status (\"error\" when none arrived)", ("endpoint", "status")
+)
+# Under serve.py: directory where workers publish snapshots, so any worker's
+# /metrics covers all of them
+METRICS_MULTIPROC_DIR = os.environ.get("METRICS_MULTIPROC_DIR")
+METRICS_SNAPSHOT_INTERVAL = float(os.environ.get("METRICS_SNAPSHOT_INTERVAL", 5))
+
+# Opt-in request profiling; when disabled the middleware isn't installed at all.
+# Requests sending "X-Profile: <PROFILING_TOKEN>" are profiled, plus a
+# PROFILE_SAMPLE_RATE fraction of all requests
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SAMPLE_MODE = os.environ.get("PROFILE_SAMPLE_MODE", "cprofile")
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "mcp-profiles"))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 50))
+PROFILE_MAX_BYTES = int(os.environ.get("PROFILE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Correlation id header: taken from the request when present, always set on the response
+REQUEST_ID_HEADER = os.environ.get("REQUEST_ID_HEADER", "X-Request-Id")
+REQUEST_ID_MAX_LENGTH = 128
+
+def observe_upstream(endpoint, elapsed, status_code):
+    upstream_duration.observe(elapsed, endpoint)
+    upstream_responses.inc(endpoint, status_code if status_code is not None else "error")
+
+# Shared keep-alive session for every call to Google
+upstream = UpstreamClient(
+    pool_connections=UPSTREAM_POOL_CONNECTIONS,
+    pool_maxsize=UPSTREAM_POOL_MAXSIZE,
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=UPSTREAM_READ_TIMEOUT,
+    retries=UPSTREAM_RETRIES,
+    backoff_factor=UPSTREAM_BACKOFF_FACTOR,
+    observer=observe_upstream,
+)
+
+# Open a new physical PostgreSQL connection (used by the pool only)
+def connect_postgres():
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        conn.autocommit = False
+        logger.debug("Connected to PostgreSQL database using DATABASE_URL")
+        return conn
+    except Exception as e:
+        logger.warning("PostgreSQL connection error with DATABASE_URL: %s", e)
+        # Fall back to individual credentials
+        if not (DB_USERNAME and DB_PASSWORD and DB_HOST and DB_PORT and DB_NAME):
+            raise
+    conn = psycopg2.connect(
+        user=DB_USERNAME,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME
+    )
+    conn.autocommit = False
+    logger.debug("Connected to PostgreSQL database using individual credentials")
+    return conn
+
+# Open a new SQLite connection (one is kept per thread)
+def connect_sqlite(path=None):
+    logger.debug("Using SQLite for local development/testing")
+    conn = sqlite3.connect(path or DB_PATH, timeout=SQLITE_BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    if SQLITE_WAL:
+        apply_pragmas(
+            conn,
+            busy_timeout=SQLITE_BUSY_TIMEOUT,
+            synchronous=SQLITE_SYNCHRONOUS,
+            cache_size_kb=SQLITE_CACHE_SIZE_KB,
+            mmap_size=SQLITE_MMAP_SIZE,
+        )
+    return conn
+
+pg_pool = None
+pg_pool_lock = threading.Lock()
+sqlite_connections = ThreadLocalConnections(connect_sqlite)
+
+# Close this process's database connections and forget breaker state, so a
+# forked worker (or a fresh start) opens its own
+def reset_db_state():
+    global pg_pool
+    with pg_pool_lock:
+        if pg_pool is not None:
+            pg_pool.closeall()
+            pg_pool = None
+    sqlite_connections.closeall()
+    if sqlite_tokens is not None:
+        sqlite_tokens.close()
+    pg_breaker.reset()
+
+def get_pg_pool():
+    global pg_pool
+    if pg_pool is None:
+        with pg_pool_lock:
+            if pg_pool is None:
+                pool = ConnectionPool(
+                    connect_postgres,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    ping_after=DB_POOL_PING_AFTER,
+                )
+                pool.fill()
+                pg_pool = pool
+    return pg_pool
+
+# Background probe used by the circuit breaker while PostgreSQL is marked down
+def probe_postgres():
+    conn = get_pg_pool().getconn()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+    finally:
+        conn.close()
+
+pg_breaker = CircuitBreaker(
+    "postgres",
+    probe_postgres,
+    failure_threshold=DB_BREAKER_FAILURE_THRESHOLD,
+    backoff_initial=DB_BREAKER_BACKOFF_INITIAL,
+    backoff_max=DB_BREAKER_BACKOFF_MAX,
+)
+
+def is_postgres(conn):
+    return getattr(conn, "backend", None) == "postgres"
+
+def pool_stats():
+    return {
+        "postgres": pg_pool.stats() if pg_pool is not None else None,
+        "sqlite": sqlite_connections.stats(),
+    }
+
+# Open a database connection without the schema check. Connections come
+# from a pool; calling close() on them returns them to the pool instead of
+# disconnecting.
+def open_db_connection():
     # First try PostgreSQL if DATABASE_URL is available and psycopg2 is installed
+    # While the circuit breaker is open, go straight to the fallback and let
+    # the breaker's background probe decide when PostgreSQL is back.
     if PSYCOPG2_AVAILABLE and DATABASE_URL:
-        try:
-            conn = psycopg2.connect(DATABASE_URL)
-            conn.autocommit = False
-            print("Connected to PostgreSQL database using DATABASE_URL")
-            return conn
-        except Exception as e:
-            print(f"PostgreSQL connection error with DATABASE_URL: {e}")
-            # Fall back to individual credentials
-            if DB_USERNAME and DB_PASSWORD and DB_HOST and DB_PORT and DB_NAME:
-                try:
-                    conn = psycopg2.connect(
-                        user=DB_USERNAME,
-                        password=DB_PASSWORD,
-                        host=DB_HOST,
-                        port=DB_PORT,
-                        database=DB_NAME
-                    )
-                    conn.autocommit = False
-                    print("Connected to PostgreSQL database using individual credentials")
-                    return conn
-                except Exception as e:
-                    print(f"PostgreSQL connection error with individual credentials: {e}")
+        if pg_breaker.allow():
+            try:
+                conn = get_pg_pool().getconn()
+                pg_breaker.record_success()
+                return conn
+            except PoolTimeout as e:
+                # PostgreSQL is up but saturated; don't split writes across
+                # backends. Raised so the request gets a 503 (see
+                # database_busy) rather than looking unauthenticated.
+                logger.warning("PostgreSQL pool exhausted: %s", e)
+                raise
+            except Exception as e:
+                logger.error("PostgreSQL connection error: %s", e)
+                pg_breaker.record_failure(e)
     elif not PSYCOPG2_AVAILABLE and (DATABASE_URL or (DB_USERNAME and DB_HOST)):
-        print("PostgreSQL credentials found but psycopg2 is not installed. Falling back to SQLite.")
+        logger.warning("PostgreSQL credentials found but psycopg2 is not installed. Falling back to SQLite.")
     
     # Fall back to SQLite for local testing
     try:
-        print("Using SQLite for local development/testing")
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return sqlite_connections.getconn()
     except Exception as e:
-        print(f"SQLite connection error: {e}")
+        logger.error("SQLite connection error: %s", e)
+        return None
+
+# Bump whenever init_schema() changes. A database whose schema_version row
+# already holds this version skips the schema checks entirely.
+SCHEMA_VERSION = 1
+
+schema_lock = threading.RLock()
+schema_ready = set()  # backends whose schema this process has verified
+schema_owner = None  # thread running ensure_schema()
+
+# Database connection function; the first connection to each backend makes
+# sure its schema is current
+def get_db_connection():
+    started = time.perf_counter()
+    try:
+        conn = open_db_connection()
+    except PoolTimeout:
+        db_acquire_duration.observe(time.perf_counter() - started, "pool_timeout")
+        raise
+    db_acquire_duration.observe(time.perf_counter() - started, conn.backend if conn is not None else "unavailable")
+    if conn is not None and conn.backend not in schema_ready and schema_owner != threading.get_ident():
+        conn.close()
+        ensure_schema()
+        conn = open_db_connection()
+    return conn
+
+def read_schema_version(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT version FROM schema_version WHERE id = 1")
+        row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except Exception:
+        # No schema_version table yet
+        conn.rollback()
         return None
 
+def record_schema_version(conn, version):
+    p = "%s" if is_postgres(conn) else "?"
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)")
+    cursor.execute(
+        f"INSERT INTO schema_version (id, version) VALUES (1, {p}) "
+        f"ON CONFLICT (id) DO UPDATE SET version = excluded.version",
+        (version,)
+    )
+    conn.commit()
+
+# Create or upgrade the schema if the database's recorded version is behind
+# SCHEMA_VERSION. Runs once per backend per process; returns True if it
+# migrated. With `backfill`, typed token columns of old rows are filled in
+# on a background thread afterwards.
+def ensure_schema(backfill=True):
+    global schema_owner
+    with schema_lock:
+        conn = open_db_connection()
+        # Re-entered from init_schema(), or another thread finished first
+        if conn is None or schema_owner is not None or conn.backend in schema_ready:
+            if conn is not None:
+                conn.close()
+            return False
+        schema_owner = threading.get_ident()
+        try:
+            backend = conn.backend
+            try:
+                version = read_schema_version(conn)
+            finally:
+                conn.close()
+            if version is not None and version >= SCHEMA_VERSION:
+                schema_ready.add(backend)
+                return False
+            logger.info("Database schema version %s is behind %s; migrating", version, SCHEMA_VERSION)
+            if not init_schema():
+                # Leave it unverified so the next connection tries again
+                return False
+            conn = open_db_connection()
+            if conn is None:
+                return False
+            try:
+                record_schema_version(conn, SCHEMA_VERSION)
+            except Exception as e:
+                logger.error("Error recording schema version: %s", e)
+            finally:
+                conn.close()
+            schema_ready.add(backend)
+        finally:
+            schema_owner = None
+    if backfill:
+        threading.Thread(target=backfill_token_columns, name="token-column-backfill", daemon=True).start()
+    return True
+
+# Typed columns promoted out of the token_data JSON so expiry sweeps and
+# hot-path reads don't have to parse every blob.
+TOKEN_COLUMNS = {
+    "access_token": "TEXT",
+    "refresh_token": "TEXT",
+    "scope": "TEXT",
+    "expires_at": "DOUBLE PRECISION",
+}
+
+SQLITE_TOKENS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        provider TEXT NOT NULL,
+        token_data TEXT NOT NULL,
+        access_token TEXT,
+        refresh_token TEXT,
+        scope TEXT,
+        expires_at REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, provider)
+    )
+'''
+SQLITE_TOKENS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_tokens_expires_at ON tokens (expires_at)",
+    "CREATE INDEX IF NOT EXISTS idx_tokens_provider ON tokens (provider)",
+]
+
+# Rows per transaction when backfilling typed columns of existing tokens
+TOKEN_MIGRATION_BATCH_SIZE = int(os.environ.get("TOKEN_MIGRATION_BATCH_SIZE", 500))
+# Pause between backfill batches so the migration never monopolizes the database
+TOKEN_MIGRATION_PAUSE = float(os.environ.get("TOKEN_MIGRATION_PAUSE", 0.05))
+
+# Typed column values for a token saved at `saved_at`
+def token_columns(token_data, saved_at):
+    scope = token_data.get("scope")
+    if isinstance(scope, (list, tuple)):
+        scope = " ".join(scope)
+    return (
+        token_data.get("access_token"),
+        token_data.get("refresh_token"),
+        scope,
+        token_expires_at(token_data, saved_at),
+    )
+
 # Initialize database
 def init_db():
     conn = get_db_connection()
@@ -95,7 +593,7 @@ def init_db():
             cursor = conn.cursor()
             
             # Check if we're using PostgreSQL or SQLite
-            if PSYCOPG2_AVAILABLE and isinstance(conn, psycopg2.extensions.connection):
+            if is_postgres(conn):
                 # PostgreSQL table creation
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS tokens (
@@ -103,143 +601,609 @@ def init_db():
                         user_id TEXT NOT NULL,
                         provider TEXT NOT NULL,
                         token_data JSONB NOT NULL,
+                        access_token TEXT,
+                        refresh_token TEXT,
+                        scope TEXT,
+                        expires_at DOUBLE PRECISION,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         UNIQUE(user_id, provider)
                     )
                 """)
-                print("PostgreSQL database initialized successfully")
+                # Upgrade tables created before the typed columns existed;
+                # adding a nullable column is a catalog-only change.
+                for column, column_type in TOKEN_COLUMNS.items():
+                    cursor.execute(f"ALTER TABLE tokens ADD COLUMN IF NOT EXISTS {column} {column_type}")
+                conn.commit()
+                # CONCURRENTLY builds the indexes without blocking writes, but
+                # can't run inside a transaction
+                conn.raw.autocommit = True
+                try:
+                    cursor.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tokens_expires_at ON tokens (expires_at)")
+                    cursor.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tokens_provider ON tokens (provider)")
+                finally:
+                    conn.raw.autocommit = False
+                logger.info("PostgreSQL database initialized successfully")
             else:
                 # SQLite table creation
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS tokens (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id TEXT NOT NULL,
-                        provider TEXT NOT NULL,
-                        token_data TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        UNIQUE(user_id, provider)
-                    )
-                ''')
-                print("SQLite database initialized successfully")
+                cursor.execute(SQLITE_TOKENS_TABLE)
+                existing = {row[1] for row in cursor.execute("PRAGMA table_info(tokens)")}
+                for column, column_type in TOKEN_COLUMNS.items():
+                    if column not in existing:
+                        column_type = "REAL" if column == "expires_at" else column_type
+                        cursor.execute(f"ALTER TABLE tokens ADD COLUMN {column} {column_type}")
+                for statement in SQLITE_TOKENS_INDEXES:
+                    cursor.execute(statement)
+                logger.info("SQLite database initialized successfully")
                 
             conn.commit()
+            return True
         except Exception as e:
-            print(f"Database initialization error: {e}")
+            logger.error("Database initialization error: %s", e)
+            return False
         finally:
             conn.close()
     else:
-        print("Failed to initialize database - no connection")
+        logger.error("Failed to initialize database - no connection")
+        return False
+
+# Fill the typed columns of rows written before they existed. Runs in small
+# committed batches, walking the primary key, so the table stays writable
+# throughout. Rows written meanwhile by save_token already have the columns
+# and are skipped. Returns the number of rows updated.
+def backfill_token_columns(batch_size=TOKEN_MIGRATION_BATCH_SIZE, pause=TOKEN_MIGRATION_PAUSE):
+    last_id = 0
+    migrated = 0
+    while True:
+        conn = get_db_connection()
+        if not conn:
+            return migrated
+        try:
+            p = "%s" if is_postgres(conn) else "?"
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, token_data, updated_at FROM tokens WHERE id > {p} AND access_token IS NULL ORDER BY id LIMIT {p}",
+                (last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return migrated
+            updates = []
+            for row in rows:
+                token_data = row[1]
+                if isinstance(token_data, str):
+                    token_data = json.loads(token_data)
+                updates.append(token_columns(token_data, row[2]) + (row[0],))
+            cursor.executemany(
+                f"UPDATE tokens SET access_token = {p}, refresh_token = {p}, scope = {p}, expires_at = {p} "
+                f"WHERE id = {p} AND access_token IS NULL",
+                updates
+            )
+            conn.commit()
+            last_id = rows[-1][0]
+            migrated += len(rows)
+        except Exception as e:
+            logger.error("Token column backfill error: %s", e)
+            return migrated
+        finally:
+            conn.close()
+        if pause:
+            time.sleep(pause)
 
-# Initialize database on startup
-init_db()
+token_cache = TokenCache(
+    max_size=TOKEN_CACHE_SIZE,
+    default_ttl=TOKEN_CACHE_DEFAULT_TTL,
+    expiry_skew=TOKEN_CACHE_EXPIRY_SKEW,
+)
+token_invalidations = None
+if TOKEN_CACHE_INVALIDATION_PATH:
+    token_invalidations = SQLiteInvalidationChannel(
+        TOKEN_CACHE_INVALIDATION_PATH, token_cache, poll_interval=TOKEN_CACHE_INVALIDATION_POLL
+    )
+
+def token_cache_stats():
+    stats = token_cache.stats()
+    stats["invalidation_channel"] = token_invalidations.stats() if token_invalidations else None
+    return stats
 
 # Helper functions for token storage
+
+# Single-statement upsert: one round trip and no SELECT-then-write race
+# between concurrent callbacks for the same (user_id, provider).
+UPSERT_TOKEN_SQL = """
+    INSERT INTO tokens (user_id, provider, token_data, access_token, refresh_token, scope, expires_at, created_at, updated_at)
+    VALUES ({p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p})
+    ON CONFLICT (user_id, provider) DO UPDATE
+    SET token_data = excluded.token_data, access_token = excluded.access_token,
+        refresh_token = excluded.refresh_token, scope = excluded.scope,
+        expires_at = excluded.expires_at, updated_at = excluded.updated_at
+"""
+UPSERT_TOKEN_SQL_PG = UPSERT_TOKEN_SQL.format(p="%s")
+UPSERT_TOKEN_SQL_SQLITE = UPSERT_TOKEN_SQL.format(p="?")
+UPSERT_TOKENS_SQL_PG_VALUES = """
+    INSERT INTO tokens (user_id, provider, token_data, access_token, refresh_token, scope, expires_at, created_at, updated_at)
+    VALUES %s
+    ON CONFLICT (user_id, provider) DO UPDATE
+    SET token_data = excluded.token_data, access_token = excluded.access_token,
+        refresh_token = excluded.refresh_token, scope = excluded.scope,
+        expires_at = excluded.expires_at, updated_at = excluded.updated_at
+"""
+
+# Rows per statement/page for save_tokens_bulk
+TOKEN_BULK_PAGE_SIZE = int(os.environ.get("TOKEN_BULK_PAGE_SIZE", 1000))
+
+# Token files of the SQLite WAL store: DB_PATH itself, or with several
+# shards tokens.db -> tokens.shard-0-of-4.db, tokens.shard-1-of-4.db, ...
+def token_shard_paths(count):
+    if count == 1:
+        return [DB_PATH]
+    root, ext = os.path.splitext(DB_PATH)
+    return [f"{root}.shard-{index}-of-{count}{ext}" for index in range(count)]
+
+TOKEN_ROW_COLUMNS = "user_id, provider, token_data, access_token, refresh_token, scope, expires_at, created_at, updated_at"
+# Seeding keeps whichever copy of a token was saved last (updated_at has
+# one-second resolution, so on a tie the later source wins)
+SEED_TOKEN_SQL_SQLITE = UPSERT_TOKEN_SQL_SQLITE + "    WHERE excluded.updated_at >= tokens.updated_at\n"
+# The shard count a token file was last set up for, and whether that is
+# still the layout in use (cleared when another shard count takes over)
+SQLITE_TOKEN_LAYOUT_TABLE = '''
+    CREATE TABLE IF NOT EXISTS token_layout (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        shards INTEGER NOT NULL,
+        current INTEGER NOT NULL
+    )
+'''
+
+# Token files of every shard count other than SQLITE_TOKEN_SHARDS, oldest
+# first: the unsharded table, then shard files by last write
+def other_token_files():
+    current = set(token_shard_paths(SQLITE_TOKEN_SHARDS))
+    root, ext = os.path.splitext(DB_PATH)
+    sources = [DB_PATH] + sorted(glob.glob(f"{glob.escape(root)}.shard-*-of-*{ext}"), key=os.path.getmtime)
+    return [path for path in sources if path not in current and os.path.exists(path)]
+
+# Mark the files of other shard counts as out of date, so that switching
+# back to one of them merges the tokens saved in the meantime
+def retire_token_files():
+    for path in other_token_files():
+        source = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT)
+        try:
+            with source:
+                source.execute("UPDATE token_layout SET current = 0 WHERE current = 1")
+        except sqlite3.OperationalError:
+            # No layout recorded in this file; it is merged from anyway
+            pass
+        finally:
+            source.close()
+
+# Merge shard `index`'s tokens from the files of every other shard count
+# into `conn`, keeping the most recently saved copy of each. Returns the
+# rows copied.
+def seed_token_shard(index, conn):
+    copied = 0
+    for path in other_token_files():
+        source = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT)
+        try:
+            source.create_function("shard_index", 1, lambda key: shard_index(key, SQLITE_TOKEN_SHARDS), deterministic=True)
+            try:
+                cursor = source.execute(f"SELECT {TOKEN_ROW_COLUMNS} FROM tokens WHERE shard_index(user_id) = ?", (index,))
+            except sqlite3.OperationalError:
+                # No tokens table in this file
+                continue
+            while True:
+                rows = cursor.fetchmany(TOKEN_MIGRATION_BATCH_SIZE)
+                if not rows:
+                    break
+                for i, row in enumerate(rows):
+                    if row[3] is None:
+                        # Not backfilled in the source; fill the typed columns now
+                        rows[i] = row[:3] + token_columns(json.loads(row[2]), row[8]) + row[7:]
+                conn.executemany(SEED_TOKEN_SQL_SQLITE, rows)
+                copied += len(rows)
+        finally:
+            source.close()
+    return copied
+
+# Runs once per token file and process before its first use. A file that
+# is new, or was last used with another shard count, is merged from the
+# files of the other shard counts, so changing SQLITE_TOKEN_SHARDS (back
+# and forth) always serves the latest copy of each token.
+def setup_token_shard(index, conn):
+    # Before merging: should this process die halfway, the other files are
+    # already marked, and this one is merged again on the next start
+    retire_token_files()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(SQLITE_TOKENS_TABLE)
+        for statement in SQLITE_TOKENS_INDEXES:
+            conn.execute(statement)
+        conn.execute(SQLITE_TOKEN_LAYOUT_TABLE)
+        layout = conn.execute("SELECT shards, current FROM token_layout").fetchone()
+        stale = layout is None or tuple(layout) != (SQLITE_TOKEN_SHARDS, 1)
+        copied = seed_token_shard(index, conn) if stale else 0
+        conn.execute(
+            "INSERT INTO token_layout (id, shards, current) VALUES (1, ?, 1) "
+            "ON CONFLICT (id) DO UPDATE SET shards = excluded.shards, current = 1",
+            (SQLITE_TOKEN_SHARDS,)
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if stale:
+        logger.info("Merged %s tokens into token shard %s", copied, os.path.basename(token_shard_paths(SQLITE_TOKEN_SHARDS)[index]))
+
+sqlite_tokens = None
+if SQLITE_WAL:
+    sqlite_tokens = SQLiteShards(
+        token_shard_paths(SQLITE_TOKEN_SHARDS),
+        connect_sqlite,
+        setup=setup_token_shard,
+        max_batch=SQLITE_GROUP_COMMIT_MAX,
+        max_delay=SQLITE_GROUP_COMMIT_DELAY,
+    )
+
+# Connection for reading `user_id`'s tokens: its shard's reader under the
+# SQLite WAL store, otherwise the regular database connection
+def get_token_connection(user_id):
+    conn = get_db_connection()
+    if conn is None or sqlite_tokens is None or is_postgres(conn):
+        return conn
+    conn.close()
+    try:
+        return sqlite_tokens.reader(user_id)
+    except Exception as e:
+        logger.error("SQLite token shard connection error: %s", e)
+        return None
+
+# Connections that between them hold every token (one per shard under the
+# SQLite WAL store)
+def get_token_connections():
+    conn = get_db_connection()
+    if conn is None:
+        return []
+    if sqlite_tokens is None or is_postgres(conn):
+        return [conn]
+    conn.close()
+    try:
+        return sqlite_tokens.readers()
+    except Exception as e:
+        logger.error("SQLite token shard connection error: %s", e)
+        return []
+
+# Write through the cache and tell other workers to drop their copies
+def publish_saved_tokens(saved, now):
+    for user_id, provider, token_data in saved:
+        token_cache.invalidate(user_id, provider)
+        token_cache.put(user_id, provider, token_data, token_expires_at(token_data, now))
+    if token_invalidations:
+        try:
+            token_invalidations.publish_many((user_id, provider) for user_id, provider, _ in saved)
+        except Exception as e:
+            logger.error("Error publishing token invalidation: %s", e)
+
 def save_token(user_id, provider, token_data):
     conn = get_db_connection()
     if not conn:
         return False
     
     try:
+        started = time.perf_counter()
         cursor = conn.cursor()
         # Convert token_data to JSON string
         token_data_str = json.dumps(token_data)
         # Current timestamp
         now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        # Check if we're using PostgreSQL or SQLite
-        if isinstance(conn, psycopg2.extensions.connection):
-            # PostgreSQL operations
-            # Check if token already exists
-            cursor.execute(
-                "SELECT id FROM tokens WHERE user_id = %s AND provider = %s", 
-                (user_id, provider)
-            )
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing token
-                cursor.execute(
-                    "UPDATE tokens SET token_data = %s, updated_at = %s WHERE user_id = %s AND provider = %s",
-                    (token_data_str, now, user_id, provider)
-                )
-            else:
-                # Insert new token
-                cursor.execute(
-                    "INSERT INTO tokens (user_id, provider, token_data, created_at, updated_at) VALUES (%s, %s, %s, %s, %s)",
-                    (user_id, provider, token_data_str, now, now)
-                )
+        params = (user_id, provider, token_data_str) + token_columns(token_data, now) + (now, now)
+        if is_postgres(conn):
+            cursor.execute(UPSERT_TOKEN_SQL_PG, params)
+        elif sqlite_tokens is not None:
+            # Committed together with whatever other writes are queued for the shard
+            sqlite_tokens.write(user_id, lambda db: db.execute(UPSERT_TOKEN_SQL_SQLITE, params))
         else:
-            # SQLite operations
-            # Check if token already exists
-            cursor.execute(
-                "SELECT id FROM tokens WHERE user_id = ? AND provider = ?", 
-                (user_id, provider)
-            )
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing token
-                cursor.execute(
-                    "UPDATE tokens SET token_data = ?, updated_at = ? WHERE user_id = ? AND provider = ?",
-                    (token_data_str, now, user_id, provider)
+            cursor.execute(UPSERT_TOKEN_SQL_SQLITE, params)
+        
+        conn.commit()
+        token_query_duration.observe(time.perf_counter() - started, "save_token", conn.backend)
+        publish_saved_tokens([(user_id, provider, token_data)], now)
+        return True
+    except Exception as e:
+        logger.error("Error saving token: %s", e, extra={"user_id": user_id, "provider": provider})
+        return False
+    finally:
+        conn.close()
+
+# Save many tokens in one transaction. `tokens` is an iterable of
+# (user_id, provider, token_data) tuples; if a key appears more than once the
+# last value wins. Returns the number of tokens written, or False on failure.
+def save_tokens_bulk(tokens):
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    saved = []
+    try:
+        started = time.perf_counter()
+        cursor = conn.cursor()
+        postgres = is_postgres(conn)
+        page = {}
+        
+        def flush():
+            rows = [
+                (user_id, provider, json.dumps(token_data)) + token_columns(token_data, now) + (now, now)
+                for (user_id, provider), token_data in page.items()
+            ]
+            if postgres:
+                # execute_values sends one multi-row INSERT per page
+                psycopg2.extras.execute_values(
+                    cursor, UPSERT_TOKENS_SQL_PG_VALUES, rows, page_size=TOKEN_BULK_PAGE_SIZE
                 )
+            elif sqlite_tokens is not None:
+                # One group-commit write per shard, written in parallel
+                by_shard = {}
+                for row in rows:
+                    by_shard.setdefault(sqlite_tokens.shard(row[0]), []).append(row)
+                futures = [
+                    sqlite_tokens.submit(index, lambda db, shard_rows=shard_rows: db.executemany(UPSERT_TOKEN_SQL_SQLITE, shard_rows))
+                    for index, shard_rows in by_shard.items()
+                ]
+                for future in futures:
+                    future.result()
             else:
-                # Insert new token
-                cursor.execute(
-                    "INSERT INTO tokens (user_id, provider, token_data, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
-                    (user_id, provider, token_data_str, now, now)
-                )
+                cursor.executemany(UPSERT_TOKEN_SQL_SQLITE, rows)
+            saved.extend((user_id, provider, token_data) for (user_id, provider), token_data in page.items())
+            page.clear()
+        
+        for user_id, provider, token_data in tokens:
+            key = (user_id, provider)
+            # PostgreSQL rejects a multi-row upsert that touches one key twice
+            if key in page:
+                del page[key]
+            page[key] = token_data
+            if len(page) >= TOKEN_BULK_PAGE_SIZE:
+                flush()
+        if page:
+            flush()
         
         conn.commit()
-        return True
+        token_query_duration.observe(time.perf_counter() - started, "save_tokens_bulk", conn.backend)
     except Exception as e:
-        print(f"Error saving token: {e}")
+        logger.error("Error saving tokens in bulk: %s", e)
         return False
     finally:
         conn.close()
+    
+    publish_saved_tokens(saved, now)
+    return len(saved)
 
 def get_token(user_id, provider):
-    conn = get_db_connection()
+    cached = token_cache.get(user_id, provider)
+    if cached is not None:
+        return cached
+    # Remember the cache version so a concurrent save_token wins over this read
+    cache_version = token_cache.version(user_id, provider)
+    
+    conn = get_token_connection(user_id)
     if not conn:
         return None
     
     try:
+        started = time.perf_counter()
         cursor = conn.cursor()
         
         # Check if we're using PostgreSQL or SQLite
-        if isinstance(conn, psycopg2.extensions.connection):
+        if is_postgres(conn):
             # PostgreSQL operations
             cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
             cursor.execute(
-                "SELECT token_data FROM tokens WHERE user_id = %s AND provider = %s",
+                "SELECT token_data, expires_at, updated_at FROM tokens WHERE user_id = %s AND provider = %s",
                 (user_id, provider)
             )
         else:
             # SQLite operations
             cursor.execute(
-                "SELECT token_data FROM tokens WHERE user_id = ? AND provider = ?",
+                "SELECT token_data, expires_at, updated_at FROM tokens WHERE user_id = ? AND provider = ?",
                 (user_id, provider)
             )
             
         result = cursor.fetchone()
+        token_query_duration.observe(time.perf_counter() - started, "get_token", conn.backend)
         
         if result:
-            # Parse JSON string back to dictionary
-            return json.loads(result['token_data'])
+            # Parse JSON string back to dictionary (psycopg2 already decodes JSONB)
+            token_data = result['token_data']
+            if isinstance(token_data, str):
+                token_data = json.loads(token_data)
+            expires_at = result['expires_at']
+            if expires_at is None:
+                # Row not backfilled yet
+                expires_at = token_expires_at(token_data, result['updated_at'])
+            token_cache.put(user_id, provider, token_data, expires_at, version=cache_version)
+            return token_data
         return None
     except Exception as e:
-        print(f"Error getting token: {e}")
+        logger.error("Error getting token: %s", e, extra={"user_id": user_id, "provider": provider})
         return None
     finally:
         conn.close()
 
+# Access tokens resolved once per JSON-RPC batch and shared by its calls
+shared_access_tokens = contextvars.ContextVar("shared_access_tokens", default=None)
+
+# Hot-path lookup for tool calls: reads only the typed access_token column
+# instead of fetching and decoding the whole token_data blob.
+def get_access_token(user_id, provider):
+    # Tokens already resolved for the current JSON-RPC batch
+    shared = shared_access_tokens.get()
+    if shared is not None and (user_id, provider) in shared:
+        return shared[(user_id, provider)]
+    cached = token_cache.get(user_id, provider, allow_partial=True)
+    if cached is not None:
+        return cached.get("access_token")
+    cache_version = token_cache.version(user_id, provider)
+    
+    conn = get_token_connection(user_id)
+    if not conn:
+        return None
+    
+    try:
+        started = time.perf_counter()
+        cursor = conn.cursor()
+        p = "%s" if is_postgres(conn) else "?"
+        cursor.execute(
+            f"SELECT access_token, expires_at FROM tokens WHERE user_id = {p} AND provider = {p}",
+            (user_id, provider)
+        )
+        result = cursor.fetchone()
+        token_query_duration.observe(time.perf_counter() - started, "get_access_token", conn.backend)
+    except Exception as e:
+        logger.error("Error getting access token: %s", e, extra={"user_id": user_id, "provider": provider})
+        return None
+    finally:
+        conn.close()
+    
+    if not result:
+        return None
+    access_token, expires_at = result[0], result[1]
+    if access_token is None:
+        # Row not backfilled yet; fall back to the JSON blob
+        token_data = get_token(user_id, provider)
+        return token_data.get("access_token") if token_data else None
+    token_cache.put(
+        user_id, provider, {"access_token": access_token}, expires_at,
+        version=cache_version, partial=True
+    )
+    return access_token
+
+# Tokens with a refresh_token that expire within `within` seconds. Uses the
+# indexed expires_at column, so only the expiring rows are read and decoded.
+def list_expiring_tokens(within):
+    conns = get_token_connections()
+    if not conns:
+        return []
+    
+    deadline = time.time() + within
+    rows = []
+    try:
+        for conn in conns:
+            cursor = conn.cursor()
+            p = "%s" if is_postgres(conn) else "?"
+            cursor.execute(
+                f"SELECT user_id, provider, token_data, expires_at FROM tokens "
+                f"WHERE expires_at <= {p} AND refresh_token IS NOT NULL ORDER BY expires_at",
+                (deadline,)
+            )
+            rows.extend(cursor.fetchall())
+    except Exception as e:
+        logger.error("Error listing expiring tokens: %s", e)
+        return []
+    finally:
+        for conn in conns:
+            conn.close()
+    if len(conns) > 1:
+        # Merge the shards' results
+        rows.sort(key=lambda row: row[3])
+    
+    expiring = []
+    for user_id, provider, token_data, _ in rows:
+        if isinstance(token_data, str):
+            token_data = json.loads(token_data)
+        expiring.append((user_id, provider, token_data))
+    return expiring
+
+# Exchange a refresh token for a new access token and store it
+def refresh_google_token(user_id, provider, token_data):
+    if provider != "google":
+        return False
+    response = upstream.post(
+        TOKEN_URL,
+        endpoint="oauth.refresh",
+        data={
+            "grant_type": "refresh_token",
+            "refresh_token": token_data["refresh_token"],
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+        }
+    )
+    if response.status_code != 200:
+        logger.warning("Token refresh failed for %s/%s: %s %s", user_id, provider, response.status_code, response.text)
+        return False
+    # Google usually omits refresh_token on refresh, so keep the one we have
+    refreshed = dict(token_data)
+    refreshed.update(response.json())
+    return save_token(user_id, provider, refreshed)
+
+token_refresher = TokenRefresher(
+    list_expiring_tokens,
+    refresh_google_token,
+    interval=TOKEN_REFRESH_INTERVAL,
+    lead_time=TOKEN_REFRESH_LEAD_TIME,
+    max_workers=TOKEN_REFRESH_WORKERS,
+    jitter=TOKEN_REFRESH_JITTER,
+)
+
+# Call a Google API on behalf of `user_id`, through its rate limit bucket.
+# `cost` is the number of API calls the request counts for (batch requests).
+def call_google(method, api, user_id, url, endpoint, cost=1, max_wait=None, **kwargs):
+    rate_limiter.acquire(user_id, api, cost, max_wait=max_wait)
+    response = upstream.request(method, url, endpoint=endpoint, **kwargs)
+    rate_limiter.record(user_id, api, response.status_code, parse_retry_after(response.headers.get("Retry-After")))
+    return response
+
+def post_google(api, user_id, url, endpoint, cost=1, max_wait=None, **kwargs):
+    return call_google("POST", api, user_id, url, endpoint, cost=cost, max_wait=max_wait, **kwargs)
+
+# Calls held back by our own rate limiter (as opposed to a 429 from Google)
+@app.errorhandler(RateLimited)
+def rate_limited(e):
+    response = jsonify({"error": "Rate limited", "throttled_by": "local", "retry_after": round(e.retry_after, 3)})
+    response.headers["Retry-After"] = str(max(1, int(e.retry_after + 0.999)))
+    return response, 429
+
+# The database connection pool stayed exhausted for DB_POOL_TIMEOUT seconds:
+# the database is overloaded, so tell the client to retry (not to re-auth)
+@app.errorhandler(PoolTimeout)
+def database_busy(e):
+    response = jsonify({"error": "Database busy", "details": str(e)})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+# Upstream Google calls that time out or fail at the transport level.
+# Registered for OSError, which requests' exceptions derive from, so that
+# requests isn't imported just to name the class.
+@app.errorhandler(OSError)
+def upstream_error(e):
+    if not isinstance(e, requests.RequestException):
+        raise e
+    status = 504 if isinstance(e, requests.Timeout) else 502
+    return jsonify({"error": "Upstream request failed", "details": str(e)}), status
+
+# Pending authorizations live in the database, so the callback can be served
+# by any worker or process
+oauth_states = OAuthStateStore(get_db_connection, is_postgres, ttl=OAUTH_STATE_TTL)
+
 # Start OAuth2 flow
 @app.route("/authorize/<provider>")
 def authorize(provider):
     if provider == "google":
-        auth_uri = client.prepare_request_uri(AUTH_URL, redirect_uri=REDIRECT_URI, scope=SCOPE)
+        user_id = request.args.get("user_id", "demo_user")  # In production, get from authentication
+        code_verifier = new_code_verifier()
+        state = oauth_states.create(provider, user_id, code_verifier)
+        if not state:
+            return jsonify({"error": "Failed to start authorization"}), 503
+        # A fresh client per request: WebApplicationClient keeps per-flow state
+        auth_uri = oauth2.WebApplicationClient(CLIENT_ID).prepare_request_uri(
+            AUTH_URL,
+            redirect_uri=REDIRECT_URI,
+            scope=SCOPE,
+            state=state,
+            code_challenge=code_challenge(code_verifier),
+            code_challenge_method="S256",
+            # Ask for a refresh token so the proactive refresher can keep access tokens fresh
+            access_type="offline"
+        )
         return redirect(auth_uri)
     else:
         return jsonify({"error": f"Provider {provider} not supported"}), 400
@@ -247,27 +1211,38 @@ def authorize(provider):
 # OAuth2 callback
 @app.route("/auth/google/callback")
 def google_callback():
+    if request.args.get("error"):
+        return jsonify({"success": False, "message": f"Authorization failed: {request.args['error']}"}), 400
+    
+    # The state must match a pending authorization; it can only be used once
+    pending = oauth_states.consume("google", request.args.get("state"))
+    if pending is None:
+        return jsonify({"success": False, "message": "Invalid or expired OAuth state"}), 400
+    
     # Get the authorization code from the request
     code = request.args.get("code")
+    if not code:
+        return jsonify({"success": False, "message": "Missing authorization code"}), 400
     
-    # Prepare the token request
-    token_request_body = client.prepare_token_request(
-        TOKEN_URL, authorization_response=request.url, redirect_url=REDIRECT_URI, code=code
-    )
-    
-    # Exchange the authorization code for tokens
-    token_response = requests.post(
-        token_request_body[0],
-        headers=token_request_body[1],
-        data=token_request_body[2],
+    # Exchange the authorization code (and PKCE verifier) for tokens
+    oauth_client = oauth2.WebApplicationClient(CLIENT_ID)
+    token_response = upstream.post(
+        TOKEN_URL,
+        endpoint="oauth.token",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data=oauth_client.prepare_request_body(
+            code=code, redirect_uri=REDIRECT_URI, code_verifier=pending["code_verifier"]
+        ),
         auth=(CLIENT_ID, CLIENT_SECRET)
     )
     
     # Parse the token response
-    client.parse_request_body_response(json.dumps(token_response.json()))
+    try:
+        oauth_client.parse_request_body_response(token_response.text)
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Token exchange failed: {e}"}), 502 if token_response.status_code >= 500 else 400
     
-    # For demo purposes, using a fixed user_id - in production use real user authentication
-    user_id = "demo_user"
+    user_id = pending["user_id"]
     
     # Save the token to the database
     token_data = token_response.json()
@@ -276,76 +1251,963 @@ def google_callback():
     else:
         return jsonify({"success": False, "message": "Failed to save authentication token"}), 500
 
-# Tool: Send email
-@app.route("/tools/send-email", methods=["POST"])
-def send_email():
-    # Get request data
-    data = request.json
+# Send one message through the Gmail API; returns the upstream response
+def send_gmail_message(user_id, access_token, to, subject, body, max_wait=None, attachments=()):
+    message = MimeMessage(to, subject, body, attachments)
+    try:
+        length = message.content_length()
+        if length is not None and length > GMAIL_MAX_MESSAGE_BYTES:
+            raise MessageTooLarge(f"Message is {length} bytes; the limit is {GMAIL_MAX_MESSAGE_BYTES}")
+        if length is not None and length <= GMAIL_RAW_MAX_BYTES:
+            # Small enough to encode in memory
+            return post_google(
+                "gmail",
+                user_id,
+                GMAIL_SEND_URL,
+                endpoint="gmail.send",
+                max_wait=max_wait,
+                headers={"Authorization": f"Bearer {access_token}"},
+                json={"raw": base64.urlsafe_b64encode(b"".join(message)).decode()}
+            )
+        if length is not None and length <= GMAIL_RESUMABLE_THRESHOLD:
+            return upload_gmail_multipart(user_id, access_token, message, length, max_wait)
+        return upload_gmail_resumable(user_id, access_token, message, length, max_wait)
+    finally:
+        message.close()
+
+# Stream a message of known length in one multipart/related upload request
+def upload_gmail_multipart(user_id, access_token, message, length, max_wait=None):
+    boundary = f"upload_{message.boundary}"
+    prefix = (
+        f"--{boundary}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n{{}}\r\n"
+        f"--{boundary}\r\nContent-Type: message/rfc822\r\n\r\n"
+    ).encode()
+    suffix = f"\r\n--{boundary}--\r\n".encode()
+    chunks = itertools.chain([prefix], message, [suffix])
+    return post_google(
+        "gmail",
+        user_id,
+        f"{GMAIL_UPLOAD_URL}?uploadType=multipart",
+        endpoint="gmail.upload",
+        max_wait=max_wait,
+        headers={
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": f'multipart/related; boundary="{boundary}"',
+        },
+        data=StreamingBody(chunks, len(prefix) + length + len(suffix))
+    )
+
+# Upload a message in GMAIL_UPLOAD_CHUNK_SIZE pieces through a resumable
+# session. Only about two chunks are held in memory; `length` may be None
+# when an attachment's size isn't known until it has been read.
+def upload_gmail_resumable(user_id, access_token, message, length=None, max_wait=None):
+    headers = {"Authorization": f"Bearer {access_token}", "X-Upload-Content-Type": "message/rfc822"}
+    if length is not None:
+        headers["X-Upload-Content-Length"] = str(length)
+    started = post_google(
+        "gmail",
+        user_id,
+        f"{GMAIL_UPLOAD_URL}?uploadType=resumable",
+        endpoint="gmail.upload",
+        max_wait=max_wait,
+        headers=headers,
+        json={}
+    )
+    session_url = started.headers.get("Location")
+    if started.status_code != 200 or not session_url:
+        return started
+
+    chunks = iter_fixed_chunks(limit_chunks(message, GMAIL_MAX_MESSAGE_BYTES), GMAIL_UPLOAD_CHUNK_SIZE)
+    offset = 0
+    chunk = next(chunks, b"")
+    while True:
+        # Look one chunk ahead so the last one can carry the total size
+        following = next(chunks, None)
+        end = offset + len(chunk)
+        total = str(end) if following is None else "*"
+        content_range = f"bytes {offset}-{end - 1}/{total}" if chunk else f"bytes */{total}"
+        response = upstream.request(
+            "PUT",
+            session_url,
+            endpoint="gmail.upload_chunk",
+            headers={"Authorization": f"Bearer {access_token}", "Content-Range": content_range},
+            data=chunk
+        )
+        if response.status_code != 308:
+            return response
+        # 308 Resume Incomplete: Range says how much Google has persisted;
+        # there is no Range while nothing has been
+        persisted = response.headers.get("Range")
+        committed = int(persisted.rsplit("-", 1)[1]) + 1 if persisted else 0
+        if committed < offset:
+            # Google dropped bytes from earlier chunks, which the stream can't replay
+            raise requests.RequestException(
+                f"Resumable upload lost persisted bytes (Google has {committed}, {offset} were sent)"
+            )
+        if committed >= end and following is None:
+            return response
+        if committed < end:
+            # Resend what wasn't persisted, re-chunked to keep the 256 KiB multiple
+            rest = [chunk[committed - offset:]] + ([following] if following is not None else [])
+            chunks = iter_fixed_chunks(itertools.chain(rest, chunks), GMAIL_UPLOAD_CHUNK_SIZE)
+            following = next(chunks, b"")
+        offset = committed
+        chunk = following
+
+# Refuse addresses in our own network (loopback, private, link-local such as
+# cloud metadata endpoints, ...); raises ValueError
+def check_attachment_address(host, address):
+    address = ipaddress.ip_address(address.split("%", 1)[0])
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    if not address.is_global or address.is_multicast:
+        raise ValueError(f"Attachment host is not allowed: {host}")
+
+# Refuse attachment URLs whose host resolves into our own network; raises ValueError
+def check_attachment_url(url):
+    parts = urllib.parse.urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise ValueError(f"Unsupported attachment URL: {url}")
+    if ATTACHMENT_ALLOWED_HOSTS:
+        if host not in ATTACHMENT_ALLOWED_HOSTS:
+            raise ValueError(f"Attachment host is not allowed: {host}")
+        return
+    try:
+        infos = socket.getaddrinfo(host, parts.port or (443 if parts.scheme == "https" else 80), proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise ValueError(f"Can't resolve attachment host {host}: {e}")
+    for info in infos:
+        check_attachment_address(host, info[4][0])
+
+# The connection is made after a second lookup of the host, which a DNS
+# rebinding host can answer differently, so the address actually connected
+# to is checked too, before any of the body is read
+def check_attachment_peer(url, response):
+    if ATTACHMENT_ALLOWED_HOSTS:
+        return
+    host = (urllib.parse.urlsplit(url).hostname or "").lower()
+    sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is None:
+        # After "Connection: close" http.client hands the socket over to the
+        # response's file object
+        reader = getattr(getattr(response.raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(reader, "raw", None), "_sock", None)
+    if sock is None:
+        raise ValueError(f"Can't verify the address of attachment host {host}")
+    check_attachment_address(host, sock.getpeername()[0])
+
+# GET an attachment URL, checking every redirect hop
+def fetch_attachment(url, **kwargs):
+    kwargs["stream"] = True
+    for _ in range(ATTACHMENT_MAX_REDIRECTS + 1):
+        check_attachment_url(url)
+        response = upstream.get(url, endpoint="attachment.fetch", allow_redirects=False, **kwargs)
+        try:
+            check_attachment_peer(url, response)
+        except ValueError:
+            response.close()
+            raise
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urllib.parse.urljoin(url, response.headers["Location"])
+    raise ValueError(f"Too many redirects fetching attachment: {url}")
+
+# Attachments from a tool call: werkzeug uploads, or {"url", "filename"?, "content_type"?}
+def open_attachments(specs):
+    attachments = []
+    try:
+        for spec in specs or []:
+            if hasattr(spec, "stream") and hasattr(spec, "filename"):
+                attachments.append(Attachment.from_upload(spec))
+            elif isinstance(spec, dict) and spec.get("url"):
+                attachments.append(Attachment.from_url(
+                    fetch_attachment, spec["url"], spec.get("filename"), spec.get("content_type"),
+                ))
+            else:
+                raise ValueError("Each attachment must be an uploaded file or an object with a 'url'")
+    except Exception:
+        for attachment in attachments:
+            attachment.close()
+        raise
+    return attachments
+
+# Send-email tool; returns (response_body, status_code)
+def send_email_tool(data):
     to = data.get("to")
     subject = data.get("subject")
     body = data.get("body")
     user_id = data.get("user_id", "demo_user")  # In production, get from authentication
     
     # Get user token from database
-    token_data = get_token(user_id, "google")
-    if not token_data:
-        return jsonify({"error": "Not authenticated"}), 401
+    access_token = get_access_token(user_id, "google")
+    if not access_token:
+        return {"error": "Not authenticated"}, 401
     
-    # Create Gmail API message (simplified)
-    email_content = f"To: {to}\nSubject: {subject}\n\n{body}"
-    message = {
-        "raw": base64.urlsafe_b64encode(email_content.encode()).decode()
-    }
+    try:
+        attachments = open_attachments(data.get("attachments"))
+    except (ValueError, requests.RequestException) as e:
+        return {"error": "Failed to load attachment", "details": str(e)}, 400
+    try:
+        response = send_gmail_message(user_id, access_token, to, subject, body, attachments=attachments)
+    except MessageTooLarge as e:
+        return {"error": "Email too large", "details": str(e)}, 413
+    
+    if response.status_code == 200:
+        return {"success": True, "message": "Email sent successfully"}, 200
+    else:
+        return {"error": "Failed to send email", "details": response.text}, response.status_code
+
+# Tool: Send email
+@app.route("/tools/send-email", methods=["POST"])
+def send_email():
+    # Get request data; multipart/form-data carries uploaded attachments
+    if request.files:
+        data = request.form.to_dict()
+        try:
+            data["attachments"] = json.loads(data["attachments"]) if data.get("attachments") else []
+        except ValueError as e:
+            return jsonify({"error": "Invalid attachments field", "details": str(e)}), 400
+        if not isinstance(data["attachments"], list):
+            return jsonify({"error": "Invalid attachments field", "details": "Expected a JSON array"}), 400
+        data["attachments"] += [upload for name in request.files for upload in request.files.getlist(name)]
+        if wants_async(data):
+            return jsonify({"error": "Uploaded attachments can't be sent asynchronously; pass them as URLs"}), 400
+    else:
+        data = request.json
+    return run_tool_request("send_email", send_email_tool, data)
+
+# Shared worker pool for batch sends, so total Gmail concurrency per process
+# stays bounded no matter how many batches arrive at once
+email_batch_executor = ThreadPoolExecutor(max_workers=EMAIL_BATCH_CONCURRENCY, thread_name_prefix="email-batch")
+
+# Send one batch item; never raises, so one failure can't abort the batch
+def send_batch_item(index, item, user_id, access_token):
+    result = {"index": index, "to": item.get("to")}
+    if not access_token:
+        result.update({"success": False, "status": 401, "error": "Not authenticated"})
+        return result
+    try:
+        response = send_gmail_message(
+            user_id, access_token, item.get("to"), item.get("subject"), item.get("body"),
+            max_wait=RATE_LIMIT_BATCH_MAX_WAIT
+        )
+    except RateLimited as e:
+        result.update({"success": False, "status": 429, "error": "Rate limited", "throttled_by": "local",
+                       "retry_after": round(e.retry_after, 3)})
+        return result
+    except requests.RequestException as e:
+        status = 504 if isinstance(e, requests.Timeout) else 502
+        result.update({"success": False, "status": status, "error": "Upstream request failed", "details": str(e)})
+        return result
+    except MessageTooLarge as e:
+        result.update({"success": False, "status": 413, "error": "Email too large", "details": str(e)})
+        return result
+    except Exception as e:
+        logger.exception("Batch item %s failed: %s", index, e)
+        result.update({"success": False, "status": 500, "error": "Failed to send email", "details": str(e)})
+        return result
+    if response.status_code != 200:
+        result.update({"success": False, "status": response.status_code, "error": "Failed to send email", "details": response.text})
+        return result
+    try:
+        message_id = response.json().get("id")
+    except ValueError:
+        result.update({"success": False, "status": 502, "error": "Invalid upstream response", "details": response.text[:500]})
+        return result
+    result.update({"success": True, "status": 200, "id": message_id})
+    return result
+
+# Tool: Send many emails in one request
+@app.route("/tools/send-email/batch", methods=["POST"])
+def send_email_batch():
+    data = request.json or {}
+    messages = data.get("messages")
+    default_user_id = data.get("user_id", "demo_user")  # In production, get from authentication
+    if not isinstance(messages, list) or not messages or not all(isinstance(item, dict) for item in messages):
+        return jsonify({"error": "'messages' must be a non-empty list of objects"}), 400
+    if len(messages) > EMAIL_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Batch exceeds {EMAIL_BATCH_MAX_ITEMS} messages"}), 400
     
-    # Call Gmail API
-    response = requests.post(
-        "https://www.googleapis.com/gmail/v1/users/me/messages/send",
-        headers={"Authorization": f"Bearer {token_data['access_token']}"},
-        json=message
+    # Resolve each user's token once for the whole batch
+    access_tokens = {}
+    for item in messages:
+        user_id = item.get("user_id", default_user_id)
+        if user_id not in access_tokens:
+            access_tokens[user_id] = get_access_token(user_id, "google")
+    
+    # Items run in a copy of this request's context, so their logs keep its correlation id
+    futures = [
+        email_batch_executor.submit(
+            contextvars.copy_context().run, send_batch_item, index, item, item.get("user_id", default_user_id),
+            access_tokens[item.get("user_id", default_user_id)]
+        )
+        for index, item in enumerate(messages)
+    ]
+    # Results come back in input order regardless of completion order
+    results = [future.result() for future in futures]
+    succeeded = sum(1 for result in results if result["success"])
+    return jsonify({
+        "success": succeeded == len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    })
+
+# Build a Calendar API event from tool input
+def build_calendar_event(data):
+    return {
+        "summary": data.get("summary"),
+        "location": data.get("location", ""),
+        "description": data.get("description", ""),
+        "start": {"dateTime": data.get("start_time"), "timeZone": "America/New_York"},
+        "end": {"dateTime": data.get("end_time"), "timeZone": "America/New_York"}
+    }
+
+# Insert one event through the Calendar API; returns the upstream response
+def insert_calendar_event(user_id, access_token, event):
+    return post_google(
+        "calendar",
+        user_id,
+        CALENDAR_EVENTS_URL,
+        endpoint="calendar.insert",
+        headers={"Authorization": f"Bearer {access_token}"},
+        json=event
     )
+
+# Create-event tool; returns (response_body, status_code)
+def create_event_tool(data):
+    user_id = data.get("user_id", "demo_user")  # In production, get from authentication
+    
+    # Get user token from database
+    access_token = get_access_token(user_id, "google")
+    if not access_token:
+        return {"error": "Not authenticated"}, 401
+    
+    # Create Calendar API event
+    event = build_calendar_event(data)
+    
+    # Call Calendar API
+    response = insert_calendar_event(user_id, access_token, event)
     
     if response.status_code == 200:
-        return jsonify({"success": True, "message": "Email sent successfully"})
+        # The next calendar read should sync instead of trusting the cache
+        calendar_events.mark_stale(user_id)
+        return {"success": True, "event": response.json()}, 200
     else:
-        return jsonify({"error": "Failed to send email", "details": response.text}), response.status_code
+        return {"error": "Failed to create event", "details": response.text}, response.status_code
 
 # Tool: Create calendar event
 @app.route("/tools/create-event", methods=["POST"])
 def create_event():
     # Get request data
     data = request.json
-    summary = data.get("summary")
-    start_time = data.get("start_time")
-    end_time = data.get("end_time")
-    description = data.get("description", "")
-    location = data.get("location", "")
+    return run_tool_request("create_event", create_event_tool, data)
+
+calendar_batch_executor = ThreadPoolExecutor(max_workers=CALENDAR_BATCH_CONCURRENCY, thread_name_prefix="calendar-batch")
+
+# Send one multipart batch of event inserts; returns a result per event.
+# `chunk` is a list of (index, event) pairs.
+def insert_calendar_events_batch(user_id, access_token, chunk):
+    batch_body, content_type = build_batch_request(
+        (f"item-{index}", "POST", CALENDAR_EVENTS_PATH, event) for index, event in chunk
+    )
+    try:
+        # Google counts every call inside a batch against the quota
+        response = post_google(
+            "calendar",
+            user_id,
+            CALENDAR_BATCH_URL,
+            endpoint="calendar.batch",
+            cost=len(chunk),
+            max_wait=RATE_LIMIT_BATCH_MAX_WAIT,
+            headers={"Authorization": f"Bearer {access_token}", "Content-Type": content_type},
+            data=batch_body
+        )
+    except RateLimited as e:
+        return [
+            {"index": index, "success": False, "status": 429, "error": "Rate limited", "throttled_by": "local",
+             "retry_after": round(e.retry_after, 3)}
+            for index, _ in chunk
+        ]
+    except requests.RequestException as e:
+        status = 504 if isinstance(e, requests.Timeout) else 502
+        return [
+            {"index": index, "success": False, "status": status, "error": "Upstream request failed", "details": str(e)}
+            for index, _ in chunk
+        ]
+    if response.status_code != 200:
+        # The whole batch was rejected (e.g. bad credentials)
+        return [
+            {"index": index, "success": False, "status": response.status_code,
+             "error": "Failed to create event", "details": response.text}
+            for index, _ in chunk
+        ]
+    
+    parts = parse_batch_response(response.content, response.headers.get("Content-Type"))
+    results = []
+    for index, _ in chunk:
+        status, body = parts.get(f"item-{index}", (502, "Missing part in batch response"))
+        if status == 200:
+            results.append({"index": index, "success": True, "status": status, "event": body})
+        else:
+            results.append({"index": index, "success": False, "status": status,
+                            "error": "Failed to create event", "details": body})
+    return results
+
+# Tool: Create many calendar events using Google's multipart batch API
+@app.route("/tools/create-event/batch", methods=["POST"])
+def create_event_batch():
+    data = request.json or {}
+    events = data.get("events")
     user_id = data.get("user_id", "demo_user")  # In production, get from authentication
+    if not isinstance(events, list) or not events or not all(isinstance(item, dict) for item in events):
+        return jsonify({"error": "'events' must be a non-empty list of objects"}), 400
+    if len(events) > CALENDAR_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Batch exceeds {CALENDAR_BATCH_MAX_ITEMS} events"}), 400
     
-    # Get user token from database
-    token_data = get_token(user_id, "google")
-    if not token_data:
+    access_token = get_access_token(user_id, "google")
+    if not access_token:
         return jsonify({"error": "Not authenticated"}), 401
     
-    # Create Calendar API event
-    event = {
-        "summary": summary,
-        "location": location,
-        "description": description,
-        "start": {"dateTime": start_time, "timeZone": "America/New_York"},
-        "end": {"dateTime": end_time, "timeZone": "America/New_York"}
-    }
-    
-    # Call Calendar API
-    response = requests.post(
-        "https://www.googleapis.com/calendar/v3/calendars/primary/events",
-        headers={"Authorization": f"Bearer {token_data['access_token']}"},
-        json=event
+    # Google caps the parts per batch request; larger inputs are split into
+    # chunks that are sent in parallel
+    indexed = [(index, build_calendar_event(item)) for index, item in enumerate(events)]
+    chunks = [indexed[i:i + CALENDAR_BATCH_LIMIT] for i in range(0, len(indexed), CALENDAR_BATCH_LIMIT)]
+    futures = [
+        calendar_batch_executor.submit(contextvars.copy_context().run, insert_calendar_events_batch, user_id, access_token, chunk)
+        for chunk in chunks
+    ]
+    results = [result for future in futures for result in future.result()]
+    succeeded = sum(1 for result in results if result["success"])
+    if succeeded:
+        calendar_events.mark_stale(user_id)
+    return jsonify({
+        "success": succeeded == len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "batches": len(chunks),
+        "results": results
+    })
+
+# Fetch one page of events.list for the event cache: a full listing, or the
+# changes since `sync_token`
+def fetch_calendar_page(user_id, access_token, sync_token, page_token):
+    params = {"maxResults": CALENDAR_SYNC_PAGE_SIZE, "singleEvents": "true"}
+    if sync_token:
+        params["syncToken"] = sync_token
+    if page_token:
+        params["pageToken"] = page_token
+    response = call_google(
+        "GET",
+        "calendar",
+        user_id,
+        CALENDAR_EVENTS_URL,
+        endpoint="calendar.list",
+        headers={"Authorization": f"Bearer {access_token}"},
+        params=params
     )
-    
-    if response.status_code == 200:
-        return jsonify({"success": True, "event": response.json()})
+    try:
+        body = response.json()
+    except ValueError:
+        body = {"error": response.text}
+    return response.status_code, body
+
+calendar_events = EventCache(
+    fetch_calendar_page,
+    max_users=CALENDAR_CACHE_USERS,
+    min_sync_interval=CALENDAR_SYNC_MIN_INTERVAL,
+)
+
+# Sync the user's calendar cache before a read; returns (sync_info, error_response)
+def sync_calendar(data):
+    user_id = data.get("user_id", "demo_user")  # In production, get from authentication
+    access_token = get_access_token(user_id, "google")
+    if not access_token:
+        return None, ({"error": "Not authenticated"}, 401)
+    try:
+        return calendar_events.sync(user_id, access_token, force=data.get("refresh") is True), None
+    except CalendarSyncError as e:
+        return None, ({"error": "Failed to sync calendar", "details": e.details}, e.status)
+
+def parse_window(data, required=False):
+    time_min, time_max = parse_time(data.get("time_min")), parse_time(data.get("time_max"))
+    if (data.get("time_min") and time_min is None) or (data.get("time_max") and time_max is None):
+        raise ValueError("time_min and time_max must be RFC 3339 timestamps")
+    if required and (time_min is None or time_max is None):
+        raise ValueError("time_min and time_max are required")
+    if time_min is not None and time_max is not None and time_max <= time_min:
+        raise ValueError("time_max must be after time_min")
+    return time_min, time_max
+
+# List-events tool: cached events in a window, paged with page_token/max_results
+def list_events_tool(data):
+    try:
+        time_min, time_max = parse_window(data)
+        max_results = min(int(data.get("max_results", 250)), CALENDAR_LIST_MAX_RESULTS)
+        offset = int(data.get("page_token") or 0)
+        if max_results < 1 or offset < 0:
+            raise ValueError("max_results must be positive and page_token a valid token")
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    sync, error = sync_calendar(data)
+    if error:
+        return error
+    events = calendar_events.list_events(data.get("user_id", "demo_user"), time_min, time_max)
+    page = events[offset:offset + max_results]
+    return {
+        "success": True,
+        "events": page,
+        "next_page_token": str(offset + max_results) if offset + max_results < len(events) else None,
+        "total": len(events),
+        "sync": sync,
+    }, 200
+
+# Free/busy tool: merged busy periods in [time_min, time_max)
+def free_busy_tool(data):
+    try:
+        time_min, time_max = parse_window(data, required=True)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    sync, error = sync_calendar(data)
+    if error:
+        return error
+    busy = calendar_events.free_busy(data.get("user_id", "demo_user"), time_min, time_max)
+    return {
+        "success": True,
+        "time_min": format_time(time_min),
+        "time_max": format_time(time_max),
+        "busy": [{"start": format_time(start), "end": format_time(end)} for start, end in busy],
+        "sync": sync,
+    }, 200
+
+# Tool: List calendar events
+@app.route("/tools/list-events", methods=["POST"])
+def list_events():
+    body, status = list_events_tool(request.json or {})
+    return jsonify(body), status
+
+# Tool: Free/busy for a time window
+@app.route("/tools/free-busy", methods=["POST"])
+def free_busy():
+    body, status = free_busy_tool(request.json or {})
+    return jsonify(body), status
+
+# Run a tool as a queued job. Sending an email or creating an event twice
+# isn't harmless, so the queue only retries failures that show Google never
+# got the call: connect errors and 429s. A read timeout or 5xx may come after
+# the message went out, so those jobs fail instead.
+def run_tool_job(tool):
+    def handler(payload):
+        try:
+            body, status = tool(payload)
+        except requests.RequestException as e:
+            if is_connect_error(e):
+                raise RetryableJobError(f"Upstream request failed: {e}")
+            raise
+        except RateLimited as e:
+            raise RetryableJobError(str(e))
+        return status, body
+    return handler
+
+job_queue = JobQueue(
+    get_db_connection,
+    is_postgres,
+    {
+        "send_email": run_tool_job(send_email_tool),
+        "create_event": run_tool_job(create_event_tool),
+    },
+    workers=JOB_WORKERS,
+    poll_interval=JOB_POLL_INTERVAL,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_backoff=JOB_RETRY_BACKOFF,
+    lock_timeout=JOB_LOCK_TIMEOUT,
+    retention=JOB_RETENTION,
+    prune_interval=JOB_PRUNE_INTERVAL,
+    idempotent_kinds=(),
+)
+
+# Async mode is opt-in per request: {"async": true}, ?async=1 or Prefer: respond-async
+def wants_async(data):
+    if "respond-async" in request.headers.get("Prefer", ""):
+        return True
+    if request.args.get("async", "").lower() in ("1", "true", "yes"):
+        return True
+    return isinstance(data, dict) and data.get("async") is True
+
+def enqueue_tool_job(kind, data):
+    payload = {key: value for key, value in data.items() if key != "async"}
+    job_id = job_queue.enqueue(kind, payload)
+    if not job_id:
+        return {"error": "Failed to enqueue job"}, 503
+    status_url = url_for("get_job", job_id=job_id)
+    return {"success": True, "job_id": job_id, "status": "queued", "status_url": status_url}, 202
+
+idempotency_store = IdempotencyStore(
+    get_db_connection,
+    is_postgres,
+    ttl=IDEMPOTENCY_TTL,
+    memory_size=IDEMPOTENCY_CACHE_SIZE,
+    wait_timeout=IDEMPOTENCY_WAIT_TIMEOUT,
+    lease_timeout=IDEMPOTENCY_LEASE_TIMEOUT,
+)
+
+# Run a tool endpoint, synchronously or as a job. With an Idempotency-Key
+# header the first result is stored and replayed for retries, and concurrent
+# duplicates share one upstream call.
+def run_tool_request(kind, tool, data):
+    if wants_async(data):
+        call = lambda: enqueue_tool_job(kind, data)
     else:
-        return jsonify({"error": "Failed to create event", "details": response.text}), response.status_code
+        call = lambda: tool(data)
+    key = request.headers.get("Idempotency-Key")
+    if not key:
+        body, status = call()
+        return tool_response(body, status)
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return jsonify({"error": f"Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters"}), 400
+    # Keys are scoped per tool and user so clients can't collide with each other
+    user_id = data.get("user_id", "demo_user") if isinstance(data, dict) else "demo_user"
+    scoped_key = f"{kind}:{user_id}:{key}"
+    body, status, replayed = idempotency_store.execute(scoped_key, request_fingerprint(data), call)
+    response, status = tool_response(body, status)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response, status
+
+def tool_response(body, status):
+    response = jsonify(body)
+    if status == 202 and isinstance(body, dict) and body.get("status_url"):
+        response.headers["Location"] = body["status_url"]
+    return response, status
+
+@app.errorhandler(IdempotencyConflict)
+def idempotency_conflict(e):
+    return jsonify({"error": "Idempotency-Key was already used with a different request body"}), 422
+
+@app.errorhandler(IdempotencyInProgress)
+def idempotency_in_progress(e):
+    response = jsonify({"error": "A request with this Idempotency-Key is still being processed"})
+    response.headers["Retry-After"] = "1"
+    return response, 409
+
+# Job status and result
+@app.route("/jobs/<job_id>")
+def get_job(job_id):
+    try:
+        job = job_queue.get(job_id)
+    except Exception as e:
+        return jsonify({"error": f"Failed to load job: {e}"}), 500
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+llm_cache = ResponseCache(max_entries=LLM_CACHE_SIZE, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL)
+
+# Start a streamed chat completion; raises UpstreamLLMError if OpenRouter refuses it
+def open_llm_stream(payload):
+    if not OPENROUTER_API_KEY:
+        raise UpstreamLLMError(503, "OPENROUTER_API_KEY is not configured")
+    response = upstream.post(
+        f"{OPENROUTER_API_URL}/chat/completions",
+        endpoint="openrouter.chat",
+        headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}"},
+        json=dict(payload, stream=True),
+        stream=True,
+        timeout=(UPSTREAM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT)
+    )
+    if response.status_code != 200:
+        details = response.text
+        response.close()
+        raise UpstreamLLMError(response.status_code, details)
+    return response
+
+# Yield text deltas from an open stream; the finished response is cached
+# under `key`. A stream abandoned part-way (client gone) is never cached.
+def stream_llm(response, payload, key):
+    try:
+        result = yield from iter_completion(response)
+    finally:
+        response.close()
+    result["model"] = result["model"] or payload["model"]
+    # A stream that was cut off would be replayed as if it were the whole answer
+    complete = result.pop("complete")
+    if key and result["content"] and complete:
+        llm_cache.put(key, result)
+    return result
+
+def llm_error(e):
+    # Client errors (bad model, no credits, rate limits) and a missing key pass
+    # through; anything else from upstream is a gateway error
+    status = e.status if isinstance(e.status, int) and (400 <= e.status < 500 or e.status == 503) else 502
+    return {"error": "LLM request failed", "details": e.details}, status
+
+# Prepare a /tools/llm call: (payload, cache_key or None); `"cache": false` skips the cache
+def prepare_llm_request(data):
+    payload = build_chat_request(data, LLM_DEFAULT_MODEL)
+    return payload, (cache_key(payload) if data.get("cache", True) is not False else None)
+
+# LLM tool; returns (response_body, status_code)
+def llm_tool(data):
+    try:
+        payload, key = prepare_llm_request(data)
+    except LLMRequestError as e:
+        return {"error": str(e)}, 400
+    cached = llm_cache.get(key) if key else None
+    if cached is not None:
+        return dict(cached, cached=True), 200
+    try:
+        result = collect(stream_llm(open_llm_stream(payload), payload, key))
+    except UpstreamLLMError as e:
+        return llm_error(e)
+    return dict(result, cached=False), 200
+
+# Tool: LLM completion through OpenRouter. Streams tokens as Server-Sent
+# Events by default; {"stream": false} or ?stream=0 returns JSON instead.
+@app.route("/tools/llm", methods=["POST"])
+def llm():
+    data = request.json or {}
+    if data.get("stream") is False or request.args.get("stream", "1").lower() in ("0", "false", "no"):
+        body, status = llm_tool(data)
+        return jsonify(body), status
+    try:
+        payload, key = prepare_llm_request(data)
+    except LLMRequestError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    cached = llm_cache.get(key) if key else None
+    if cached is not None:
+        # Replay a cached response without calling OpenRouter
+        def replay():
+            yield sse_event("token", {"content": cached["content"]})
+            yield sse_event("done", dict(cached, cached=True))
+        return Response(replay(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    
+    # Open the upstream stream before answering, so errors get a real status code
+    try:
+        upstream_response = open_llm_stream(payload)
+    except UpstreamLLMError as e:
+        body, status = llm_error(e)
+        return jsonify(body), status
+    
+    def events():
+        deltas = stream_llm(upstream_response, payload, key)
+        try:
+            while True:
+                yield sse_event("token", {"content": next(deltas)})
+        except StopIteration as stop:
+            yield sse_event("done", dict(stop.value, cached=False))
+        except UpstreamLLMError as e:
+            yield sse_event("error", llm_error(e)[0])
+        except requests.RequestException as e:
+            yield sse_event("error", {"error": "Upstream request failed", "details": str(e)})
+        finally:
+            deltas.close()
+    
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Built-in tool that just outputs its parameters, for workflow inputs
+def input_tool(data):
+    return dict(data), 200
+
+# Tools available to workflows; new tools plug in with tool_registry.register()
+tool_registry = ToolRegistry()
+tool_registry.register(
+    "send_email", send_email_tool,
+    description="Send an email from the user's Gmail account",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "to": {"type": "string"},
+            "subject": {"type": "string"},
+            "body": {"type": "string"},
+            "user_id": {"type": "string"},
+        },
+        "required": ["to"],
+    },
+    aliases=("send-email",),
+)
+tool_registry.register(
+    "create_event", create_event_tool,
+    description="Create an event on the user's primary Google Calendar",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "summary": {"type": "string"},
+            "start_time": {"type": "string", "format": "date-time"},
+            "end_time": {"type": "string", "format": "date-time"},
+            "description": {"type": "string"},
+            "location": {"type": "string"},
+            "user_id": {"type": "string"},
+        },
+        "required": ["summary", "start_time", "end_time"],
+    },
+    aliases=("create-event",),
+)
+tool_registry.register(
+    "llm", llm_tool,
+    description="Generate text with an LLM through OpenRouter",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "prompt": {"type": "string"},
+            "system": {"type": "string"},
+            "messages": {"type": "array", "items": {"type": "object"}},
+            "model": {"type": "string"},
+            "temperature": {"type": "number"},
+            "max_tokens": {"type": "integer"},
+            "cache": {"type": "boolean"},
+        },
+    },
+)
+tool_registry.register(
+    "list_events", list_events_tool,
+    description="List events on the user's primary Google Calendar in a time window",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "time_min": {"type": "string", "format": "date-time"},
+            "time_max": {"type": "string", "format": "date-time"},
+            "max_results": {"type": "integer"},
+            "page_token": {"type": "string"},
+            "refresh": {"type": "boolean"},
+            "user_id": {"type": "string"},
+        },
+    },
+)
+tool_registry.register(
+    "free_busy", free_busy_tool,
+    description="Busy periods on the user's primary Google Calendar in a time window",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "time_min": {"type": "string", "format": "date-time"},
+            "time_max": {"type": "string", "format": "date-time"},
+            "refresh": {"type": "boolean"},
+            "user_id": {"type": "string"},
+        },
+        "required": ["time_min", "time_max"],
+    },
+)
+tool_registry.register("input", input_tool, description="Output the given parameters unchanged")
+
+workflow_executor = ThreadPoolExecutor(max_workers=WORKFLOW_CONCURRENCY, thread_name_prefix="workflow")
+
+# Run a workflow graph. Streams per-node progress as Server-Sent Events by
+# default; ?stream=0 waits and returns the final summary as JSON instead.
+@app.route("/workflows/run", methods=["POST"])
+def run_workflow_endpoint():
+    data = request.json or {}
+    graph = data.get("workflow", data)
+    defaults = {"user_id": data.get("user_id", "demo_user")}  # In production, get from authentication
+    try:
+        validate_workflow(graph, tool_registry, WORKFLOW_MAX_NODES)
+    except WorkflowError as e:
+        return jsonify({"error": "Invalid workflow", "details": str(e)}), 400
+    
+    if request.args.get("stream", "1").lower() in ("0", "false", "no"):
+        summary = run_workflow(graph, tool_registry, workflow_executor, defaults=defaults, max_nodes=WORKFLOW_MAX_NODES)
+        return jsonify(summary)
+    
+    # The graph runs on its own thread and hands events to the response
+    # generator, so progress reaches the client while nodes are still running
+    events = queue.Queue()
+    
+    def run():
+        try:
+            run_workflow(
+                graph, tool_registry, workflow_executor,
+                emit=lambda event, payload: events.put((event, payload)),
+                defaults=defaults, max_nodes=WORKFLOW_MAX_NODES
+            )
+        except Exception as e:
+            events.put(("workflow_error", {"error": str(e)}))
+        finally:
+            events.put(None)
+    
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), name="workflow-run", daemon=True).start()
+    
+    def stream():
+        while True:
+            item = events.get()
+            if item is None:
+                return
+            yield sse_event(*item)
+    
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# JSON-RPC methods for the MCP endpoint
+def rpc_initialize(params):
+    return {
+        "protocolVersion": MCP_PROTOCOL_VERSION,
+        "capabilities": {"tools": {"listChanged": False}},
+        "serverInfo": {"name": "uifast-mcp", "version": "1.0.0"},
+    }
+
+def rpc_tools_list(params):
+    return {"tools": tool_registry.describe()}
+
+def rpc_tools_call(params):
+    if not isinstance(params, dict) or not isinstance(params.get("name"), str):
+        raise RpcError(INVALID_PARAMS, "tools/call requires a tool 'name'")
+    arguments = params.get("arguments") or {}
+    if not isinstance(arguments, dict):
+        raise RpcError(INVALID_PARAMS, "'arguments' must be an object")
+    if params["name"] not in tool_registry:
+        raise RpcError(INVALID_PARAMS, f"Unknown tool: {params['name']}")
+    try:
+        body, status = tool_registry.call(params["name"], arguments)
+    except RateLimited as e:
+        body, status = {"error": "Rate limited", "throttled_by": "local", "retry_after": round(e.retry_after, 3)}, 429
+    except requests.RequestException as e:
+        body, status = {"error": "Upstream request failed", "details": str(e)}, 504 if isinstance(e, requests.Timeout) else 502
+    # Tool failures are results with isError set, not protocol errors
+    return {
+        "content": [{"type": "text", "text": json.dumps(body)}],
+        "structuredContent": body,
+        "isError": status >= 400,
+        "status": status,
+    }
+
+rpc_executor = ThreadPoolExecutor(max_workers=MCP_CONCURRENCY, thread_name_prefix="mcp-rpc")
+rpc_dispatcher = JsonRpcDispatcher(
+    {
+        "initialize": rpc_initialize,
+        "notifications/initialized": lambda params: None,
+        "ping": lambda params: {},
+        "tools/list": rpc_tools_list,
+        "tools/call": rpc_tools_call,
+    },
+    rpc_executor,
+    max_batch=MCP_MAX_BATCH,
+)
+
+# Resolve each user's access token once for a whole batch of tool calls
+def prepare_rpc_batch(rpc_requests):
+    user_ids = set()
+    for rpc_request in rpc_requests:
+        if isinstance(rpc_request, dict) and rpc_request.get("method") == "tools/call":
+            params = rpc_request.get("params")
+            arguments = params.get("arguments") if isinstance(params, dict) else None
+            if isinstance(arguments, dict):
+                user_ids.add(arguments.get("user_id", "demo_user"))
+    shared_access_tokens.set({(user_id, "google"): get_access_token(user_id, "google") for user_id in user_ids})
+
+# MCP-style JSON-RPC 2.0 endpoint; accepts single requests and batch arrays
+@app.route("/mcp", methods=["POST"])
+def mcp_endpoint():
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify(error_response(None, PARSE_ERROR, "Parse error")), 400
+    response = rpc_dispatcher.handle(payload, prepare_batch=prepare_rpc_batch)
+    if response is None:
+        # Only notifications were sent
+        return "", 202
+    return jsonify(response)
 
 # Test database connection
 @app.route("/test-db")
@@ -359,7 +2221,7 @@ def test_db():
             cursor.fetchone()
             
             # Determine database type
-            if PSYCOPG2_AVAILABLE and isinstance(conn, psycopg2.extensions.connection):
+            if is_postgres(conn):
                 db_type = "PostgreSQL (Sevalla)"
                 db_info = {
                     "host": conn.info.host,
@@ -369,26 +2231,211 @@ def test_db():
                 }
             else:
                 db_type = "SQLite (local)"
-                db_info = {"path": DB_PATH}
+                db_info = {"path": DB_PATH, "store_mode": SQLITE_STORE_MODE}
+                if sqlite_tokens is not None:
+                    db_info["token_store"] = sqlite_tokens.stats()
                 
-            conn.close()
             return jsonify({
                 "success": True, 
                 "message": "Database connection successful",
                 "database_type": db_type,
-                "database_info": db_info
+                "database_info": db_info,
+                "pool_stats": pool_stats(),
+                "circuit_breaker": pg_breaker.stats(),
+                "token_cache": token_cache_stats(),
+                "token_refresher": token_refresher.stats(),
+                "upstream": upstream.stats(),
+                "job_queue": job_queue.stats(),
+                "calendar_cache": calendar_events.stats(),
+                "llm_cache": llm_cache.stats(),
+                "idempotency": idempotency_store.stats(),
+                "rate_limiter": rate_limiter.stats()
             })
         except Exception as e:
             return jsonify({"success": False, "message": f"Database connection error: {str(e)}"}), 500
+        finally:
+            conn.close()
     else:
-        return jsonify({"success": False, "message": "Database connection failed"}), 500
+        return jsonify({"success": False, "message": "Database connection failed", "pool_stats": pool_stats(), "circuit_breaker": pg_breaker.stats()}), 500
 
 # Health check endpoint
 @app.route("/health")
 def health_check():
     return jsonify({"status": "healthy"})
 
+# Correlation id for everything logged while handling the request: the
+# caller's X-Request-Id if it sent a usable one, otherwise a new one. It is
+# echoed back in the response.
+@app.before_request
+def assign_request_id():
+    value = request.headers.get(REQUEST_ID_HEADER, "")
+    if not (0 < len(value) <= REQUEST_ID_MAX_LENGTH and value.isprintable()):
+        value = uuid.uuid4().hex
+    request.environ["mcp.request_id"] = value
+    request.environ["mcp.request_id_token"] = structured_logging.request_id.set(value)
+
+@app.after_request
+def add_request_id_header(response):
+    value = request.environ.get("mcp.request_id")
+    if value:
+        response.headers[REQUEST_ID_HEADER] = value
+    return response
+
+# Request threads are reused, so the id mustn't outlive the request
+@app.teardown_request
+def clear_request_id(exc):
+    token = request.environ.pop("mcp.request_id_token", None)
+    if token is not None:
+        structured_logging.request_id.reset(token)
+
+@app.before_request
+def start_request_timer():
+    request.environ["mcp.request_started"] = time.perf_counter()
+
+# Per-route request metrics; the route is the URL rule (e.g. /jobs/<job_id>),
+# so label values stay bounded
+@app.after_request
+def record_request_metrics(response):
+    started = request.environ.get("mcp.request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        http_request_duration.observe(time.perf_counter() - started, route, request.method)
+        http_requests.inc(route, request.method, response.status_code)
+    return response
+
+# Prometheus metrics
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+if PROFILING_ENABLED:
+    profile_store = ProfileStore(PROFILE_DIR, max_profiles=PROFILE_MAX_FILES, max_bytes=PROFILE_MAX_BYTES)
+    app.wsgi_app = ProfilingMiddleware(
+        app.wsgi_app,
+        profile_store,
+        token=PROFILING_TOKEN,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        sample_mode=PROFILE_SAMPLE_MODE,
+        sample_interval=PROFILE_SAMPLE_INTERVAL,
+    )
+
+    # Profile downloads need "Authorization: Bearer <PROFILING_TOKEN>"
+    def profiles_authorized():
+        header = request.headers.get("Authorization", "")
+        return bool(PROFILING_TOKEN) and hmac.compare_digest(header.encode(), f"Bearer {PROFILING_TOKEN}".encode())
+
+    # Stored profiles, newest first
+    @app.route("/admin/profiles")
+    def list_profiles():
+        if not profiles_authorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        return jsonify({"profiles": profile_store.list()})
+
+    # Download one profile (.pstats or .collapsed)
+    @app.route("/admin/profiles/<profile_id>")
+    def download_profile(profile_id):
+        if not profiles_authorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        found = profile_store.path(profile_id)
+        if found is None:
+            return jsonify({"error": "Profile not found"}), 404
+        path, mode = found
+        return send_file(
+            path,
+            mimetype="application/octet-stream" if mode == "cprofile" else "text/plain",
+            as_attachment=True,
+            download_name=os.path.basename(path),
+        )
+
+# Tables, columns and indexes for every component; run by ensure_schema()
+# when the database is behind SCHEMA_VERSION. Returns True if all succeeded.
+def init_schema():
+    results = [
+        init_db(),
+        oauth_states.init_schema(),
+        job_queue.init_schema(),
+        idempotency_store.init_schema(),
+    ]
+    return all(results)
+
+background_started = False
+background_lock = threading.Lock()
+
+# Per-process background work; starts once. `backfill` also runs the token
+# column backfill (serve.py passes it to one worker after migrating).
+# `refresher=False` leaves proactive token refresh to another process (serve.py
+# runs it in one worker only, so tokens aren't refreshed twice)
+def start_background(backfill=False, refresher=True):
+    global background_started
+    with background_lock:
+        if background_started:
+            return
+        background_started = True
+    if backfill:
+        threading.Thread(target=backfill_token_columns, name="token-column-backfill", daemon=True).start()
+    if METRICS_MULTIPROC_DIR:
+        metrics.share(METRICS_MULTIPROC_DIR, METRICS_SNAPSHOT_INTERVAL)
+    if token_invalidations:
+        token_invalidations.start()
+    if refresher and TOKEN_REFRESH_ENABLED and CLIENT_ID and CLIENT_SECRET:
+        token_refresher.start()
+    if JOB_WORKERS > 0:
+        job_queue.start()
+
+# Stop background work, letting running jobs finish for up to `timeout` seconds
+def stop_background(timeout=None):
+    job_queue.stop(timeout=timeout)
+    token_refresher.stop()
+    if token_invalidations:
+        token_invalidations.stop()
+    metrics.stop_sharing()
+
+# Pay connection and cache setup costs before taking traffic instead of on
+# the first requests
+def warmup():
+    started = time.perf_counter()
+    tokens_loaded = 0
+    conns = get_token_connections()
+    recent = []
+    try:
+        for conn in conns:
+            cursor = conn.cursor()
+            cursor.execute("SELECT updated_at, user_id, provider FROM tokens ORDER BY updated_at DESC LIMIT %s" % int(WARMUP_TOKENS))
+            recent.extend(tuple(row) for row in cursor.fetchall())
+    except Exception as e:
+        logger.warning("Warmup query failed: %s", e)
+    finally:
+        for conn in conns:
+            conn.close()
+    # Most recently active users' access tokens into the token cache
+    recent.sort(reverse=True)
+    for _, user_id, provider in recent[:WARMUP_TOKENS]:
+        if get_access_token(user_id, provider):
+            tokens_loaded += 1
+    if WARMUP_HTTP:
+        # Open a keep-alive connection (and TLS session) to Google
+        try:
+            upstream.request("HEAD", f"{GOOGLE_API_BASE_URL}/", endpoint="warmup", timeout=(UPSTREAM_CONNECT_TIMEOUT, 2))
+        except requests.RequestException as e:
+            logger.warning("Warmup HTTP request failed: %s", e)
+    tool_registry.describe()
+    return {"seconds": round(time.perf_counter() - started, 4), "tokens_loaded": tokens_loaded}
+
+# Background work starts with the first request rather than at import
+# (serve.py starts it in each worker before warmup)
+@app.before_request
+def start_background_on_first_request():
+    if not background_started:
+        start_background()
+
+# App factory for WSGI servers, e.g. `gunicorn "mcp_server:create_app()"`.
+# Importing the module does no I/O: the database schema is checked on the
+# first connection and background work starts with the first request.
+def create_app():
+    return app
+
 if __name__ == "__main__":
+    # Development server; use serve.py in production.
     # Use port 5001 to avoid conflicts with port 3000 (Next.js) and 5000 (common default)
     port = int(os.environ.get("BACKEND_PORT", 5001))
     app.run(host="0.0.0.0", port=port, debug=True)
\ No newline at end of file
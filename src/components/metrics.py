@@ -0,0 +1,267 @@
+"""
+Counters and histograms exposed in the Prometheus text format.
+
+Recording is lock-free: every thread accumulates into its own shard (a dict
+keyed by metric and label values), so request threads never contend on a
+shared lock. The lock is only taken when a thread records its first sample
+and when /metrics merges the shards; shards of threads that have exited are
+folded into one, so their number stays bounded by the live threads.
+
+Each process has its own samples. With share(directory) a process also
+writes snapshots of them to that directory, and render() adds up every
+process's snapshot, so a scrape served by any pre-forked worker covers all
+of them (serve.py sets this up).
+"""
+
+import bisect
+import contextlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def snapshot_path(directory, pid):
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+
+def remove_snapshot(directory, pid):
+    """Delete the snapshot of process `pid` once it has exited, so it no longer counts."""
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(snapshot_path(directory, pid))
+
+
+class Counter:
+    def __init__(self, registry, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry
+
+    def inc(self, *labels, amount=1):
+        shard = self._registry._shard()
+        key = (self.name, tuple(str(label) for label in labels))
+        values = shard.get(key)
+        if values is None:
+            values = shard[key] = [0.0]
+        values[0] += amount
+
+
+class Histogram:
+    def __init__(self, registry, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._registry = registry
+
+    def observe(self, value, *labels):
+        shard = self._registry._shard()
+        key = (self.name, tuple(str(label) for label in labels))
+        values = shard.get(key)
+        if values is None:
+            # One count per bucket (the last is +Inf), then the sum
+            values = shard[key] = [0.0] * (len(self.buckets) + 2)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) for threads that have recorded something
+        self._retired = {}  # samples of threads that have exited
+        self._share_dir = None
+        self._share_stop = threading.Event()
+        self._share_thread = None
+        if hasattr(os, "register_at_fork"):
+            # A forked child starts from zero; its parent keeps counting its own
+            os.register_at_fork(after_in_child=self._reset)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self, name, documentation, labelnames, buckets))
+
+    def collect(self):
+        """This process's samples: {(name, labels): values}."""
+        with self._lock:
+            self._fold_exited()
+            merged = {key: list(values) for key, values in self._retired.items()}
+            for _, shard in self._shards:
+                # Copying a dict or list of plain values is atomic under the GIL
+                for key, values in list(shard.items()):
+                    _add_values(merged, key, list(values))
+        return merged
+
+    def render(self):
+        """All samples in the Prometheus text exposition format."""
+        samples = self.collect()
+        if self._share_dir:
+            for key, values in self._other_processes():
+                _add_values(samples, key, values)
+        by_metric = {}
+        for (name, labels), values in samples.items():
+            by_metric.setdefault(name, []).append((labels, values))
+        lines = []
+        for name, metric in self._metrics.items():
+            kind = "histogram" if isinstance(metric, Histogram) else "counter"
+            lines.append(f"# HELP {name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, values in sorted(by_metric.get(name, ())):
+                pairs = list(zip(metric.labelnames, labels))
+                if kind == "counter":
+                    lines.append(f"{name}{_format_labels(pairs)} {_format_value(values[0])}")
+                    continue
+                cumulative = 0.0
+                for bound, count in zip(metric.buckets + (math.inf,), values[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(pairs + [('le', le)])} {_format_value(cumulative)}")
+                lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(values[-1])}")
+                lines.append(f"{name}_count{_format_labels(pairs)} {_format_value(cumulative)}")
+        return "\n".join(lines) + "\n"
+
+    def share(self, directory, interval=5.0):
+        """Publish this process's samples to `directory` every `interval` seconds."""
+        os.makedirs(directory, exist_ok=True)
+        self._share_dir = directory
+        if self._share_thread is None:
+            self._share_stop.clear()
+            self._share_thread = threading.Thread(
+                target=self._share_loop, args=(interval,), name="metrics-snapshot", daemon=True
+            )
+            self._share_thread.start()
+
+    def stop_sharing(self):
+        """Stop the snapshot thread after writing a final snapshot."""
+        if self._share_thread is not None:
+            self._share_stop.set()
+            self._share_thread.join()
+            self._share_thread = None
+
+    def flush(self):
+        """Write this process's snapshot now (no-op unless sharing)."""
+        if not self._share_dir:
+            return
+        path = snapshot_path(self._share_dir, os.getpid())
+        samples = [[name, list(labels), values] for (name, labels), values in self.collect().items()]
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(samples, f)
+        os.replace(temporary, path)
+
+    def _add(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._fold_exited()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._share_thread = None
+
+    def _fold_exited(self):
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for key, values in shard.items():
+                    _add_values(self._retired, key, values)
+        self._shards = alive
+
+    def _share_loop(self, interval):
+        while not self._share_stop.wait(interval):
+            self._flush_quietly()
+        self._flush_quietly()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except OSError as e:
+            logger.warning("Metrics snapshot failed: %s", e)
+
+    def _other_processes(self):
+        own = f"metrics-{os.getpid()}.json"
+        try:
+            names = os.listdir(self._share_dir)
+        except OSError:
+            return
+        for filename in names:
+            if filename == own or not filename.startswith("metrics-") or not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self._share_dir, filename)) as f:
+                    samples = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, values in samples:
+                metric = self._metrics.get(name)
+                # Skip samples from a version of the code with other buckets
+                expected = len(metric.buckets) + 2 if isinstance(metric, Histogram) else 1
+                if metric is not None and len(values) == expected:
+                    yield (name, tuple(labels)), values
+
+
+def _add_values(target, key, values):
+    existing = target.get(key)
+    if existing is None:
+        target[key] = list(values)
+    else:
+        for i, value in enumerate(values):
+            existing[i] += value
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
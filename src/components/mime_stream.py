@@ -0,0 +1,216 @@
+"""
+Streaming MIME encoder for outgoing Gmail messages.
+
+A message is produced as an iterator of byte chunks: the headers, the text
+body, then each attachment base64-encoded one block at a time. Memory use
+therefore depends on the block size, not on how big the attachments are.
+When every attachment's size is known up front, so is the exact encoded
+length, which lets the caller choose Gmail's simple, multipart or resumable
+upload path before anything is sent.
+"""
+
+import base64
+import email.header
+import mimetypes
+import os
+import urllib.parse
+import uuid
+
+# 57 input bytes encode to exactly one 76-character base64 line (RFC 2045)
+LINE_INPUT_BYTES = 57
+LINE_LENGTH = 76
+DEFAULT_BLOCK_SIZE = LINE_INPUT_BYTES * 1024
+
+
+class MessageTooLarge(ValueError):
+    """The encoded message is bigger than the configured limit."""
+
+
+def base64_length(size):
+    """Encoded size of `size` bytes as CRLF-terminated 76-character lines."""
+    encoded = 4 * ((size + 2) // 3)
+    return encoded + 2 * ((encoded + LINE_LENGTH - 1) // LINE_LENGTH)
+
+
+def encode_lines(data):
+    encoded = base64.b64encode(data)
+    return b"".join(encoded[i:i + LINE_LENGTH] + b"\r\n" for i in range(0, len(encoded), LINE_LENGTH))
+
+
+def iter_base64(read, block_size=DEFAULT_BLOCK_SIZE):
+    """Base64-encode everything `read(n)` returns, one block at a time."""
+    # Whole lines per block, so blocks can be encoded independently
+    block_size = max(LINE_INPUT_BYTES, block_size - block_size % LINE_INPUT_BYTES)
+    pending = b""
+    while True:
+        data = read(block_size)
+        if not data:
+            break
+        pending += data
+        whole = len(pending) - len(pending) % LINE_INPUT_BYTES
+        if whole:
+            yield encode_lines(pending[:whole])
+            pending = pending[whole:]
+    if pending:
+        yield encode_lines(pending)
+
+
+def iter_fixed_chunks(chunks, size):
+    """Regroup an iterable of byte strings into chunks of exactly `size` (the last may be shorter)."""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def limit_chunks(chunks, max_bytes):
+    """Pass chunks through, raising MessageTooLarge once more than `max_bytes` went by."""
+    sent = 0
+    for chunk in chunks:
+        sent += len(chunk)
+        if max_bytes and sent > max_bytes:
+            raise MessageTooLarge(f"Message exceeds {max_bytes} bytes")
+        yield chunk
+
+
+class StreamingBody:
+    """Iterable request body with a known length, so requests sends Content-Length instead of chunking."""
+
+    def __init__(self, chunks, length):
+        self._chunks = chunks
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+
+def header_value(value):
+    # Drop line breaks so values can't inject headers; RFC 2047-encode non-ASCII
+    value = " ".join(str(value or "").splitlines())
+    try:
+        value.encode("ascii")
+        return value
+    except UnicodeEncodeError:
+        return email.header.Header(value, "utf-8").encode()
+
+
+def filename_param(filename):
+    filename = " ".join(str(filename).splitlines()).replace("\\", "_").replace('"', "_")
+    try:
+        filename.encode("ascii")
+        return f'filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"filename*=utf-8''{urllib.parse.quote(filename)}"
+
+
+class Attachment:
+    """A file to attach, read lazily from a stream."""
+
+    def __init__(self, filename, stream, content_type=None, size=None, on_close=None):
+        self.filename = filename or "attachment"
+        self.stream = stream
+        self.content_type = content_type or mimetypes.guess_type(self.filename)[0] or "application/octet-stream"
+        # Raw (unencoded) size in bytes, or None if unknown
+        self.size = size
+        self._on_close = on_close
+
+    @classmethod
+    def from_upload(cls, upload):
+        """From a werkzeug FileStorage (a multipart/form-data upload)."""
+        stream = upload.stream
+        size = None
+        if stream.seekable():
+            position = stream.tell()
+            size = stream.seek(0, os.SEEK_END) - position
+            stream.seek(position)
+        return cls(upload.filename, stream, upload.mimetype or None, size)
+
+    @classmethod
+    def from_url(cls, get, url, filename=None, content_type=None):
+        """From an http(s) URL; `get(url, stream=True)` returns a requests.Response."""
+        if urllib.parse.urlsplit(url).scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported attachment URL: {url}")
+        response = get(url, stream=True)
+        if response.status_code >= 400:
+            response.close()
+            raise ValueError(f"Attachment URL returned {response.status_code}: {url}")
+        response.raw.decode_content = True
+        size = response.headers.get("Content-Length")
+        # With Content-Encoding the length is of the compressed body
+        size = int(size) if size and size.isdigit() and not response.headers.get("Content-Encoding") else None
+        filename = filename or os.path.basename(urllib.parse.urlsplit(url).path) or None
+        content_type = content_type or (response.headers.get("Content-Type") or "").split(";")[0].strip() or None
+        return cls(filename, response.raw, content_type, size, on_close=response.close)
+
+    def headers(self):
+        return (
+            f"Content-Type: {header_value(self.content_type)}\r\n"
+            f"Content-Disposition: attachment; {filename_param(self.filename)}\r\n"
+            f"Content-Transfer-Encoding: base64\r\n\r\n"
+        ).encode()
+
+    def close(self):
+        if self._on_close:
+            self._on_close()
+
+
+class MimeMessage:
+    """An RFC 822 message with optional attachments, encoded on the fly."""
+
+    def __init__(self, to, subject, body, attachments=(), block_size=DEFAULT_BLOCK_SIZE, boundary=None):
+        self.to = to
+        self.subject = subject
+        self.body = body or ""
+        self.attachments = list(attachments)
+        self.block_size = block_size
+        self.boundary = boundary or f"=_{uuid.uuid4().hex}"
+
+    def _head(self):
+        head = f"To: {header_value(self.to)}\r\nSubject: {header_value(self.subject)}\r\nMIME-Version: 1.0\r\n"
+        text = 'Content-Type: text/plain; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+        if not self.attachments:
+            return (head + text).encode()
+        return (
+            f'{head}Content-Type: multipart/mixed; boundary="{self.boundary}"\r\n\r\n'
+            f"--{self.boundary}\r\n{text}"
+        ).encode()
+
+    def _segments(self):
+        """Static byte strings and attachments, in message order."""
+        segments = [self._head(), encode_lines(self.body.encode())]
+        if self.attachments:
+            for attachment in self.attachments:
+                segments.append(f"--{self.boundary}\r\n".encode() + attachment.headers())
+                segments.append(attachment)
+            segments.append(f"--{self.boundary}--\r\n".encode())
+        return segments
+
+    def content_length(self):
+        """Exact encoded size, or None if an attachment's size is unknown."""
+        total = 0
+        for segment in self._segments():
+            if isinstance(segment, Attachment):
+                if segment.size is None:
+                    return None
+                total += base64_length(segment.size)
+            else:
+                total += len(segment)
+        return total
+
+    def __iter__(self):
+        for segment in self._segments():
+            if isinstance(segment, Attachment):
+                yield from iter_base64(segment.stream.read, self.block_size)
+            else:
+                yield segment
+
+    def close(self):
+        for attachment in self.attachments:
+            attachment.close()
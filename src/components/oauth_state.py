@@ -0,0 +1,122 @@
+"""
+Shared store for in-flight OAuth authorization requests.
+
+/authorize/<provider> saves a random `state` together with the user it was
+started for and the PKCE code verifier; the callback consumes it exactly once
+(DELETE ... RETURNING), so it can land on any worker or process and a replayed
+or forged callback finds nothing. Entries expire after `ttl` seconds.
+"""
+
+import base64
+import hashlib
+import logging
+import secrets
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def new_code_verifier():
+    # 64 random bytes -> 86 URL-safe characters (RFC 7636 allows 43-128)
+    return secrets.token_urlsafe(64)
+
+
+def code_challenge(verifier):
+    """S256 PKCE challenge for `verifier`."""
+    digest = hashlib.sha256(verifier.encode("ascii")).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+class OAuthStateStore:
+    """Database-backed, single-use, expiring OAuth state values."""
+
+    def __init__(self, get_connection, is_postgres, ttl=600.0, purge_every=100):
+        self._get_connection = get_connection
+        self._is_postgres = is_postgres
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def init_schema(self):
+        conn = self._get_connection()
+        if not conn:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS oauth_states (
+                    state TEXT PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    code_verifier TEXT NOT NULL,
+                    created_at DOUBLE PRECISION NOT NULL,
+                    expires_at DOUBLE PRECISION NOT NULL
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_oauth_states_expires_at ON oauth_states (expires_at)")
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error("OAuth state store initialization error: %s", e)
+            return False
+        finally:
+            conn.close()
+
+    def create(self, provider, user_id, code_verifier):
+        """Store a new authorization request and return its state value (None on failure)."""
+        state = secrets.token_urlsafe(32)
+        now = time.time()
+        conn = self._get_connection()
+        if not conn:
+            return None
+        with self._lock:
+            self._created += 1
+            purge = self._created % self.purge_every == 0
+        try:
+            p = self._placeholder(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                f"INSERT INTO oauth_states (state, provider, user_id, code_verifier, created_at, expires_at) "
+                f"VALUES ({p}, {p}, {p}, {p}, {p}, {p})",
+                (state, provider, user_id, code_verifier, now, now + self.ttl)
+            )
+            if purge:
+                cursor.execute(f"DELETE FROM oauth_states WHERE expires_at <= {p}", (now,))
+            conn.commit()
+            return state
+        except Exception as e:
+            logger.error("Error saving OAuth state: %s", e)
+            return None
+        finally:
+            conn.close()
+
+    def consume(self, provider, state):
+        """Remove and return {"user_id", "code_verifier"} for a live state, else None."""
+        if not state:
+            return None
+        conn = self._get_connection()
+        if not conn:
+            return None
+        try:
+            p = self._placeholder(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                f"DELETE FROM oauth_states WHERE state = {p} AND provider = {p} "
+                f"RETURNING user_id, code_verifier, expires_at",
+                (state, provider)
+            )
+            row = cursor.fetchone()
+            conn.commit()
+        except Exception as e:
+            logger.error("Error loading OAuth state: %s", e)
+            return None
+        finally:
+            conn.close()
+        if row is None or row[2] <= time.time():
+            return None
+        return {"user_id": row[0], "code_verifier": row[1]}
+
+    def _placeholder(self, conn):
+        return "%s" if self._is_postgres(conn) else "?"
@@ -0,0 +1,244 @@
+"""
+Opt-in profiling of individual requests.
+
+ProfilingMiddleware wraps the WSGI app only when profiling is enabled, so a
+disabled server runs exactly the code it would without this module. A
+request is profiled when it carries `X-Profile: <token>` or falls in the
+sampled fraction, in one of two modes:
+
+    cprofile  deterministic cProfile of the request thread -> .pstats
+              (load with pstats.Stats or snakeviz)
+    sample    stack samples of the request thread every few milliseconds ->
+              .collapsed (one "frame;frame;frame count" line per stack, the
+              input of flamegraph.pl and speedscope)
+
+The profile covers the whole response, streamed bodies included. Results go
+to a ProfileStore: a directory holding at most `max_profiles` profiles and
+`max_bytes` bytes, oldest dropped first. The directory can be shared by
+several processes.
+"""
+
+import cProfile
+import collections
+import hmac
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MODES = ("cprofile", "sample")
+EXTENSIONS = {"cprofile": ".pstats", "sample": ".collapsed"}
+
+
+class ProfileStore:
+    """Bounded on-disk ring of profiles with a JSON sidecar of metadata each."""
+
+    def __init__(self, directory, max_profiles=50, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.max_bytes = max_bytes
+        self._sequence = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+
+    def new_id(self):
+        # Sorts chronologically; the pid keeps ids unique across workers
+        return f"{time.time_ns():020d}-{os.getpid()}-{next(self._sequence)}"
+
+    def save(self, profile_id, mode, write, metadata):
+        """Store a profile; `write(path)` writes its data file."""
+        path = os.path.join(self.directory, profile_id + EXTENSIONS[mode])
+        write(path)
+        metadata = dict(metadata, id=profile_id, mode=mode, bytes=os.path.getsize(path))
+        temporary = os.path.join(self.directory, f".{profile_id}.json.tmp")
+        with open(temporary, "w") as f:
+            json.dump(metadata, f)
+        os.replace(temporary, os.path.join(self.directory, profile_id + ".json"))
+        self.prune()
+        return metadata
+
+    def list(self):
+        """Metadata of stored profiles, newest first."""
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith(".json") or name.startswith("."):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def path(self, profile_id):
+        """(path, mode) of a stored profile, or None."""
+        for mode, extension in EXTENSIONS.items():
+            path = os.path.join(self.directory, os.path.basename(profile_id) + extension)
+            if os.path.isfile(path):
+                return path, mode
+        return None
+
+    def prune(self):
+        profiles = self.list()
+        total = 0
+        for index, metadata in enumerate(profiles):
+            total += metadata.get("bytes", 0)
+            if index >= self.max_profiles or total > self.max_bytes:
+                self._remove(metadata["id"])
+
+    def _remove(self, profile_id):
+        for extension in list(EXTENSIONS.values()) + [".json"]:
+            try:
+                os.remove(os.path.join(self.directory, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+
+class _Profile:
+    """One profiled request: started on construction, saved by finish()."""
+
+    def __init__(self, store, mode, environ, sample_interval):
+        self.store = store
+        self.mode = mode
+        self.id = store.new_id()
+        self.environ = environ
+        self.status = None
+        self.started = time.perf_counter()
+        self.created_at = time.time()
+        self._done = False
+        if mode == "sample":
+            self._profiler = StackSampler(threading.get_ident(), sample_interval)
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            # Python 3.12+ allows one active cProfile per process; raises ValueError
+            self._profiler.enable()
+
+    def finish(self):
+        if self._done:
+            return
+        self._done = True
+        elapsed = time.perf_counter() - self.started
+        if self.mode == "sample":
+            self._profiler.stop()
+            write = self._profiler.write
+        else:
+            self._profiler.disable()
+            write = self._profiler.dump_stats
+        query = self.environ.get("QUERY_STRING")
+        try:
+            self.store.save(self.id, self.mode, write, {
+                "method": self.environ.get("REQUEST_METHOD"),
+                "path": self.environ.get("PATH_INFO", "") + (f"?{query}" if query else ""),
+                "status": self.status,
+                "seconds": round(elapsed, 6),
+                "created_at": self.created_at,
+                "pid": os.getpid(),
+            })
+        except OSError as e:
+            logger.error("Error saving profile %s: %s", self.id, e)
+
+
+class _ProfiledBody:
+    """Response iterable that ends the profile once the body has been sent."""
+
+    def __init__(self, body, profile):
+        self._body = body
+        self._profile = profile
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            if hasattr(self._body, "close"):
+                self._body.close()
+        finally:
+            self._profile.finish()
+
+
+class ProfilingMiddleware:
+    """Profiles requests carrying the profiling header, plus a random sample."""
+
+    def __init__(self, app, store, token=None, sample_rate=0.0, sample_mode="cprofile",
+                 sample_interval=0.005, header="X-Profile"):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.sample_mode = sample_mode
+        self.sample_interval = sample_interval
+        self._environ_key = "HTTP_" + header.upper().replace("-", "_")
+        self._mode_key = self._environ_key + "_MODE"
+
+    def authorized(self, value):
+        return bool(self.token) and value is not None and hmac.compare_digest(value.encode(), self.token.encode())
+
+    def __call__(self, environ, start_response):
+        mode = self._mode(environ)
+        if mode is None:
+            return self.app(environ, start_response)
+        try:
+            profile = _Profile(self.store, mode, environ, self.sample_interval)
+        except ValueError as e:
+            # Another profiler is active (Python 3.12+); serve unprofiled
+            logger.warning("Request not profiled: %s", e)
+            return self.app(environ, start_response)
+
+        def profiled_start_response(status, headers, exc_info=None):
+            profile.status = int(status.split(" ", 1)[0])
+            return start_response(status, list(headers) + [("X-Profile-Id", profile.id)], exc_info)
+
+        try:
+            body = self.app(environ, profiled_start_response)
+        except BaseException:
+            profile.finish()
+            raise
+        return _ProfiledBody(body, profile)
+
+    def _mode(self, environ):
+        if self.authorized(environ.get(self._environ_key)):
+            mode = environ.get(self._mode_key, "cprofile").lower()
+            return mode if mode in MODES else "cprofile"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return self.sample_mode
+        return None
@@ -0,0 +1,167 @@
+"""
+Adaptive token-bucket rate limiter for upstream Google APIs.
+
+Buckets are keyed by (user_id, api). A call waits (up to `max_wait`) for a
+token before it is sent; if it would have to wait longer it is rejected
+locally with RateLimited instead of burning quota on a call Google would
+refuse. When Google answers 429 the bucket's rate is halved and the bucket
+is paused for Retry-After; every successful call afterwards adds back a
+fraction of the configured rate until it is fully restored (AIMD).
+"""
+
+import collections
+import datetime
+import email.utils
+import threading
+import time
+
+
+class RateLimited(Exception):
+    """Raised when a call is throttled locally before reaching the upstream API."""
+
+    def __init__(self, key, retry_after):
+        self.key = key
+        self.retry_after = retry_after
+        super().__init__(f"Rate limit for {key[1]} exceeded for user {key[0]}; retry after {retry_after:.2f}s")
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class _Bucket:
+    __slots__ = ("rate", "base_rate", "capacity", "tokens", "updated", "blocked_until",
+                 "allowed", "local_rejections", "upstream_throttles", "last_throttled_at")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.base_rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+        self.allowed = 0
+        self.local_rejections = 0
+        self.upstream_throttles = 0
+        self.last_throttled_at = None
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class AdaptiveRateLimiter:
+    """Per-(user_id, api) token buckets that back off on 429 and probe back up."""
+
+    def __init__(self, limits, max_wait=2.0, min_rate_fraction=0.05, decrease_factor=0.5,
+                 increase_fraction=0.05, max_keys=10000):
+        # limits: api -> (requests_per_second, burst)
+        self.limits = dict(limits)
+        self.max_wait = max_wait
+        self.min_rate_fraction = min_rate_fraction
+        self.decrease_factor = decrease_factor
+        self.increase_fraction = increase_fraction
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, user_id, api, cost=1, max_wait=None):
+        """Take `cost` tokens, waiting if needed; raises RateLimited when the wait is too long."""
+        if api not in self.limits:
+            return
+        key = (user_id, api)
+        max_wait = self.max_wait if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                bucket = self._bucket(key, now)
+                bucket.refill(now)
+                # A cost above the burst size runs the bucket into debt rather
+                # than never being admitted
+                needed = min(cost, bucket.capacity)
+                if now >= bucket.blocked_until and bucket.tokens >= needed:
+                    bucket.tokens -= cost
+                    bucket.allowed += 1
+                    return
+                wait = max(bucket.blocked_until - now, (needed - bucket.tokens) / bucket.rate)
+                if now + wait > deadline:
+                    bucket.local_rejections += 1
+                    raise RateLimited(key, wait)
+            time.sleep(wait)
+
+    def record(self, user_id, api, status_code, retry_after=None):
+        """Feed an upstream response back into the limiter."""
+        if api not in self.limits:
+            return
+        key = (user_id, api)
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(key, now)
+            if status_code == 429:
+                # Multiplicative decrease, and honour Retry-After
+                min_rate = bucket.base_rate * self.min_rate_fraction
+                bucket.rate = max(min_rate, bucket.rate * self.decrease_factor)
+                bucket.refill(now)
+                bucket.tokens = min(bucket.tokens, 0.0)
+                pause = retry_after if retry_after is not None else 1.0 / bucket.rate
+                bucket.blocked_until = max(bucket.blocked_until, now + pause)
+                bucket.upstream_throttles += 1
+                bucket.last_throttled_at = time.time()
+            elif status_code < 400 and bucket.rate < bucket.base_rate:
+                # Additive increase: probe back towards the configured rate
+                bucket.refill(now)
+                bucket.rate = min(bucket.base_rate, bucket.rate + bucket.base_rate * self.increase_fraction)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            keys = []
+            totals = collections.Counter()
+            for (user_id, api), bucket in self._buckets.items():
+                totals["allowed"] += bucket.allowed
+                totals["local_rejections"] += bucket.local_rejections
+                totals["upstream_throttles"] += bucket.upstream_throttles
+                if bucket.rate < bucket.base_rate or bucket.blocked_until > now:
+                    keys.append({
+                        "user_id": user_id,
+                        "api": api,
+                        "rate": round(bucket.rate, 4),
+                        "base_rate": bucket.base_rate,
+                        "blocked_for": round(max(0.0, bucket.blocked_until - now), 3),
+                        "local_rejections": bucket.local_rejections,
+                        "upstream_throttles": bucket.upstream_throttles,
+                        "last_throttled_at": bucket.last_throttled_at,
+                    })
+            return {
+                "limits": {api: {"rate": rate, "burst": burst} for api, (rate, burst) in self.limits.items()},
+                "tracked_keys": len(self._buckets),
+                # Calls we held back ourselves vs. 429s that came from Google
+                "local_rejections": totals["local_rejections"],
+                "upstream_throttles": totals["upstream_throttles"],
+                "allowed": totals["allowed"],
+                "throttled": keys,
+            }
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, burst = self.limits[key[1]]
+            bucket = _Bucket(rate, burst, now)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
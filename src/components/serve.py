@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Production entry point for the MCP server: a pre-forking master with a pool
+of threads in each worker.
+
+    python serve.py --workers 4 --threads 8 --port 5001
+
+The master opens the listening socket, migrates the database schema if it
+is behind, then forks the workers, which share the socket. Each worker
+starts its background threads (the typed-column backfill and the proactive
+token refresher run in one designated worker only), warms its database connection, HTTP session
+and caches, and only then reports ready and starts accepting. A worker accepts a
+connection only while one of its threads is free, so requests queue in the
+kernel backlog for whichever worker can take them next.
+
+Signals to the master:
+
+    TERM, INT  stop accepting, let in-flight requests finish (up to
+               --graceful-timeout), then exit
+    HUP        reload: re-exec the master with the same socket, start a new
+               set of workers on the new code, and drain the old ones once
+               the new ones are ready; no connection is refused meanwhile
+
+Workers that die are replaced. `python mcp_server.py` remains the
+development server.
+"""
+
+import argparse
+import glob
+import logging
+import os
+import selectors
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import metrics
+import structured_logging
+
+logger = logging.getLogger("serve")
+access_logger = logging.getLogger("serve.access")
+
+# Set by a reloading master for the one it execs
+LISTEN_FD_ENV = "MCP_SERVE_FD"
+OLD_WORKERS_ENV = "MCP_SERVE_OLD_WORKERS"
+# Metrics snapshot directory created by serve.py itself (removed on exit)
+OWN_METRICS_DIR_ENV = "MCP_SERVE_OWN_METRICS_DIR"
+
+
+class RequestHandler(WSGIRequestHandler):
+    # One request per connection, so an idle keep-alive client never holds a
+    # worker thread
+    protocol_version = "HTTP/1.0"
+
+    # One structured access log record per request (through the logging
+    # queue, like everything else) instead of werkzeug's colored line
+    def log_request(self, code="-", size="-"):
+        code = getattr(code, "value", code)
+        access_logger.info(
+            '%s "%s" %s %s', self.address_string(), self.requestline, code, size,
+            extra={"client": self.address_string(), "method": self.command, "path": self.path, "status": code},
+        )
+
+
+class WorkerServer(BaseWSGIServer):
+    """Werkzeug server on an inherited socket with a fixed pool of request threads."""
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, listener, app, threads, stopping):
+        host, port = listener.getsockname()[:2]
+        super().__init__(host, port, app, handler=RequestHandler, fd=listener.fileno())
+        self.socket.setblocking(False)
+        self.threads = threads
+        self._stopping = stopping
+        self._slots = threading.BoundedSemaphore(threads)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+
+    def serve(self):
+        """Accept and dispatch connections until `stopping` is set."""
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ)
+        try:
+            while not self._stopping.is_set():
+                # Only take a connection when a thread is free to handle it
+                if not self._slots.acquire(timeout=0.2):
+                    continue
+                try:
+                    if not selector.select(timeout=0.2):
+                        self._slots.release()
+                        continue
+                    conn, address = self.socket.accept()
+                except OSError:
+                    # Another worker took it first (BlockingIOError) or the client went away
+                    self._slots.release()
+                    continue
+                conn.setblocking(True)
+                self._executor.submit(self._handle, conn, address)
+        finally:
+            selector.close()
+
+    def drain(self, timeout):
+        """Wait up to `timeout` seconds for in-flight requests; True if all finished."""
+        deadline = time.monotonic() + timeout
+        idle = 0
+        while idle < self.threads:
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                break
+            idle += 1
+        self._executor.shutdown(wait=False)
+        self.server_close()
+        return idle == self.threads
+
+    def _handle(self, conn, address):
+        try:
+            self.finish_request(conn, address)
+        except Exception:
+            self.handle_error(conn, address)
+        finally:
+            self.shutdown_request(conn)
+            self._slots.release()
+
+
+def run_worker(listener, args, ready_fd, backfill=False, refresher=False):
+    """Body of a forked worker process; returns its exit code."""
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    # Ctrl-C and reloads are the master's business
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    import mcp_server
+    mcp_server.start_background(backfill=backfill, refresher=refresher)
+    try:
+        warmup = mcp_server.warmup()
+        logger.info("Worker %s warmed up in %ss (%s tokens cached)", os.getpid(), warmup["seconds"], warmup["tokens_loaded"])
+    except Exception as e:
+        logger.warning("Worker %s warmup failed: %s", os.getpid(), e)
+    server = WorkerServer(listener, mcp_server.create_app(), args.threads, stopping)
+    os.write(ready_fd, b"1")
+    os.close(ready_fd)
+
+    server.serve()
+    # A replacement refresher may already be starting; stop scanning now
+    # rather than after the drain
+    mcp_server.token_refresher.stop()
+    if not server.drain(args.graceful_timeout):
+        logger.warning("Worker %s: requests still running after %ss, exiting anyway", os.getpid(), args.graceful_timeout)
+    mcp_server.stop_background(timeout=args.graceful_timeout)
+    mcp_server.reset_db_state()
+    return 0
+
+
+class Master:
+    def __init__(self, listener, args):
+        self.listener = listener
+        self.args = args
+        self.workers = {}  # pid -> start time
+        self.old_workers = set()
+        self.backfill_pending = False
+        # The one worker running the proactive token refresher
+        self.refresher_pid = None
+        self._stop = False
+        self._reload = False
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        # Workers publish metrics snapshots here so /metrics on any of them
+        # covers all; set before mcp_server reads its configuration
+        if not os.environ.get("METRICS_MULTIPROC_DIR"):
+            os.environ["METRICS_MULTIPROC_DIR"] = os.environ[OWN_METRICS_DIR_ENV] = tempfile.mkdtemp(prefix="mcp-metrics-")
+        elif OLD_WORKERS_ENV not in os.environ:
+            # Fresh start: counters from a previous run don't carry over
+            for path in glob.glob(os.path.join(os.environ["METRICS_MULTIPROC_DIR"], "metrics-*.json")):
+                os.remove(path)
+
+        import mcp_server
+        # Migrate (if the database is behind) once, before any worker exists;
+        # the typed-column backfill that follows is left to one worker
+        self.backfill_pending = mcp_server.ensure_schema(backfill=False)
+        # Workers open their own connections; nothing may be shared across fork
+        mcp_server.reset_db_state()
+
+        self.old_workers = {int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, "").split(",") if pid}
+        started = self.start_workers(self.args.workers)
+        if self.old_workers:
+            if started:
+                logger.info("Reloaded; draining %s old workers", len(self.old_workers))
+                self.signal_workers(self.old_workers, signal.SIGTERM)
+            else:
+                # The new code can't start; keep serving with the old workers
+                logger.error("New workers failed to start; old workers keep serving")
+
+        host, port = self.listener.getsockname()[:2]
+        logger.info("Serving on http://%s:%s (master %s, %s workers x %s threads)", host, port, os.getpid(), self.args.workers, self.args.threads)
+        while True:
+            self.reap()
+            if self._stop:
+                self.shutdown()
+                return 0
+            if self._reload:
+                self.reload()
+            time.sleep(0.2)
+
+    def start_workers(self, count):
+        """Fork `count` workers and wait until each is warmed up; True if all are."""
+        pending = {}
+        for _ in range(count):
+            pid, ready_fd = self.spawn()
+            pending[pid] = ready_fd
+        deadline = time.monotonic() + self.args.warmup_timeout
+        ready = 0
+        for pid, ready_fd in pending.items():
+            selector = selectors.DefaultSelector()
+            selector.register(ready_fd, selectors.EVENT_READ)
+            if selector.select(timeout=max(0.0, deadline - time.monotonic())):
+                # EOF instead of a byte means the worker died during warmup
+                ready += os.read(ready_fd, 1) == b"1"
+            selector.close()
+            os.close(ready_fd)
+        return ready == count
+
+    def spawn(self):
+        backfill, self.backfill_pending = self.backfill_pending, False
+        refresher = self.refresher_pid is None
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            code = 1
+            try:
+                code = run_worker(self.listener, self.args, ready_write, backfill, refresher)
+            except BaseException:
+                logger.exception("Worker %s crashed", os.getpid())
+            finally:
+                # os._exit skips atexit; write out queued log records first
+                structured_logging.shutdown()
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        os.close(ready_write)
+        self.workers[pid] = time.monotonic()
+        if refresher:
+            self.refresher_pid = pid
+        return pid, ready_read
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.remove_metrics(pid)
+            self.old_workers.discard(pid)
+            if pid == self.refresher_pid:
+                # Its replacement takes over
+                self.refresher_pid = None
+            started = self.workers.pop(pid, None)
+            if started is None or self._stop:
+                continue
+            logger.warning("Worker %s exited with status %s; starting a replacement", pid, os.waitstatus_to_exitcode(status))
+            # Don't spin if workers die straight away
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            self.start_workers(1)
+
+    def reload(self):
+        logger.info("Reloading master %s", os.getpid())
+        env = dict(os.environ)
+        env[LISTEN_FD_ENV] = str(self.listener.fileno())
+        env[OLD_WORKERS_ENV] = ",".join(str(pid) for pid in set(self.workers) | self.old_workers)
+        os.set_inheritable(self.listener.fileno(), True)
+        structured_logging.shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        argv = getattr(sys, "orig_argv", None) or [sys.executable] + sys.argv
+        # Same pid, so the old workers stay our children and are reaped as they exit
+        os.execve(sys.executable, [sys.executable] + argv[1:], env)
+
+    def shutdown(self):
+        workers = set(self.workers) | self.old_workers
+        logger.info("Stopping %s workers", len(workers))
+        self.signal_workers(workers, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while workers and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.remove_metrics(pid)
+                workers.discard(pid)
+            else:
+                time.sleep(0.1)
+        self.signal_workers(workers, signal.SIGKILL)
+        self.listener.close()
+        if os.environ.get(OWN_METRICS_DIR_ENV):
+            shutil.rmtree(os.environ[OWN_METRICS_DIR_ENV], ignore_errors=True)
+
+    # A worker's metrics snapshot goes when it does, so scrapes add up live
+    # workers only and the directory doesn't grow as workers are replaced.
+    # The totals drop by its counts, which Prometheus reads as a counter reset.
+    def remove_metrics(self, pid):
+        directory = os.environ.get("METRICS_MULTIPROC_DIR")
+        if directory:
+            metrics.remove_snapshot(directory, pid)
+
+    def signal_workers(self, pids, signum):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _on_stop(self, signum, frame):
+        self._stop = True
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+
+def open_listener(host, port, backlog):
+    if os.environ.get(LISTEN_FD_ENV):
+        fd = int(os.environ.pop(LISTEN_FD_ENV))
+        listener = socket.socket(fileno=fd)
+    else:
+        listener = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen(backlog)
+    listener.set_inheritable(False)
+    listener.setblocking(False)
+    return listener
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default=os.environ.get("BACKEND_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("BACKEND_PORT", 5001)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SERVE_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("SERVE_THREADS", 8)))
+    parser.add_argument("--backlog", type=int, default=int(os.environ.get("SERVE_BACKLOG", 2048)))
+    parser.add_argument("--graceful-timeout", type=float, default=float(os.environ.get("SERVE_GRACEFUL_TIMEOUT", 30)))
+    parser.add_argument("--warmup-timeout", type=float, default=float(os.environ.get("SERVE_WARMUP_TIMEOUT", 60)))
+    args = parser.parse_args()
+
+    structured_logging.setup()
+    listener = open_listener(args.host, args.port, args.backlog)
+    return Master(listener, args).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+SQLite storage tuned for many concurrent writers.
+
+Connections opened through apply_pragmas() use WAL, so readers never wait
+for the writer. All writes to one file go through a single
+GroupCommitWriter thread. It takes every write that is queued, runs them
+in one transaction (each under its own savepoint, so one failure doesn't
+sink the rest) and commits once. A burst of N concurrent writes then costs
+a handful of commits instead of N, and requests never fight over the write
+lock with "database is locked" errors.
+
+SQLiteShards hash-partitions rows by key (user_id) across several files.
+Each file has its own writer and its own per-thread readers, so
+throughput scales with files instead of sharing one lock.
+"""
+
+import concurrent.futures
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+from db_pool import ThreadLocalConnections
+
+logger = logging.getLogger(__name__)
+
+
+def apply_pragmas(conn, busy_timeout=5.0, synchronous="NORMAL", cache_size_kb=16384, mmap_size=256 * 1024 * 1024):
+    """Put `conn` in WAL mode and tune it for concurrent access."""
+    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL only syncs at checkpoints in WAL mode: a power loss can drop the
+    # last commits but never corrupts the database
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    conn.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+    conn.execute(f"PRAGMA cache_size={-int(cache_size_kb)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    return conn
+
+
+def shard_index(key, count):
+    """Stable shard for `key` (the same in every process, unlike hash())."""
+    return zlib.crc32(str(key).encode()) % count
+
+
+class GroupCommitWriter:
+    """Single thread that owns a write connection and commits queued writes in groups."""
+
+    def __init__(self, connect, max_batch=256, max_delay=0.0, name="sqlite-writer"):
+        self._connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"writes": 0, "failed": 0, "commits": 0, "largest_group": 0}
+
+    def submit(self, fn):
+        """Queue `fn(conn)`; the returned future resolves once its group has committed."""
+        future = concurrent.futures.Future()
+        self._ensure_started()
+        self._queue.put((fn, future))
+        return future
+
+    def write(self, fn):
+        """Run `fn(conn)` in the next group commit and return its result."""
+        return self.submit(fn).result()
+
+    def stop(self, timeout=None):
+        """Finish the queued writes, then stop the thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mean_group"] = round(stats["writes"] / stats["commits"], 2) if stats["commits"] else 0
+        return stats
+
+    def _ensure_started(self):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            return
+        with self._lock:
+            # Also true in a forked child, where the parent's thread doesn't exist
+            if self._thread is None or not self._thread.is_alive():
+                self._queue = queue.SimpleQueue()
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self, pending):
+        conn = None
+        stopping = False
+        while not stopping:
+            item = pending.get()
+            if item is None:
+                break
+            group = [item]
+            deadline = time.monotonic() + self.max_delay
+            # Everything that queued up during the previous commit goes in this one
+            while len(group) < self.max_batch:
+                try:
+                    wait = deadline - time.monotonic()
+                    item = pending.get(timeout=wait) if wait > 0 else pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+            try:
+                if conn is None:
+                    conn = self._connect()
+                    # Transactions are managed explicitly below
+                    conn.isolation_level = None
+                self._commit(conn, group)
+            except Exception as e:
+                logger.error("%s: group commit failed: %s", self.name, e)
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                if conn is not None:
+                    try:
+                        if conn.in_transaction:
+                            conn.execute("ROLLBACK")
+                    except sqlite3.Error:
+                        conn.close()
+                        conn = None
+        if conn is not None:
+            conn.close()
+
+    def _commit(self, conn, group):
+        conn.execute("BEGIN IMMEDIATE")
+        outcomes = []
+        for fn, future in group:
+            conn.execute("SAVEPOINT write")
+            try:
+                outcomes.append((future, fn(conn), None))
+            except Exception as e:
+                conn.execute("ROLLBACK TO write")
+                outcomes.append((future, None, e))
+            conn.execute("RELEASE write")
+        conn.execute("COMMIT")
+        failed = 0
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+                failed += 1
+        with self._lock:
+            self._stats["writes"] += len(group)
+            self._stats["failed"] += failed
+            self._stats["commits"] += 1
+            self._stats["largest_group"] = max(self._stats["largest_group"], len(group))
+
+
+class SQLiteShards:
+    """
+    Rows partitioned by key across SQLite files, each with one group-commit
+    writer and a reader connection per thread.
+
+    `connect(path)` opens a configured connection. `setup(index, conn)`, if
+    given, runs once per shard and process before the shard is first used
+    (creating tables, say) on an autocommit connection. Every connection has
+    a `shard_index(key)` SQL function.
+    """
+
+    def __init__(self, paths, connect, setup=None, max_batch=256, max_delay=0.0):
+        self.paths = list(paths)
+        self._connect = connect
+        self._setup = setup
+        self._ready = [setup is None] * len(self.paths)
+        self._setup_lock = threading.Lock()
+        self._readers = [
+            ThreadLocalConnections(lambda index=index: self._open(index)) for index in range(len(self.paths))
+        ]
+        self._writers = [
+            GroupCommitWriter(
+                lambda index=index: self._open(index), max_batch=max_batch, max_delay=max_delay,
+                name=f"sqlite-writer-{index}",
+            )
+            for index in range(len(self.paths))
+        ]
+
+    @property
+    def count(self):
+        return len(self.paths)
+
+    def shard(self, key):
+        return shard_index(key, len(self.paths))
+
+    def reader(self, key):
+        """This thread's connection to `key`'s shard; close() releases it."""
+        return self.reader_for(self.shard(key))
+
+    def reader_for(self, index):
+        self._ensure_ready(index)
+        return self._readers[index].getconn()
+
+    def readers(self):
+        """One connection per shard, for queries that span all of them."""
+        return [self.reader_for(index) for index in range(len(self.paths))]
+
+    def submit(self, index, fn):
+        """Queue `fn(conn)` on shard `index`'s writer; returns a future."""
+        self._ensure_ready(index)
+        return self._writers[index].submit(fn)
+
+    def write(self, key, fn):
+        """Run `fn(conn)` in a group commit on `key`'s shard and return its result."""
+        return self.submit(self.shard(key), fn).result()
+
+    def close(self, timeout=None):
+        """Stop the writers (after their queued writes) and close this thread's readers."""
+        for writer in self._writers:
+            writer.stop(timeout)
+        for readers in self._readers:
+            readers.closeall()
+
+    def stats(self):
+        return {
+            "shards": len(self.paths),
+            "writers": [writer.stats() for writer in self._writers],
+            "readers": [readers.stats() for readers in self._readers],
+        }
+
+    def _open(self, index):
+        conn = self._connect(self.paths[index])
+        conn.create_function("shard_index", 1, self.shard, deterministic=True)
+        return conn
+
+    def _ensure_ready(self, index):
+        if self._ready[index]:
+            return
+        with self._setup_lock:
+            if self._ready[index]:
+                return
+            conn = self._open(index)
+            conn.isolation_level = None
+            try:
+                self._setup(index, conn)
+            finally:
+                conn.close()
+            self._ready[index] = True
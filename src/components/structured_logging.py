@@ -0,0 +1,240 @@
+"""
+Structured logging with a background writer.
+
+setup() routes the root logger through a bounded in-memory queue that a
+single writer thread drains, formatting each record (JSON lines, or text on
+a terminal) and writing it to stderr. A thread that logs only builds the
+record and enqueues it; it never waits on the stream. If the writer falls
+behind and the queue fills up, new records are dropped instead; the next
+record that gets through says how many.
+
+Every record carries the correlation id of the request that produced it
+(the `request_id` context variable, which the server sets per request).
+Call sites that keep logging warnings or errors are rate-limited: past
+`burst` records per `interval` seconds the rest are dropped, and the next
+record let through reports how many were suppressed.
+
+Modules log through the standard library as usual:
+
+    logger = logging.getLogger(__name__)
+    logger.error("Error getting token: %s", e)
+"""
+
+import atexit
+import contextvars
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+# Correlation id of the request being handled in this context
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord attributes that aren't user-supplied `extra` fields
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "request_id", "suppressed", "dropped",
+}
+
+
+def _extra_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS and not key.startswith("_")}
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current correlation id onto each record."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class RepeatFilter(logging.Filter):
+    """Lets at most `burst` records from one call site through per `interval`
+    seconds; records below `level` (access logs, say) are never limited."""
+
+    def __init__(self, burst=10, interval=60.0, level=logging.WARNING, max_sites=1000):
+        super().__init__()
+        self.burst = burst
+        self.level = level
+        self.interval = interval
+        self.max_sites = max_sites
+        self._windows = {}  # (pathname, lineno) -> [window start, records, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.burst <= 0 or record.levelno < self.level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                if window is None and len(self._windows) >= self.max_sites:
+                    self._expire(now)
+                self._windows[key] = [now, 1, 0]
+                return True
+            window[1] += 1
+            if window[1] <= self.burst:
+                return True
+            window[2] += 1
+            return False
+
+    def _expire(self, now):
+        for key, window in list(self._windows.items()):
+            if now - window[0] >= self.interval:
+                del self._windows[key]
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve everything that can't be done later on another thread: the
+        # message arguments and the traceback may change or go away
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # The first record that fits after some were dropped says how many
+        dropped = self.dropped
+        if dropped:
+            record.dropped = dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped -= dropped
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        entry.update(_extra_fields(record))
+        for counter in ("suppressed", "dropped"):
+            if getattr(record, counter, None):
+                entry[counter] = getattr(record, counter)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with the correlation id and extra fields appended."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if getattr(record, "request_id", None):
+            fields["request_id"] = record.request_id
+        for counter in ("suppressed", "dropped"):
+            if getattr(record, counter, None):
+                fields[counter] = getattr(record, counter)
+        if fields:
+            # Tracebacks (if any) are already on the following lines
+            first, _, rest = line.partition("\n")
+            line = first + " " + " ".join(f"{key}={value}" for key, value in fields.items()) + (f"\n{rest}" if rest else "")
+        return line
+
+
+_handler = None
+_listener = None
+_state_lock = threading.Lock()
+
+
+def _parse_levels(spec):
+    """`werkzeug=WARNING,job_queue=DEBUG` -> {"werkzeug": "WARNING", ...}"""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup(level=None, fmt=None, queue_size=None, stream=None):
+    """Install the queue handler on the root logger and start the writer; idempotent."""
+    global _handler, _listener
+    with _state_lock:
+        if _handler is not None:
+            return
+        level = level or os.environ.get("LOG_LEVEL", "INFO").upper()
+        stream = stream or sys.stderr
+        fmt = fmt or os.environ.get("LOG_FORMAT") or ("text" if stream.isatty() else "json")
+        queue_size = queue_size or int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+        writer = logging.StreamHandler(stream)
+        writer.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        _handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        _handler.addFilter(ContextFilter())
+        _handler.addFilter(RepeatFilter(
+            burst=int(os.environ.get("LOG_REPEAT_BURST", 10)),
+            interval=float(os.environ.get("LOG_REPEAT_INTERVAL", 60)),
+        ))
+        _listener = logging.handlers.QueueListener(_handler.queue, writer)
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_handler)
+        root.setLevel(level)
+        for name, logger_level in _parse_levels(os.environ.get("LOG_LEVELS", "")).items():
+            logging.getLogger(name).setLevel(logger_level)
+
+        _listener.start()
+        atexit.register(shutdown)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_restart_in_child)
+
+
+def shutdown():
+    """Write out queued records and stop the writer."""
+    with _state_lock:
+        if _listener is not None and _listener._thread is not None:
+            _listener.stop()
+
+
+def _restart_in_child():
+    # The writer thread doesn't survive fork, and the queue's lock may have
+    # been held by it; give the child its own of both
+    global _state_lock
+    _state_lock = threading.Lock()
+    if _handler is None:
+        return
+    _handler.queue = _listener.queue = queue.Queue(_handler.queue.maxsize)
+    _handler.dropped = 0
+    _listener._thread = None
+    _listener.start()
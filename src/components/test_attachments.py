@@ -0,0 +1,93 @@
+"""Tests for attachment URL fetching and its guard against internal addresses."""
+
+import io
+
+import pytest
+
+
+def send_with_url(client, user_id, url):
+    return client.post("/tools/send-email", json={
+        "user_id": user_id, "to": "someone@example.com", "subject": "Report", "body": "Attached.",
+        "attachments": [{"url": url, "filename": "report.json"}],
+    })
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:1/secret",
+    "http://localhost/secret",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.0.0.8/internal",
+    "http://[::1]/secret",
+    "http://224.0.0.1/",
+    "file:///etc/passwd",
+])
+def test_internal_urls_are_refused(server, url):
+    with pytest.raises(ValueError):
+        server.check_attachment_url(url)
+
+
+def test_public_address_is_allowed(server):
+    server.check_attachment_url("https://8.8.8.8/report.pdf")
+
+
+def test_refused_url_is_a_client_error_and_nothing_is_sent(client, fake_google, google_user):
+    response = send_with_url(client, google_user, f"{fake_google.url}/_stats")
+
+    assert response.status_code == 400
+    assert "not allowed" in response.get_json()["details"]
+    assert "gmail.send" not in fake_google.request_counts()
+
+
+def test_allow_listed_host_is_fetched(client, server, fake_google, google_user, monkeypatch):
+    monkeypatch.setattr(server, "ATTACHMENT_ALLOWED_HOSTS", {"127.0.0.1"})
+
+    response = send_with_url(client, google_user, f"{fake_google.url}/_stats")
+
+    assert response.status_code == 200
+    assert fake_google.request_counts()["gmail.send"] == 1
+
+
+def test_redirects_are_checked_too(client, server, fake_google, google_user, monkeypatch):
+    monkeypatch.setattr(server, "ATTACHMENT_ALLOWED_HOSTS", {"127.0.0.1"})
+    # The fake consent screen redirects wherever redirect_uri says
+    url = f"{fake_google.url}/o/oauth2/auth?response_type=code&redirect_uri=http://169.254.169.254/latest/meta-data/"
+
+    response = send_with_url(client, google_user, url)
+
+    assert response.status_code == 400
+    assert "169.254.169.254" in response.get_json()["details"]
+
+
+def test_host_rebinding_to_an_internal_address_is_refused(client, server, fake_google, google_user, monkeypatch):
+    real_getaddrinfo = server.socket.getaddrinfo
+    lookups = []
+
+    # Public for the check, loopback for the connection that follows
+    def rebinding(host, port, *args, **kwargs):
+        lookups.append(host)
+        if len(lookups) == 1:
+            return [(server.socket.AF_INET, server.socket.SOCK_STREAM, 6, "", ("93.184.215.14", port))]
+        return real_getaddrinfo(host, port, *args, **kwargs)
+
+    monkeypatch.setattr(server.socket, "getaddrinfo", rebinding)
+    port = fake_google.url.rsplit(":", 1)[1]
+
+    response = send_with_url(client, google_user, f"http://localhost:{port}/_stats")
+
+    assert len(lookups) >= 2
+    assert response.status_code == 400
+    assert "not allowed" in response.get_json()["details"]
+    assert "gmail.send" not in fake_google.request_counts()
+
+
+@pytest.mark.parametrize("field", ["[{not json", '{"url": "https://example.com/a.pdf"}'])
+def test_malformed_attachments_field_of_an_upload_is_a_client_error(client, fake_google, google_user, field):
+    response = client.post("/tools/send-email", content_type="multipart/form-data", data={
+        "user_id": google_user, "to": "someone@example.com", "subject": "Report", "body": "Attached.",
+        "attachments": field,
+        "file": (io.BytesIO(b"data"), "report.bin", "application/octet-stream"),
+    })
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid attachments field"
+    assert "gmail.send" not in fake_google.request_counts()
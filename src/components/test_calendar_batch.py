@@ -0,0 +1,49 @@
+"""Tests for /tools/create-event/batch and the multipart batch codec, against fake_google.py."""
+
+from google_batch import encode_http_response, encode_multipart, parse_batch_response
+
+
+def event(summary):
+    return {"summary": summary, "start_time": "2026-01-05T10:00:00Z", "end_time": "2026-01-05T11:00:00Z"}
+
+
+def test_parse_batch_response_maps_parts_to_content_ids():
+    body = encode_multipart([
+        ({"Content-Type": "application/http", "Content-ID": "<response-item-1>"},
+         encode_http_response(400, "Bad Request", {"error": {"code": 400}})),
+        ({"Content-Type": "application/http", "Content-ID": "<response-item-0>"},
+         encode_http_response(200, "OK", {"id": "abc"})),
+    ], "b0undary")
+
+    parts = parse_batch_response(body, "multipart/mixed; boundary=b0undary")
+
+    assert parts == {"item-0": (200, {"id": "abc"}), "item-1": (400, {"error": {"code": 400}})}
+
+
+def test_batch_results_follow_input_order_across_chunks(client, server, fake_google, google_user, monkeypatch):
+    monkeypatch.setattr(server, "CALENDAR_BATCH_LIMIT", 2)
+    summaries = ["a", "fail", "c", "d", "e"]
+
+    response = client.post("/tools/create-event/batch", json={
+        "user_id": google_user, "events": [event(summary) for summary in summaries],
+    })
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body["batches"] == 3
+    assert (body["succeeded"], body["failed"]) == (4, 1)
+    assert [result["index"] for result in body["results"]] == list(range(5))
+    assert [result["status"] for result in body["results"]] == [200, 400, 200, 200, 200]
+    assert [result["event"]["summary"] for result in body["results"] if result["success"]] == ["a", "c", "d", "e"]
+    assert fake_google.request_counts()["calendar.batch"] == 3
+
+
+def test_batch_over_the_item_limit_is_rejected(client, server, fake_google, google_user, monkeypatch):
+    monkeypatch.setattr(server, "CALENDAR_BATCH_MAX_ITEMS", 3)
+
+    response = client.post("/tools/create-event/batch", json={
+        "user_id": google_user, "events": [event(str(i)) for i in range(4)],
+    })
+
+    assert response.status_code == 400
+    assert "calendar.batch" not in fake_google.request_counts()
@@ -0,0 +1,91 @@
+"""Tests for circuit_breaker.CircuitBreaker: opening, probing with backoff and closing again."""
+
+import time
+
+import pytest
+
+from circuit_breaker import CircuitBreaker
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def breakers():
+    made = []
+
+    def make(probe, **options):
+        breaker = CircuitBreaker("postgres", probe, **options)
+        made.append(breaker)
+        return breaker
+
+    yield make
+    for breaker in made:
+        breaker.stop()
+
+
+def test_opens_only_after_consecutive_failures(breakers):
+    breaker = breakers(lambda: None, failure_threshold=3, backoff_initial=60)
+
+    breaker.record_failure("refused")
+    breaker.record_failure("refused")
+    breaker.record_success()
+    breaker.record_failure("refused")
+    breaker.record_failure("refused")
+    assert breaker.allow() is True
+
+    breaker.record_failure("refused")
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow() is False
+    stats = breaker.stats()
+    assert (stats["failures"], stats["short_circuited"], stats["last_error"]) == (5, 1, "refused")
+
+
+def test_probe_closes_the_breaker_once_the_backend_is_back(breakers):
+    attempts = []
+
+    def probe():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise ConnectionError("still down")
+
+    breaker = breakers(probe, failure_threshold=1, backoff_initial=0.01, backoff_max=1)
+    breaker.record_failure("refused")
+
+    wait_for(lambda: breaker.state == CircuitBreaker.CLOSED)
+
+    assert breaker.allow() is True
+    stats = breaker.stats()
+    assert (stats["probes"], stats["probe_failures"]) == (3, 2)
+    assert stats["transitions"] == {"closed->open": 1, "open->half_open": 3, "half_open->open": 2, "half_open->closed": 1}
+    # Each failed probe doubles the wait before the next
+    assert attempts[2] - attempts[1] >= 0.02
+
+
+def test_backoff_is_capped(breakers):
+    def probe():
+        raise ConnectionError("down")
+
+    breaker = breakers(probe, failure_threshold=1, backoff_initial=0.01, backoff_max=0.04)
+    breaker.record_failure()
+
+    wait_for(lambda: breaker.stats()["probe_failures"] >= 4)
+
+    assert breaker.state in (CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)
+    assert breaker.stats()["backoff_seconds"] == 0.04
+
+
+def test_reset_closes_and_forgets_failures(breakers):
+    breaker = breakers(lambda: None, failure_threshold=1, backoff_initial=60)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    breaker.reset()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["consecutive_failures"] == 0
@@ -0,0 +1,19 @@
+"""Tests for how tool routes answer when the database connection pool is exhausted."""
+
+from db_pool import PoolTimeout
+
+
+def test_exhausted_pool_is_503_not_401(client, server, monkeypatch):
+    def exhausted(*args, **kwargs):
+        raise PoolTimeout("No connection available within 5s")
+
+    monkeypatch.setattr(server, "get_token_connection", exhausted)
+    monkeypatch.setattr(server.token_cache, "get", lambda *args, **kwargs: None)
+
+    response = client.post("/tools/send-email", json={
+        "user_id": "busy-user", "to": "someone@example.com", "subject": "Hi", "body": "Hi",
+    })
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.get_json()["error"] == "Database busy"
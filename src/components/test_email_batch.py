@@ -0,0 +1,53 @@
+"""Tests for /tools/send-email/batch against fake_google.py."""
+
+
+def message(subject, body="Hi"):
+    return {"to": "someone@example.com", "subject": subject, "body": body}
+
+
+def test_batch_sends_each_message_in_input_order(client, fake_google, google_user):
+    response = client.post("/tools/send-email/batch", json={
+        "user_id": google_user, "messages": [message(f"Message {i}") for i in range(5)],
+    })
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body["success"], body["succeeded"]) == (True, 5)
+    assert [result["index"] for result in body["results"]] == list(range(5))
+    assert all(result["id"] for result in body["results"])
+    assert fake_google.request_counts()["gmail.send"] == 5
+
+
+def test_oversized_item_fails_alone(client, server, fake_google, google_user, monkeypatch):
+    monkeypatch.setattr(server, "GMAIL_MAX_MESSAGE_BYTES", 1000)
+
+    response = client.post("/tools/send-email/batch", json={
+        "user_id": google_user, "messages": [message("Small"), message("Large", body="x" * 5000), message("Small too")],
+    })
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert [result["status"] for result in body["results"]] == [200, 413, 200]
+    assert body["results"][1]["error"] == "Email too large"
+    assert fake_google.request_counts()["gmail.send"] == 2
+
+
+def test_unreadable_upstream_reply_fails_alone(client, server, fake_google, google_user, monkeypatch):
+    send = server.send_gmail_message
+
+    # Gmail accepted the call but the reply isn't JSON (a proxy error page, say)
+    def garbled(user_id, access_token, to, subject, body, **kwargs):
+        response = send(user_id, access_token, to, subject, body, **kwargs)
+        if subject == "Garbled":
+            response._content = b"<html>Bad gateway</html>"
+        return response
+
+    monkeypatch.setattr(server, "send_gmail_message", garbled)
+
+    response = client.post("/tools/send-email/batch", json={
+        "user_id": google_user, "messages": [message("Garbled"), message("Fine")],
+    })
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert [result["status"] for result in body["results"]] == [502, 200]
@@ -0,0 +1,161 @@
+"""Tests for the incrementally synced calendar cache (event_cache.py) and the calendar read tools."""
+
+import random
+import uuid
+
+import pytest
+
+from event_cache import CalendarSyncError, EventCache, IntervalIndex, parse_time
+
+
+class ScriptedCalendar:
+    """events.list over a change log: full listings skip cancelled events, sync tokens list changes since."""
+
+    def __init__(self, page_size=2):
+        self.page_size = page_size
+        self.log = []
+        self.calls = []
+        self.expired = False
+        self.fail_pages = set()
+
+    def change(self, event_id, start_hour=None, end_hour=None, **fields):
+        event = dict(fields, id=event_id)
+        if start_hour is not None:
+            event["start"] = {"dateTime": f"2026-03-01T{start_hour:02d}:00:00Z"}
+            event["end"] = {"dateTime": f"2026-03-01T{end_hour:02d}:00:00Z"}
+        self.log.append(event)
+
+    def fetch_page(self, user_id, access_token, sync_token, page_token):
+        self.calls.append((sync_token, page_token))
+        if page_token in self.fail_pages:
+            return 503, {"error": "Backend Error"}
+        if sync_token and self.expired:
+            return 410, {"error": "Sync token is no longer valid"}
+        since = int(sync_token or 0)
+        latest = {}
+        for event in self.log[since:]:
+            latest[event["id"]] = event
+        items = [event for event in latest.values() if since or event.get("status") != "cancelled"]
+        offset = int(page_token or 0)
+        body = {"items": items[offset:offset + self.page_size]}
+        if offset + self.page_size < len(items):
+            body["nextPageToken"] = str(offset + self.page_size)
+        else:
+            body["nextSyncToken"] = str(len(self.log))
+        return 200, body
+
+
+@pytest.fixture
+def calendar():
+    calendar = ScriptedCalendar()
+    for n, hour in enumerate([9, 11, 14]):
+        calendar.change(f"e{n}", hour, hour + 1, summary=f"Meeting {n}")
+    return calendar
+
+
+def ids(events):
+    return [event["id"] for event in events]
+
+
+def hour(value):
+    return parse_time(f"2026-03-01T{value:02d}:00:00Z")
+
+
+def test_full_sync_then_incremental_changes(calendar):
+    cache = EventCache(calendar.fetch_page, min_sync_interval=0)
+
+    assert cache.sync("alice", "token") == {"mode": "full", "pages": 2, "changes": 3}
+    calendar.change("e3", 16, 17)
+    calendar.change("e1", 12, 13, summary="Moved")
+    calendar.change("e0", status="cancelled")
+    result = cache.sync("alice", "token")
+
+    assert result == {"mode": "incremental", "pages": 2, "changes": 3}
+    assert calendar.calls[-2:] == [("3", None), ("3", "2")]
+    assert ids(cache.list_events("alice")) == ["e1", "e2", "e3"]
+    assert cache.list_events("alice")[0]["summary"] == "Moved"
+    assert ids(cache.list_events("alice", hour(13), hour(16))) == ["e2"]
+
+
+def test_free_busy_merges_overlaps_and_ignores_free_events():
+    calendar = ScriptedCalendar(page_size=10)
+    calendar.change("a", 9, 11)
+    calendar.change("b", 10, 12)
+    calendar.change("free", 12, 14, transparency="transparent")
+    calendar.change("c", 15, 18)
+    cache = EventCache(calendar.fetch_page)
+    cache.sync("alice", "token")
+
+    busy = cache.free_busy("alice", hour(8), hour(16))
+
+    assert busy == [[hour(9), hour(12)], [hour(15), hour(16)]]
+
+
+def test_expired_sync_token_falls_back_to_a_full_sync(calendar):
+    cache = EventCache(calendar.fetch_page, min_sync_interval=0)
+    cache.sync("alice", "token")
+    calendar.expired = True
+    calendar.change("e0", status="cancelled")
+
+    result = cache.sync("alice", "token")
+
+    assert result["mode"] == "full"
+    assert ids(cache.list_events("alice")) == ["e1", "e2"]
+    assert cache.stats()["token_expired"] == 1
+
+
+def test_reads_within_min_sync_interval_use_the_cache_until_marked_stale(calendar):
+    cache = EventCache(calendar.fetch_page, min_sync_interval=60)
+    cache.sync("alice", "token")
+    calls = len(calendar.calls)
+
+    assert cache.sync("alice", "token")["mode"] == "cached"
+    assert len(calendar.calls) == calls
+    cache.mark_stale("alice")
+    assert cache.sync("alice", "token")["mode"] == "incremental"
+
+
+def test_failed_full_sync_keeps_nothing(calendar):
+    cache = EventCache(calendar.fetch_page)
+    calendar.fail_pages.add("2")
+
+    with pytest.raises(CalendarSyncError) as failed:
+        cache.sync("alice", "token")
+
+    assert failed.value.status == 503
+    assert cache.list_events("alice") == []
+
+
+def test_interval_index_matches_a_linear_scan():
+    rng = random.Random(7)
+    intervals = []
+    for n in range(300):
+        start = rng.uniform(0, 1000)
+        intervals.append((start, start + rng.choice([0, rng.uniform(0, 50)]), n))
+    index = IntervalIndex(intervals)
+
+    for _ in range(200):
+        start = rng.uniform(-10, 1010)
+        end = start + rng.uniform(0.1, 100)
+        expected = sorted(
+            (interval for interval in intervals
+             if interval[0] < end and (interval[1] > start or (interval[0] == interval[1] and interval[0] >= start))),
+            key=lambda interval: interval[0],
+        )
+        assert index.overlapping(start, end) == expected
+
+
+def test_created_event_shows_up_in_the_next_listing(client, fake_google, google_user):
+    summary = f"Review {uuid.uuid4().hex[:8]}"
+    window = {"user_id": google_user, "time_min": "2031-05-01T00:00:00Z", "time_max": "2031-05-02T00:00:00Z"}
+    assert client.post("/tools/list-events", json=window).status_code == 200
+
+    created = client.post("/tools/create-event", json={
+        "user_id": google_user, "summary": summary,
+        "start_time": "2031-05-01T10:00:00-04:00", "end_time": "2031-05-01T11:00:00-04:00",
+    })
+    listed = client.post("/tools/list-events", json=window).get_json()
+
+    assert created.status_code == 200
+    assert summary in [event["summary"] for event in listed["events"]]
+    assert listed["sync"]["mode"] == "incremental"
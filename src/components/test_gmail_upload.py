@@ -0,0 +1,61 @@
+"""Tests for resumable Gmail uploads against fake_google.py, including chunks Google doesn't persist."""
+
+import email
+import io
+import os
+
+import pytest
+
+
+@pytest.fixture
+def resumable(server, monkeypatch):
+    # Send every message through the resumable endpoint in 256 KiB chunks
+    monkeypatch.setattr(server, "GMAIL_RAW_MAX_BYTES", 0)
+    monkeypatch.setattr(server, "GMAIL_RESUMABLE_THRESHOLD", 0)
+    monkeypatch.setattr(server, "GMAIL_UPLOAD_CHUNK_SIZE", 256 * 1024)
+
+
+def send_with_attachment(client, user_id, content):
+    return client.post("/tools/send-email", content_type="multipart/form-data", data={
+        "user_id": user_id, "to": "someone@example.com", "subject": "Report", "body": "Attached.",
+        "file": (io.BytesIO(content), "report.bin", "application/octet-stream"),
+    })
+
+
+def assert_uploaded(fake_google, content):
+    upload = fake_google.last_upload()
+    assert upload["type"] == "resumable"
+    message = email.message_from_bytes(upload["message"])
+    assert message["Subject"] == "Report"
+    attachments = [part for part in message.walk() if part.get_filename() == "report.bin"]
+    assert [part.get_payload(decode=True) for part in attachments] == [content]
+
+
+@pytest.mark.parametrize("drop, short", [(0, 0), (1, 0), (0, 1), (2, 1)], ids=["all-persisted", "first-dropped", "half-persisted", "mixed"])
+def test_resumable_upload_resends_what_google_did_not_persist(client, fake_google, google_user, resumable, drop, short):
+    # Dropping the first chunk makes the fake answer 308 without a Range header
+    fake_google.app.config.update(UPLOAD_DROP_NEXT=drop, UPLOAD_SHORT_NEXT=short)
+    content = os.urandom(600 * 1024)
+
+    response = send_with_attachment(client, google_user, content)
+
+    assert response.status_code == 200, response.get_json()
+    assert_uploaded(fake_google, content)
+    assert fake_google.request_counts()["gmail.upload_chunk"] > 3
+
+
+def test_resumable_upload_fails_when_google_loses_persisted_bytes(client, server, fake_google, google_user, resumable, monkeypatch):
+    put = server.upstream.request
+
+    # A 308 whose Range is behind bytes already acknowledged
+    def forgetful(method, url, **kwargs):
+        response = put(method, url, **kwargs)
+        if response.status_code == 308 and kwargs["headers"]["Content-Range"].startswith("bytes 262144-"):
+            response.headers["Range"] = "bytes=0-99"
+        return response
+
+    monkeypatch.setattr(server.upstream, "request", forgetful)
+
+    response = send_with_attachment(client, google_user, os.urandom(600 * 1024))
+
+    assert response.status_code == 502
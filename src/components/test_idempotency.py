@@ -0,0 +1,128 @@
+"""Tests for Idempotency-Key replay, conflicts and stale claims (idempotency.py)."""
+
+import io
+import sqlite3
+import threading
+import time
+import uuid
+
+import pytest
+
+from idempotency import IdempotencyConflict, IdempotencyInProgress, IdempotencyStore
+
+
+def send_email(client, user_id, key, subject="Hello"):
+    return client.post(
+        "/tools/send-email",
+        json={"user_id": user_id, "to": "someone@example.com", "subject": subject, "body": "Hi"},
+        headers={"Idempotency-Key": key},
+    )
+
+
+def test_retry_replays_the_stored_response(client, fake_google, google_user):
+    key = uuid.uuid4().hex
+    first = send_email(client, google_user, key)
+    retry = send_email(client, google_user, key)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_json() == first.get_json()
+    assert fake_google.request_counts()["gmail.send"] == 1
+
+
+def test_reusing_a_key_with_another_body_conflicts(client, fake_google, google_user):
+    key = uuid.uuid4().hex
+    assert send_email(client, google_user, key).status_code == 200
+    assert send_email(client, google_user, key, subject="Something else").status_code == 422
+    assert fake_google.request_counts()["gmail.send"] == 1
+
+
+def test_reusing_a_key_with_another_uploaded_file_conflicts(client, fake_google, google_user):
+    key = uuid.uuid4().hex
+
+    def upload(content):
+        return client.post("/tools/send-email", content_type="multipart/form-data", headers={"Idempotency-Key": key}, data={
+            "user_id": google_user, "to": "someone@example.com", "subject": "Report", "body": "Attached.",
+            "file": (io.BytesIO(content), "report.bin", "application/octet-stream"),
+        })
+
+    assert upload(b"first report").status_code == 200
+    assert upload(b"first report").headers["Idempotent-Replayed"] == "true"
+    assert upload(b"other report").status_code == 422
+    assert fake_google.request_counts()["gmail.send"] == 1
+
+
+def test_in_flight_duplicate_with_another_body_conflicts(server, fake_google, google_user):
+    fake_google.app.config["LATENCY"] = 0.5
+    key = uuid.uuid4().hex
+    statuses = {}
+
+    def send(subject):
+        statuses[subject] = send_email(server.app.test_client(), google_user, key, subject=subject).status_code
+
+    first = threading.Thread(target=send, args=("First",))
+    first.start()
+    # Let the first request become the in-flight leader
+    time.sleep(0.2)
+    send("Second")
+    first.join()
+
+    assert statuses == {"First": 200, "Second": 422}
+    assert fake_google.request_counts()["gmail.send"] == 1
+
+
+@pytest.fixture
+def connect(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+    return lambda: sqlite3.connect(path, timeout=5)
+
+
+def make_store(connect, **options):
+    store = IdempotencyStore(connect, lambda conn: False, memory_size=0, wait_timeout=0.3, poll_interval=0.05, **options)
+    assert store.init_schema()
+    return store
+
+
+def test_stale_claim_is_taken_over(connect):
+    store = make_store(connect, lease_timeout=60)
+    fingerprint = "f" * 64
+    # A worker claimed the key and crashed before storing a response
+    stale_lease, stored = store._claim("k", fingerprint)
+    assert stored is None
+    conn = connect()
+    conn.execute("UPDATE idempotency_keys SET claimed_at = ? WHERE key = 'k'", (stale_lease - 120,))
+    conn.commit()
+    conn.close()
+
+    assert store.execute("k", fingerprint, lambda: ({"ok": True}, 200)) == ({"ok": True}, 200, False)
+    # The crashed worker's late response doesn't replace the new one
+    store._complete("k", stale_lease - 120, {"late": True}, 200)
+    assert store.execute("k", fingerprint, lambda: pytest.fail("ran twice")) == ({"ok": True}, 200, True)
+    assert store.stats()["taken_over"] == 1
+
+
+def test_fresh_claim_is_not_taken_over(connect):
+    store = make_store(connect, lease_timeout=60)
+    store._claim("k", "f" * 64)
+
+    with pytest.raises(IdempotencyInProgress):
+        store.execute("k", "f" * 64, lambda: pytest.fail("ran while claimed"))
+    with pytest.raises(IdempotencyConflict):
+        store.execute("k", "e" * 64, lambda: pytest.fail("ran with another body"))
+
+
+def test_init_schema_adds_claimed_at_to_an_existing_table(connect):
+    conn = connect()
+    conn.execute("""
+        CREATE TABLE idempotency_keys (
+            key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, status_code INTEGER, response TEXT,
+            created_at DOUBLE PRECISION NOT NULL, expires_at DOUBLE PRECISION NOT NULL
+        )
+    """)
+    conn.execute("INSERT INTO idempotency_keys VALUES ('k', ?, NULL, NULL, ?, ?)", ("f" * 64, time.time() - 120, time.time() + 3600))
+    conn.commit()
+    conn.close()
+
+    store = make_store(connect, lease_timeout=60)
+
+    assert store.execute("k", "f" * 64, lambda: ({"ok": True}, 200)) == ({"ok": True}, 200, False)
@@ -0,0 +1,139 @@
+"""Tests for job_queue.JobQueue on a throwaway SQLite database."""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from job_queue import DEAD, FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue
+
+
+@pytest.fixture
+def connect(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    return lambda: sqlite3.connect(path, timeout=5)
+
+
+def make_queue(connect, handlers, **options):
+    queue = JobQueue(connect, lambda conn: False, handlers, workers=0, **options)
+    assert queue.init_schema()
+    return queue
+
+
+def test_running_job_keeps_its_lock_past_lock_timeout(connect):
+    calls = []
+
+    def slow(payload):
+        calls.append(payload)
+        time.sleep(0.8)
+        return 200, {"sent": True}
+
+    queue = make_queue(connect, {"send": slow}, lock_timeout=0.3)
+    # A second worker (another process, say) polling the same table
+    other = make_queue(connect, {"send": slow}, lock_timeout=0.3)
+    job_id = queue.enqueue("send", {"n": 1})
+
+    runner = threading.Thread(target=queue.run_pending)
+    runner.start()
+    while queue.get(job_id)["status"] != RUNNING:
+        time.sleep(0.01)
+    deadline = time.monotonic() + 0.7
+    while time.monotonic() < deadline:
+        assert other.run_pending() == 0
+        time.sleep(0.05)
+    runner.join()
+
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"], job["result"]) == (SUCCEEDED, 1, {"sent": True})
+    assert calls == [{"n": 1}]
+
+
+def test_stale_claim_is_taken_over_and_its_late_result_dropped(connect):
+    queue = make_queue(connect, {"send": lambda payload: (200, {})}, lock_timeout=60)
+    job_id = queue.enqueue("send", {})
+    claimed_id, _, _, attempt, _ = queue._claim()
+    assert (claimed_id, attempt) == (job_id, 1)
+    assert queue._claim() is None
+
+    # The worker died without a heartbeat
+    conn = connect()
+    conn.execute("UPDATE jobs SET locked_at = ? WHERE id = ?", (time.time() - 120, job_id))
+    conn.commit()
+    conn.close()
+
+    assert queue._claim()[3] == 2
+    queue._finish(job_id, 1, FAILED, error="late")
+    assert queue.get(job_id)["status"] == RUNNING
+    queue._finish(job_id, 2, SUCCEEDED, 200, {"ok": True})
+    assert queue.get(job_id)["status"] == SUCCEEDED
+
+
+def test_prune_deletes_only_old_finished_jobs(connect):
+    queue = make_queue(connect, {"send": lambda payload: (200, {})}, retention=3600)
+    ids = {status: queue.enqueue("send", {}) for status in (SUCCEEDED, FAILED, DEAD, QUEUED)}
+    recent = queue.enqueue("send", {})
+    conn = connect()
+    for status, job_id in ids.items():
+        conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (status, time.time() - 7200, job_id))
+    conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (SUCCEEDED, recent))
+    conn.commit()
+    conn.close()
+
+    assert queue.prune() == 3
+    assert [status for status, job_id in ids.items() if queue.get(job_id)] == [QUEUED]
+    assert queue.get(recent) is not None
+    assert queue.stats()["pruned"] == 3
+
+
+def test_5xx_result_is_retried_only_for_idempotent_kinds(connect):
+    unavailable = lambda payload: (503, {"error": "Backend Error"})
+    queue = make_queue(connect, {"send": unavailable, "list": unavailable}, idempotent_kinds={"list"})
+    send, listing = queue.enqueue("send", {}), queue.enqueue("list", {})
+
+    assert queue.run_pending() == 2
+
+    assert (queue.get(send)["status"], queue.get(send)["result_status"]) == (FAILED, 503)
+    assert queue.get(listing)["status"] == QUEUED
+
+
+@pytest.fixture
+def email_jobs(server, connect):
+    return make_queue(connect, {"send_email": server.run_tool_job(server.send_email_tool)}, idempotent_kinds=())
+
+
+def enqueue_email(queue, user_id):
+    return queue.enqueue("send_email", {"user_id": user_id, "to": "someone@example.com", "subject": "Hi", "body": "Hi"})
+
+
+def test_email_job_is_not_resent_after_a_read_timeout(server, fake_google, google_user, email_jobs, monkeypatch):
+    monkeypatch.setattr(server.upstream, "timeout", (3.05, 0.2))
+    fake_google.app.config["LATENCY"] = 0.5
+    job_id = enqueue_email(email_jobs, google_user)
+
+    email_jobs.run_pending()
+
+    job = email_jobs.get(job_id)
+    assert (job["status"], job["attempts"]) == (FAILED, 1)
+    assert job["error"].startswith("ReadTimeout")
+
+
+def test_email_job_is_not_resent_after_a_5xx(fake_google, google_user, email_jobs):
+    fake_google.app.config.update(FAIL_NEXT=1, FAIL_STATUS=503)
+    job_id = enqueue_email(email_jobs, google_user)
+
+    email_jobs.run_pending()
+
+    assert email_jobs.get(job_id)["status"] == FAILED
+    assert fake_google.request_counts() == {"failed": 1}
+
+
+def test_email_job_is_retried_when_google_could_not_be_reached(server, google_user, email_jobs, monkeypatch):
+    monkeypatch.setattr(server, "GMAIL_SEND_URL", "http://127.0.0.1:1/gmail/v1/users/me/messages/send")
+    job_id = enqueue_email(email_jobs, google_user)
+
+    email_jobs.run_pending()
+
+    job = email_jobs.get(job_id)
+    assert (job["status"], job["attempts"]) == (QUEUED, 1)
+    assert "Upstream request failed" in job["error"]
@@ -0,0 +1,113 @@
+"""Tests for the JSON-RPC dispatcher (json_rpc.py) and the /mcp endpoint."""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from json_rpc import (
+    INTERNAL_ERROR, INVALID_PARAMS, INVALID_REQUEST, METHOD_NOT_FOUND, PARSE_ERROR, JsonRpcDispatcher, RpcError,
+)
+
+
+@pytest.fixture
+def dispatcher():
+    def sleep(params):
+        time.sleep(params["seconds"])
+        return params["seconds"]
+
+    def reject(params):
+        raise RpcError(INVALID_PARAMS, "Bad value", {"field": "x"})
+
+    def crash(params):
+        raise RuntimeError("boom")
+
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield JsonRpcDispatcher({"sleep": sleep, "reject": reject, "crash": crash}, executor, max_batch=5)
+    executor.shutdown()
+
+
+def call(method, request_id, **params):
+    return {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}
+
+
+def test_batch_runs_concurrently_and_answers_in_request_order(dispatcher):
+    batch = [call("sleep", n, seconds=seconds) for n, seconds in enumerate([0.2, 0.1, 0.0, 0.15])]
+
+    started = time.monotonic()
+    responses = dispatcher.handle(batch)
+
+    assert time.monotonic() - started < 0.4
+    assert [(response["id"], response["result"]) for response in responses] == [(0, 0.2), (1, 0.1), (2, 0.0), (3, 0.15)]
+
+
+def test_notifications_get_no_response(dispatcher):
+    notification = {"jsonrpc": "2.0", "method": "sleep", "params": {"seconds": 0}}
+
+    assert dispatcher.handle([notification, call("sleep", 1, seconds=0)]) == [{"jsonrpc": "2.0", "id": 1, "result": 0}]
+    assert dispatcher.handle([notification]) is None
+    assert dispatcher.handle(notification) is None
+
+
+@pytest.mark.parametrize("request_body, code", [
+    (call("nope", 1), METHOD_NOT_FOUND),
+    (call("reject", 1), INVALID_PARAMS),
+    (call("crash", 1), INTERNAL_ERROR),
+    ({"jsonrpc": "2.0", "id": 1, "method": "sleep", "params": 5}, INVALID_PARAMS),
+    ({"jsonrpc": "1.0", "id": 1, "method": "sleep"}, INVALID_REQUEST),
+    ([], INVALID_REQUEST),
+    ([call("sleep", n, seconds=0) for n in range(6)], INVALID_REQUEST),
+])
+def test_errors_are_json_rpc_error_objects(dispatcher, request_body, code):
+    response = dispatcher.handle(request_body)
+
+    assert response["error"]["code"] == code
+
+
+def test_error_in_one_call_leaves_the_rest_of_the_batch(dispatcher):
+    responses = dispatcher.handle([call("crash", 1), call("sleep", 2, seconds=0), call("reject", 3)])
+
+    assert [response.get("error", {}).get("code") for response in responses] == [INTERNAL_ERROR, None, INVALID_PARAMS]
+    assert responses[0]["error"]["data"] == "RuntimeError: boom"
+    assert responses[2]["error"]["data"] == {"field": "x"}
+
+
+def test_mcp_batch_of_tool_calls(client, fake_google, google_user):
+    def send(request_id, subject):
+        return call("tools/call", request_id, name="send_email", arguments={
+            "user_id": google_user, "to": "someone@example.com", "subject": subject, "body": "Hi",
+        })
+
+    response = client.post("/mcp", json=[
+        call("tools/list", "list"),
+        send("a", "First"),
+        send("b", "Second"),
+        call("tools/call", "c", name="nope", arguments={}),
+        {"jsonrpc": "2.0", "method": "notifications/initialized"},
+    ])
+
+    assert response.status_code == 200
+    listed, first, second, unknown = response.get_json()
+    assert "send_email" in {tool["name"] for tool in listed["result"]["tools"]}
+    assert [(result["id"], result["result"]["isError"], result["result"]["status"]) for result in (first, second)] == [
+        ("a", False, 200), ("b", False, 200),
+    ]
+    assert unknown["error"]["code"] == INVALID_PARAMS
+    assert fake_google.request_counts()["gmail.send"] == 2
+
+
+def test_mcp_tool_failure_is_a_result_not_a_protocol_error(client):
+    response = client.post("/mcp", json=call("tools/call", 1, name="send_email", arguments={
+        "user_id": "nobody", "to": "someone@example.com",
+    }))
+
+    result = response.get_json()["result"]
+    assert (result["isError"], result["status"]) == (True, 401)
+
+
+def test_mcp_parse_error_and_notification_only(client):
+    malformed = client.post("/mcp", data="{not json", content_type="application/json")
+    notified = client.post("/mcp", json={"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+    assert (malformed.status_code, malformed.get_json()["error"]["code"]) == (400, PARSE_ERROR)
+    assert notified.status_code == 202
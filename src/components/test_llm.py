@@ -0,0 +1,105 @@
+"""Tests for the /tools/llm SSE proxy and its response cache, against fake_openrouter.py."""
+
+import json
+import uuid
+
+import pytest
+
+
+def parse_sse(body):
+    events = []
+    for block in body.decode().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+        if "event" in lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.fixture
+def prompt():
+    # Unique per test, so cached answers from other tests don't leak in
+    return f"hello world {uuid.uuid4().hex[:8]}"
+
+
+def test_stream_relays_tokens_then_done(client, fake_openrouter, prompt):
+    response = client.post("/tools/llm", json={"prompt": prompt})
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = parse_sse(response.data)
+    tokens = [data["content"] for event, data in events if event == "token"]
+    assert len(tokens) == 4
+    assert "".join(tokens) == f"Echo: {prompt}"
+    event, done = events[-1]
+    assert event == "done"
+    assert (done["content"], done["cached"]) == (f"Echo: {prompt}", False)
+    assert done["usage"]["completion_tokens"] == 4
+
+
+def test_repeated_request_is_answered_from_the_cache(client, fake_openrouter, prompt):
+    first = parse_sse(client.post("/tools/llm", json={"prompt": prompt}).data)
+    streamed = parse_sse(client.post("/tools/llm", json={"prompt": prompt}).data)
+    as_json = client.post("/tools/llm", json={"prompt": prompt, "stream": False}).get_json()
+
+    assert streamed[-1][1]["cached"] is True
+    assert streamed[-1][1]["content"] == first[-1][1]["content"]
+    assert (as_json["content"], as_json["cached"]) == (first[-1][1]["content"], True)
+    assert fake_openrouter.request_counts()["chat.completions"] == 1
+
+
+def test_cache_false_always_calls_upstream(client, fake_openrouter, prompt):
+    for _ in range(2):
+        body = client.post("/tools/llm", json={"prompt": prompt, "cache": False, "stream": False}).get_json()
+        assert body["cached"] is False
+    assert fake_openrouter.request_counts()["chat.completions"] == 2
+
+
+@pytest.mark.parametrize("upstream_status, status", [(429, 429), (500, 502)])
+def test_upstream_errors_keep_a_real_status_and_are_not_cached(client, fake_openrouter, prompt, upstream_status, status):
+    fake_openrouter.app.config.update(FAIL_NEXT=1, FAIL_STATUS=upstream_status)
+
+    failed = client.post("/tools/llm", json={"prompt": prompt})
+    retried = client.post("/tools/llm", json={"prompt": prompt, "stream": False})
+
+    assert failed.status_code == status
+    assert failed.get_json()["error"] == "LLM request failed"
+    assert (retried.status_code, retried.get_json()["cached"]) == (200, False)
+    assert fake_openrouter.request_counts()["chat.completions"] == 2
+
+
+def test_abandoned_stream_is_not_cached(client, fake_openrouter, prompt):
+    fake_openrouter.app.config["TOKEN_DELAY"] = 0.05
+    response = client.post("/tools/llm", json={"prompt": prompt}, buffered=False)
+    assert next(iter(response.response)).startswith(b"event: token")
+    # The client goes away after the first token
+    response.close()
+
+    body = client.post("/tools/llm", json={"prompt": prompt, "stream": False}).get_json()
+
+    assert body["cached"] is False
+    assert fake_openrouter.request_counts()["chat.completions"] == 2
+
+
+def test_stream_cut_off_before_it_finished_is_not_cached(client, fake_openrouter, prompt):
+    fake_openrouter.app.config["TRUNCATE_NEXT"] = 1
+
+    cut_off = parse_sse(client.post("/tools/llm", json={"prompt": prompt}).data)
+    body = client.post("/tools/llm", json={"prompt": prompt, "stream": False}).get_json()
+
+    assert cut_off[-1][1]["content"] == "Echo:"
+    assert (body["content"], body["cached"]) == (f"Echo: {prompt}", False)
+    assert fake_openrouter.request_counts()["chat.completions"] == 2
+
+
+def test_malformed_chunk_ends_the_stream_with_an_error_event(client, fake_openrouter, prompt):
+    fake_openrouter.app.config["MALFORMED_NEXT"] = 1
+
+    response = client.post("/tools/llm", json={"prompt": prompt})
+    events = parse_sse(response.data)
+
+    assert response.status_code == 200
+    assert [event for event, _ in events] == ["token", "error"]
+    assert events[-1][1]["error"] == "LLM request failed"
+    assert "Malformed stream chunk" in events[-1][1]["details"]
+    body = client.post("/tools/llm", json={"prompt": prompt, "stream": False}).get_json()
+    assert body["cached"] is False
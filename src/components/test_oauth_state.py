@@ -0,0 +1,109 @@
+"""Tests for the DB-backed OAuth state store (oauth_state.py) and the /authorize -> callback flow against fake_google.py."""
+
+import sqlite3
+import urllib.parse
+
+import pytest
+import requests
+
+from oauth_state import OAuthStateStore, code_challenge, new_code_verifier
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / "states.db")
+    store = OAuthStateStore(lambda: sqlite3.connect(path), lambda conn: False, ttl=60, purge_every=2)
+    assert store.init_schema()
+    store.path = path
+    return store
+
+
+def test_state_is_consumed_once_and_only_for_its_provider(store):
+    state = store.create("google", "alice", "verifier")
+
+    assert store.consume("github", state) is None
+    assert store.consume("google", state) == {"user_id": "alice", "code_verifier": "verifier"}
+    assert store.consume("google", state) is None
+    assert store.consume("google", None) is None
+
+
+def test_expired_state_is_rejected_and_purged(store):
+    store.ttl = -1
+    expired = store.create("google", "alice", "verifier")
+    store.ttl = 60
+    live = store.create("google", "bob", "verifier")
+
+    assert store.consume("google", expired) is None
+    with sqlite3.connect(store.path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM oauth_states").fetchone()[0] == 1
+    assert store.consume("google", live)["user_id"] == "bob"
+
+
+def test_code_challenge_is_s256_of_the_verifier():
+    verifier = new_code_verifier()
+
+    assert 43 <= len(verifier) <= 128
+    # RFC 7636 appendix B
+    assert code_challenge("dBjftJeZ4CVP-mB92K27uhbUJU1p1r_wW1gFWFOEjXk") == "E9Melhoa2OwvFrEMTJguCHaoeK1t8URWbuGJSstw-cM"
+
+
+@pytest.fixture
+def oauth(server, fake_google, monkeypatch):
+    # The fake speaks plain HTTP
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    monkeypatch.setattr(server, "AUTH_URL", f"{fake_google.url}/o/oauth2/auth")
+    monkeypatch.setattr(server, "REDIRECT_URI", "http://localhost/auth/google/callback")
+    return fake_google
+
+
+# /authorize, then the consent screen; returns the callback query Google redirects back with
+def authorize(client, user_id):
+    started = client.get("/authorize/google", query_string={"user_id": user_id})
+    assert started.status_code == 302
+    consent = requests.get(started.headers["Location"], allow_redirects=False, timeout=5)
+    assert consent.status_code == 302
+    return urllib.parse.urlsplit(consent.headers["Location"]).query
+
+
+def test_authorization_code_is_exchanged_with_the_pkce_verifier(client, server, oauth):
+    query = authorize(client, "oauth-user")
+
+    response = client.get(f"/auth/google/callback?{query}")
+
+    assert response.status_code == 200
+    assert response.get_json()["success"] is True
+    assert server.get_token("oauth-user", "google")["access_token"].startswith("ya29.fake-")
+    assert oauth.request_counts()["token:authorization_code"] == 1
+
+
+def test_replayed_or_forged_callback_is_rejected(client, oauth):
+    query = authorize(client, "oauth-user")
+    assert client.get(f"/auth/google/callback?{query}").status_code == 200
+
+    replayed = client.get(f"/auth/google/callback?{query}")
+    forged = client.get("/auth/google/callback", query_string={"code": "fake-code-x", "state": "made-up"})
+
+    for response in (replayed, forged):
+        assert response.status_code == 400
+        assert response.get_json()["message"] == "Invalid or expired OAuth state"
+    assert oauth.request_counts()["token:authorization_code"] == 1
+
+
+def test_callback_after_the_state_ttl_is_rejected(client, server, oauth, monkeypatch):
+    monkeypatch.setattr(server.oauth_states, "ttl", -1)
+    query = authorize(client, "oauth-user")
+
+    response = client.get(f"/auth/google/callback?{query}")
+
+    assert response.status_code == 400
+    assert "token:authorization_code" not in oauth.request_counts()
+
+
+def test_code_issued_for_another_verifier_fails_the_exchange(client, server, oauth):
+    state = server.oauth_states.create("google", "oauth-user", new_code_verifier())
+    code = f"fake-code-stolen.{code_challenge(new_code_verifier())}"
+
+    response = client.get("/auth/google/callback", query_string={"code": code, "state": state})
+
+    assert response.status_code == 400
+    assert response.get_json()["message"].startswith("Token exchange failed")
@@ -0,0 +1,90 @@
+"""Tests for rate_limiter.AdaptiveRateLimiter and how tool calls use it."""
+
+import email.utils
+import time
+
+import pytest
+
+from rate_limiter import AdaptiveRateLimiter, RateLimited, parse_retry_after
+
+
+def test_burst_is_admitted_then_further_calls_are_rejected_locally():
+    limiter = AdaptiveRateLimiter({"gmail": (2.0, 3)}, max_wait=0)
+    for _ in range(3):
+        limiter.acquire("alice", "gmail")
+
+    with pytest.raises(RateLimited) as rejected:
+        limiter.acquire("alice", "gmail")
+
+    assert rejected.value.retry_after == pytest.approx(0.5, abs=0.05)
+    # Other users, and APIs without a limit, have their own budget
+    limiter.acquire("bob", "gmail")
+    limiter.acquire("alice", "drive")
+    stats = limiter.stats()
+    assert (stats["allowed"], stats["local_rejections"]) == (4, 1)
+
+
+def test_call_waits_for_a_token_within_max_wait():
+    limiter = AdaptiveRateLimiter({"calendar": (20.0, 1)}, max_wait=1)
+    limiter.acquire("alice", "calendar")
+
+    started = time.monotonic()
+    limiter.acquire("alice", "calendar")
+
+    assert 0.03 <= time.monotonic() - started < 0.5
+
+
+def test_429_halves_the_rate_and_successes_restore_it():
+    limiter = AdaptiveRateLimiter({"gmail": (10.0, 10)}, max_wait=0, increase_fraction=0.25)
+
+    limiter.record("alice", "gmail", 429, retry_after=0.2)
+
+    throttled, = limiter.stats()["throttled"]
+    assert (throttled["rate"], throttled["upstream_throttles"]) == (5.0, 1)
+    assert 0.1 < throttled["blocked_for"] <= 0.2
+    with pytest.raises(RateLimited):
+        limiter.acquire("alice", "gmail")
+
+    for _ in range(2):
+        limiter.record("alice", "gmail", 200)
+    assert limiter.stats()["throttled"][0]["rate"] == 10.0
+
+
+def test_rate_never_drops_below_its_floor():
+    limiter = AdaptiveRateLimiter({"gmail": (10.0, 10)}, min_rate_fraction=0.1)
+    for _ in range(10):
+        limiter.record("alice", "gmail", 429, retry_after=0)
+
+    assert limiter.stats()["throttled"][0]["rate"] == 1.0
+
+
+def test_tracked_keys_are_bounded():
+    limiter = AdaptiveRateLimiter({"gmail": (10.0, 10)}, max_keys=5)
+    for n in range(20):
+        limiter.acquire(f"user-{n}", "gmail")
+
+    assert limiter.stats()["tracked_keys"] == 5
+
+
+def test_retry_after_accepts_seconds_and_http_dates():
+    in_a_minute = email.utils.formatdate(time.time() + 60, usegmt=True)
+
+    assert parse_retry_after("3") == 3.0
+    assert 55 < parse_retry_after(in_a_minute) <= 60
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_google_429_slows_the_user_down_before_the_next_call(client, server, fake_google, google_user, monkeypatch):
+    monkeypatch.setattr(server, "rate_limiter", AdaptiveRateLimiter({"gmail": (10.0, 10)}, max_wait=0))
+    fake_google.app.config.update(THROTTLE_NEXT=1, RETRY_AFTER=30)
+    send = {"user_id": google_user, "to": "someone@example.com", "subject": "Hi", "body": "Hi"}
+
+    throttled = client.post("/tools/send-email", json=send)
+    held_back = client.post("/tools/send-email", json=send)
+
+    assert throttled.status_code == 429
+    assert held_back.status_code == 429
+    assert held_back.get_json()["throttled_by"] == "local"
+    assert int(held_back.headers["Retry-After"]) >= 29
+    assert fake_google.request_counts() == {"throttled": 1}
@@ -0,0 +1,32 @@
+"""Tests for the serve.py master's bookkeeping of its workers."""
+
+import os
+import time
+
+import metrics
+from serve import Master
+
+
+def test_reaped_worker_takes_its_metrics_snapshot_along(tmp_path, monkeypatch):
+    monkeypatch.setenv("METRICS_MULTIPROC_DIR", str(tmp_path))
+    live = metrics.snapshot_path(str(tmp_path), os.getpid())
+    with open(live, "w") as f:
+        f.write("[]")
+    pid = os.fork()
+    if pid == 0:
+        # A worker that wrote a snapshot, then crashed
+        with open(metrics.snapshot_path(str(tmp_path), os.getpid()), "w") as f:
+            f.write("[]")
+        os._exit(1)
+    master = Master(None, None)
+    master.workers[pid] = time.monotonic()
+    # Stopping, so no replacement is forked
+    master._stop = True
+
+    deadline = time.monotonic() + 5
+    while pid in master.workers and time.monotonic() < deadline:
+        master.reap()
+        time.sleep(0.01)
+
+    assert pid not in master.workers
+    assert os.listdir(tmp_path) == [os.path.basename(live)]
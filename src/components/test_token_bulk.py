@@ -0,0 +1,82 @@
+"""Tests for the single-statement token upsert and save_tokens_bulk."""
+
+import uuid
+
+import pytest
+
+from sqlite_store import SQLiteShards
+
+
+def new_users(count):
+    prefix = uuid.uuid4().hex[:8]
+    return [f"bulk-{prefix}-{n}" for n in range(count)]
+
+
+def token(access_token):
+    return {"access_token": access_token, "refresh_token": "1//refresh", "expires_in": 3600}
+
+
+def stored_rows(server, user_id):
+    conn = server.get_token_connection(user_id)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT access_token, created_at FROM tokens WHERE user_id = ? AND provider = 'google'", (user_id,))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def test_saving_again_updates_the_one_row_and_keeps_created_at(server):
+    user_id, = new_users(1)
+    assert server.save_token(user_id, "google", token("ya29.first"))
+    conn = server.get_db_connection()
+    conn.cursor().execute("UPDATE tokens SET created_at = '2020-01-01 00:00:00' WHERE user_id = ?", (user_id,))
+    conn.commit()
+    conn.close()
+
+    assert server.save_token(user_id, "google", token("ya29.second"))
+
+    assert [tuple(row) for row in stored_rows(server, user_id)] == [("ya29.second", "2020-01-01 00:00:00")]
+
+
+def test_bulk_save_pages_and_keeps_the_last_copy_of_a_key(server, monkeypatch):
+    monkeypatch.setattr(server, "TOKEN_BULK_PAGE_SIZE", 3)
+    users = new_users(8)
+    tokens = [(user_id, "google", token(f"ya29.{n}")) for n, user_id in enumerate(users)]
+    tokens.append((users[0], "google", token("ya29.latest")))
+
+    assert server.save_tokens_bulk(tokens) == 9
+
+    # Written through the cache, and to the database
+    assert server.get_token(users[0], "google")["access_token"] == "ya29.latest"
+    server.token_cache.clear()
+    assert [server.get_token(user_id, "google")["access_token"] for user_id in users] == (
+        ["ya29.latest"] + [f"ya29.{n}" for n in range(1, 8)]
+    )
+    assert all(len(stored_rows(server, user_id)) == 1 for user_id in users)
+
+
+@pytest.fixture
+def sharded(server, monkeypatch, tmp_path):
+    shards = SQLiteShards(
+        [str(tmp_path / f"tokens.shard-{index}-of-2.db") for index in range(2)],
+        server.connect_sqlite,
+        setup=lambda index, conn: conn.execute(server.SQLITE_TOKENS_TABLE),
+    )
+    monkeypatch.setattr(server, "sqlite_tokens", shards)
+    yield shards
+    shards.close()
+
+
+def test_bulk_save_spreads_tokens_over_the_shards(server, sharded):
+    users = new_users(20)
+
+    assert server.save_tokens_bulk((user_id, "google", token(f"ya29.{user_id}")) for user_id in users) == 20
+
+    server.token_cache.clear()
+    assert all(server.get_token(user_id, "google")["access_token"] == f"ya29.{user_id}" for user_id in users)
+    counts = []
+    for conn in sharded.readers():
+        counts.append(conn.execute("SELECT COUNT(*) FROM tokens").fetchone()[0])
+        conn.close()
+    assert sum(counts) == 20 and all(counts)
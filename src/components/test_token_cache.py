@@ -0,0 +1,70 @@
+"""Tests for the process-local token cache and its cross-process invalidation channel (token_cache.py)."""
+
+import pytest
+
+from token_cache import SQLiteInvalidationChannel, TokenCache
+
+
+@pytest.fixture
+def workers(tmp_path):
+    # Two worker processes' caches sharing one invalidation file
+    path = str(tmp_path / "invalidations.db")
+    caches = [TokenCache(max_size=10), TokenCache(max_size=10)]
+    return [(cache, SQLiteInvalidationChannel(path, cache)) for cache in caches]
+
+
+def test_saving_a_token_invalidates_it_in_other_processes(workers):
+    (saver, saver_channel), (other, other_channel) = workers
+    for cache, _ in workers:
+        cache.put("user", "google", {"access_token": "old"})
+
+    # What save_token does
+    saver.invalidate("user", "google")
+    saver.put("user", "google", {"access_token": "new"})
+    saver_channel.publish("user", "google")
+
+    assert other_channel.poll() == 1
+    assert other.get("user", "google") is None
+    # The saver skips its own entry and keeps the new token
+    assert saver_channel.poll() == 0
+    assert saver.get("user", "google") == {"access_token": "new"}
+    assert other.stats()["remote_invalidations"] == 1
+
+
+def test_read_that_raced_with_an_invalidation_is_not_cached():
+    cache = TokenCache()
+    version = cache.version("user", "google")
+    cache.invalidate("user", "google")
+
+    cache.put("user", "google", {"access_token": "stale"}, version=version)
+
+    assert cache.get("user", "google") is None
+
+
+def test_versions_stay_bounded_and_still_turn_stale_reads_away():
+    cache = TokenCache(max_size=10)
+    for n in range(1000):
+        user_id = f"user-{n}"
+        cache.put(user_id, "google", {"access_token": "a"}, version=cache.version(user_id, "google"))
+        cache.invalidate(f"other-{n}", "google")
+    assert cache.stats()["tracked_versions"] <= 10
+    assert cache.stats()["size"] == 10
+
+    cache.invalidate("user", "google")
+    version = cache.version("user", "google")
+    # Its version is dropped to make room, then it is invalidated again
+    for n in range(20):
+        cache.invalidate(f"more-{n}", "google")
+    cache.invalidate("user", "google")
+    cache.put("user", "google", {"access_token": "stale"}, version=version)
+
+    assert cache.get("user", "google") is None
+
+
+def test_publishing_without_polling_stays_bounded(tmp_path):
+    channel = SQLiteInvalidationChannel(str(tmp_path / "invalidations.db"), TokenCache(), max_own=5)
+
+    channel.publish_many((f"user-{n}", "google") for n in range(50))
+
+    assert channel.stats()["unpolled_own"] == 5
+    assert channel.stats()["published"] == 50
@@ -0,0 +1,71 @@
+"""Tests for the typed token columns, their backfill and the indexed expiry lookup."""
+
+import datetime
+import json
+import uuid
+
+
+def new_user():
+    return f"columns-{uuid.uuid4().hex[:8]}"
+
+
+def typed_columns(server, user_id):
+    conn = server.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT access_token, refresh_token, scope, expires_at, updated_at FROM tokens WHERE user_id = ?", (user_id,)
+        )
+        return tuple(cursor.fetchone())
+    finally:
+        conn.close()
+
+
+def test_save_token_fills_the_typed_columns(server):
+    user_id = new_user()
+    server.save_token(user_id, "google", {
+        "access_token": "ya29.a", "refresh_token": "1//r", "expires_in": 3600,
+        "scope": ["https://mail.google.com/", "openid"],
+    })
+
+    access_token, refresh_token, scope, expires_at, updated_at = typed_columns(server, user_id)
+
+    assert (access_token, refresh_token, scope) == ("ya29.a", "1//r", "https://mail.google.com/ openid")
+    saved_at = datetime.datetime.strptime(updated_at, "%Y-%m-%d %H:%M:%S").timestamp()
+    assert expires_at == saved_at + 3600
+
+
+def test_rows_from_before_the_columns_are_read_and_backfilled(server):
+    user_id = new_user()
+    saved_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = server.get_db_connection()
+    # As written by a version without the typed columns
+    conn.cursor().execute(
+        "INSERT INTO tokens (user_id, provider, token_data, created_at, updated_at) VALUES (?, 'google', ?, ?, ?)",
+        (user_id, json.dumps({"access_token": "ya29.legacy", "refresh_token": "1//r", "expires_in": 60}), saved_at, saved_at)
+    )
+    conn.commit()
+    conn.close()
+
+    # Falls back to the JSON blob until the backfill reaches the row
+    assert server.get_access_token(user_id, "google") == "ya29.legacy"
+    assert server.backfill_token_columns(batch_size=2, pause=0) >= 1
+
+    assert typed_columns(server, user_id)[:2] == ("ya29.legacy", "1//r")
+    assert user_id in {listed for listed, _, _ in server.list_expiring_tokens(600)}
+    assert server.backfill_token_columns(pause=0) == 0
+
+
+def test_expiry_sweep_uses_the_expires_at_index(server):
+    conn = server.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "EXPLAIN QUERY PLAN SELECT user_id, provider, token_data, expires_at FROM tokens "
+            "WHERE expires_at <= ? AND refresh_token IS NOT NULL ORDER BY expires_at", (0,)
+        )
+        plan = " ".join(str(row[-1]) for row in cursor.fetchall())
+    finally:
+        conn.close()
+
+    assert "idx_tokens_expires_at" in plan
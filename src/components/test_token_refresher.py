@@ -0,0 +1,60 @@
+"""Tests for proactive token refresh (token_refresher.py) against fake_google.py's token endpoint."""
+
+import uuid
+
+import pytest
+
+from token_refresher import TokenRefresher
+
+
+@pytest.fixture
+def refresher(server):
+    refresher = TokenRefresher(
+        server.list_expiring_tokens, server.refresh_google_token, lead_time=600, jitter=0, failure_backoff=300,
+    )
+    yield refresher
+    refresher.stop()
+
+
+def store(server, expires_in, refresh_token="1//refresh"):
+    user_id = f"refresh-{uuid.uuid4().hex[:8]}"
+    token = {"access_token": "ya29.old", "expires_in": expires_in, "token_type": "Bearer"}
+    if refresh_token:
+        token["refresh_token"] = refresh_token
+    assert server.save_token(user_id, "google", token)
+    return user_id
+
+
+def test_only_tokens_expiring_within_the_lead_time_are_refreshed(server, fake_google, refresher):
+    expiring = store(server, expires_in=60)
+    fresh = store(server, expires_in=3600)
+    no_refresh_token = store(server, expires_in=60, refresh_token=None)
+
+    listed = {user_id for user_id, _, _ in server.list_expiring_tokens(600)}
+    assert expiring in listed
+    assert not listed & {fresh, no_refresh_token}
+
+    refresher.refresh_now()
+
+    refreshed = server.get_token(expiring, "google")
+    assert refreshed["access_token"].startswith("ya29.fake-")
+    # Google omits refresh_token on refresh; the stored one is kept
+    assert refreshed["refresh_token"] == "1//refresh"
+    assert server.get_token(fresh, "google")["access_token"] == "ya29.old"
+    assert expiring not in {user_id for user_id, _, _ in server.list_expiring_tokens(600)}
+    assert fake_google.request_counts()["token:refresh_token"] >= 1
+
+
+def test_failed_refresh_backs_off(server, fake_google, refresher):
+    # The fake rejects refresh tokens that don't look like Google's
+    rejected = store(server, expires_in=60, refresh_token="revoked")
+
+    refresher.refresh_now()
+    calls = fake_google.request_counts()["token:refresh_token"]
+    refresher.refresh_now()
+
+    assert server.get_token(rejected, "google")["access_token"] == "ya29.old"
+    stats = refresher.stats()
+    assert stats["failures"] == 1
+    assert stats["skipped_backoff"] >= 1
+    assert fake_google.request_counts()["token:refresh_token"] == calls
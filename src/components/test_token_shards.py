@@ -0,0 +1,81 @@
+"""Tests for moving tokens between SQLITE_TOKEN_SHARDS layouts (sqlite_store.SQLiteShards)."""
+
+import json
+
+import pytest
+
+from sqlite_store import SQLiteShards
+
+USERS = [f"shard-user-{n}" for n in range(20)]
+
+
+@pytest.fixture
+def start(server, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "DB_PATH", str(tmp_path / "tokens.db"))
+    opened = []
+
+    # The token store as a server started with `count` shards would open it
+    def start(count):
+        for shards in opened:
+            shards.close()
+        monkeypatch.setattr(server, "SQLITE_TOKEN_SHARDS", count)
+        shards = SQLiteShards(server.token_shard_paths(count), server.connect_sqlite, setup=server.setup_token_shard)
+        opened.append(shards)
+        return shards
+
+    yield start
+    for shards in opened:
+        shards.close()
+
+
+def save_all(server, shards, version, second):
+    saved_at = f"2026-01-01 00:00:{second:02d}"
+    for user_id in USERS:
+        token = {"access_token": f"ya29.{version}", "expires_in": 3600}
+        params = (user_id, "google", json.dumps(token)) + server.token_columns(token, saved_at) + (saved_at, saved_at)
+        shards.write(user_id, lambda db, params=params: db.execute(server.UPSERT_TOKEN_SQL_SQLITE, params))
+
+
+def access_tokens(shards):
+    found = {}
+    for user_id in USERS:
+        conn = shards.reader(user_id)
+        row = conn.execute("SELECT access_token FROM tokens WHERE user_id = ?", (user_id,)).fetchone()
+        conn.close()
+        found[user_id] = row[0] if row else None
+    return set(found.values())
+
+
+def test_going_back_to_one_file_serves_tokens_saved_while_sharded(server, start):
+    save_all(server, start(1), "v1", 1)
+    save_all(server, start(4), "v2", 2)
+
+    assert access_tokens(start(1)) == {"ya29.v2"}
+
+
+def test_going_back_to_an_earlier_shard_count_serves_the_latest_tokens(server, start):
+    save_all(server, start(4), "v1", 1)
+    save_all(server, start(2), "v2", 2)
+    assert access_tokens(start(4)) == {"ya29.v2"}
+
+    save_all(server, start(4), "v3", 3)
+    assert access_tokens(start(2)) == {"ya29.v3"}
+    assert access_tokens(start(1)) == {"ya29.v3"}
+
+
+def test_each_file_records_its_layout_and_old_files_are_retired(server, start):
+    save_all(server, start(1), "v1", 1)
+    save_all(server, start(2), "v2", 2)
+    start(2)
+
+    layouts = []
+    for path in server.token_shard_paths(2):
+        conn = server.connect_sqlite(path)
+        layouts.append(tuple(conn.execute("SELECT shards, current FROM token_layout").fetchone()))
+        conn.close()
+    main = server.connect_sqlite(server.DB_PATH)
+    retired = tuple(main.execute("SELECT shards, current FROM token_layout").fetchone())
+    main.close()
+
+    assert layouts == [(2, 1), (2, 1)]
+    assert retired == (1, 0)
@@ -0,0 +1,73 @@
+"""Tests for upstream.UpstreamClient retries and timeouts against fake_google.py."""
+
+import time
+
+import pytest
+import requests
+
+from upstream import UpstreamClient
+
+
+def events_url(fake_google):
+    return f"{fake_google.url}/calendar/v3/calendars/primary/events"
+
+
+def auth():
+    return {"Authorization": "Bearer ya29.test"}
+
+
+def test_idempotent_call_is_retried_on_5xx(fake_google):
+    client = UpstreamClient(retries=2, backoff_factor=0)
+    fake_google.app.config["FAIL_NEXT"] = 2
+
+    response = client.get(events_url(fake_google), endpoint="calendar.list", headers=auth())
+
+    assert response.status_code == 200
+    assert fake_google.request_counts()["failed"] == 2
+    stats = client.stats()["calendar.list"]
+    assert (stats["count"], stats["status_codes"]) == (1, {"200": 1})
+
+
+def test_retries_give_up_with_the_last_response(fake_google):
+    client = UpstreamClient(retries=1, backoff_factor=0)
+    fake_google.app.config["FAIL_NEXT"] = 5
+
+    response = client.get(events_url(fake_google), endpoint="calendar.list", headers=auth())
+
+    assert response.status_code == 503
+    assert fake_google.request_counts()["failed"] == 2
+
+
+def test_non_idempotent_call_is_not_retried(fake_google):
+    client = UpstreamClient(retries=2, backoff_factor=0)
+    fake_google.app.config["FAIL_NEXT"] = 1
+
+    response = client.post(events_url(fake_google), endpoint="calendar.insert", headers=auth(), json={"summary": "x"})
+
+    assert response.status_code == 503
+    assert fake_google.request_counts() == {"failed": 1}
+
+
+def test_read_timeout_raises_and_is_recorded(fake_google):
+    client = UpstreamClient(read_timeout=0.2, retries=1, backoff_factor=0)
+    fake_google.app.config["LATENCY"] = 0.5
+
+    started = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        client.get(events_url(fake_google), endpoint="calendar.list", headers=auth())
+
+    # One retry, each attempt cut off at the read timeout
+    assert time.monotonic() - started < 1.0
+    assert client.stats()["calendar.list"]["errors"] == 1
+
+
+def test_tool_answers_504_when_google_times_out(client, server, fake_google, google_user, monkeypatch):
+    monkeypatch.setattr(server.upstream, "timeout", (3.05, 0.2))
+    fake_google.app.config["LATENCY"] = 0.5
+
+    response = client.post("/tools/send-email", json={
+        "user_id": google_user, "to": "someone@example.com", "subject": "Slow", "body": "Hi",
+    })
+
+    assert response.status_code == 504
+    assert response.get_json()["error"] == "Upstream request failed"
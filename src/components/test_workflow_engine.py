@@ -0,0 +1,143 @@
+"""Tests for workflow graph validation and execution (workflow_engine.py) and /workflows/run."""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import structured_logging
+from tool_registry import Tool, ToolRegistry
+from workflow_engine import WorkflowError, run_workflow, validate_workflow
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def registry(calls):
+    lock = threading.Lock()
+
+    def record(name, params):
+        with lock:
+            calls.append((name, params))
+
+    def step(params):
+        record("step", params)
+        time.sleep(params.get("sleep", 0))
+        return {"value": params.get("value"), "request_id": structured_logging.request_id.get()}, 200
+
+    def fail(params):
+        record("fail", params)
+        return {"error": "Backend Error"}, 503
+
+    registry = ToolRegistry()
+    registry.register("step", step)
+    registry.register("fail", fail)
+    return registry
+
+
+def node(node_id, tool="step", **params):
+    return {"id": node_id, "tool": tool, "params": params}
+
+
+def events_of(graph, registry, executor, **options):
+    events = []
+    summary = run_workflow(graph, registry, executor, emit=lambda event, data: events.append((event, data)), **options)
+    return summary, events
+
+
+def test_nodes_run_after_their_dependencies_with_their_outputs(registry, executor):
+    # a -> (b, c) -> d, with b slower than c
+    graph = {
+        "nodes": [
+            node("a", value="from-a"),
+            node("b", value="{{a.value}}-b", sleep=0.1),
+            node("c", value="c", sleep=0.01),
+            node("d"),
+        ],
+        "edges": [
+            {"source": "a", "target": "b"},
+            {"source": "a", "target": "c"},
+            {"source": "b", "target": "d", "map": {"value": "value"}},
+            {"source": "c", "target": "d"},
+        ],
+    }
+
+    summary, events = events_of(graph, registry, executor)
+
+    assert summary["success"] is True
+    order = [data["node_id"] for event, data in events if event == "node_completed"]
+    assert order[0] == "a" and order[-1] == "d"
+    assert order.index("c") < order.index("b")
+    assert summary["results"]["b"]["output"]["value"] == "from-a-b"
+    # d's value comes from b's output through the edge map
+    assert summary["results"]["d"]["output"]["value"] == "from-a-b"
+    assert [event for event, _ in events][0] == "workflow_started"
+    assert [event for event, _ in events][-1] == "workflow_completed"
+
+
+def test_failure_skips_everything_downstream_only(registry, executor, calls):
+    graph = {
+        "nodes": [node("a", tool="fail"), node("b"), node("c"), node("independent")],
+        "edges": [{"source": "a", "target": "b"}, {"source": "b", "target": "c"}],
+    }
+
+    summary, events = events_of(graph, registry, executor)
+
+    assert summary["success"] is False
+    assert summary["failed_nodes"] == ["a", "b", "c"]
+    statuses = {node_id: result["status"] for node_id, result in summary["results"].items()}
+    assert statuses == {"a": "failed", "b": "skipped", "c": "skipped", "independent": "completed"}
+    assert summary["results"]["a"]["status_code"] == 503
+    assert "Upstream node 'b'" in summary["results"]["c"]["reason"]
+    assert sorted(name for name, _ in calls) == ["fail", "step"]
+
+
+@pytest.mark.parametrize("graph, message", [
+    ({"nodes": [node("a"), node("b")], "edges": [{"source": "a", "target": "b"}, {"source": "b", "target": "a"}]}, "cycle"),
+    ({"nodes": [node("a", tool="nope")]}, "unknown tool"),
+    ({"nodes": [node("a"), node("a")]}, "Duplicate node id"),
+    ({"nodes": [node("a")], "edges": [{"source": "a", "target": "x"}]}, "unknown node"),
+    ({"nodes": []}, "non-empty"),
+])
+def test_invalid_graphs_are_rejected(registry, graph, message):
+    with pytest.raises(WorkflowError, match=message):
+        validate_workflow(graph, registry)
+
+
+def test_nodes_run_with_the_callers_correlation_id(registry, executor):
+    token = structured_logging.request_id.set("req-123")
+    try:
+        summary, _ = events_of({"nodes": [node("a")]}, registry, executor)
+    finally:
+        structured_logging.request_id.reset(token)
+
+    assert summary["results"]["a"]["output"]["request_id"] == "req-123"
+
+
+def test_streamed_workflow_keeps_the_request_id(client, server, monkeypatch):
+    def whoami(params):
+        return {"request_id": structured_logging.request_id.get()}, 200
+
+    monkeypatch.setitem(server.tool_registry._tools, "whoami", Tool("whoami", whoami))
+
+    response = client.post(
+        "/workflows/run", json={"nodes": [{"id": "a", "tool": "whoami"}]}, headers={"X-Request-Id": "req-stream"},
+    )
+
+    completed = [
+        json.loads(block.split("data: ", 1)[1])
+        for block in response.data.decode().split("\n\n") if block.startswith("event: node_completed")
+    ]
+    assert [data["output"]["request_id"] for data in completed] == ["req-stream"]
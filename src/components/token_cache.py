@@ -0,0 +1,259 @@
+"""
+Process-local cache for OAuth tokens read by the MCP server.
+
+Entries are keyed by (user_id, provider), expire when the token itself
+expires (or after a default TTL when the token has no `expires_in`), and are
+evicted least-recently-used once the cache is full. save_token() writes
+through the cache and can publish the change on an invalidation channel so
+other worker processes drop their copy of a rotated token.
+"""
+
+import collections
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def token_expires_at(token_data, issued_at):
+    """Absolute expiry (epoch seconds) for a token issued at `issued_at`, or None."""
+    expires_in = token_data.get("expires_in") if isinstance(token_data, dict) else None
+    if expires_in is None or issued_at is None:
+        return None
+    if isinstance(issued_at, str):
+        issued_at = datetime.datetime.strptime(issued_at[:19], "%Y-%m-%d %H:%M:%S")
+    if isinstance(issued_at, datetime.datetime):
+        issued_at = issued_at.timestamp()
+    try:
+        return float(issued_at) + float(expires_in)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenCache:
+    """Thread-safe LRU cache with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, max_size=1024, default_ttl=300.0, expiry_skew=30.0):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.expiry_skew = expiry_skew
+        self._entries = collections.OrderedDict()
+        # Bumped on every invalidation so a reader that raced with a writer
+        # cannot put a stale value back after the writer invalidated it.
+        # Only keys with a cache entry or a recent invalidation are tracked
+        # (at most max_size of them); every other key reads as _floor, which
+        # is raised past any version dropped so that a reader holding it is
+        # still turned away.
+        self._versions = collections.OrderedDict()
+        self._counter = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def version(self, user_id, provider):
+        with self._lock:
+            return self._versions.get((user_id, provider), self._floor)
+
+    def get(self, user_id, provider, allow_partial=False):
+        # Partial entries hold only the typed columns read by the hot path
+        # (e.g. access_token) and don't satisfy callers wanting the full token.
+        key = (user_id, provider)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[2] and not allow_partial):
+                self._stats["misses"] += 1
+                return None
+            token_data, expires_at, _ = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._drop_version(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+        # Callers may mutate the dict they get back
+        return dict(token_data)
+
+    def put(self, user_id, provider, token_data, expires_at=None, version=None, partial=False):
+        if self.max_size <= 0:
+            return
+        key = (user_id, provider)
+        now = time.time()
+        if expires_at is None:
+            expires_at = now + self.default_ttl
+        else:
+            expires_at -= self.expiry_skew
+        if expires_at <= now:
+            return
+        with self._lock:
+            if version is not None and version != self._versions.get(key, self._floor):
+                return
+            existing = self._entries.get(key)
+            if partial and existing is not None and not existing[2]:
+                return
+            self._entries[key] = (dict(token_data), expires_at, partial)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self._drop_version(evicted)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, user_id, provider, remote=False):
+        key = (user_id, provider)
+        with self._lock:
+            self._counter += 1
+            self._versions[key] = self._counter
+            self._versions.move_to_end(key)
+            while len(self._versions) > max(self.max_size, 1):
+                self._drop_version(next(iter(self._versions)))
+            self._entries.pop(key, None)
+            self._stats["remote_invalidations" if remote else "invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._counter += 1
+            self._floor = self._counter
+            self._versions.clear()
+            self._entries.clear()
+
+    def _drop_version(self, key):
+        version = self._versions.pop(key, None)
+        if version is not None:
+            self._floor = max(self._floor, version)
+
+    def stats(self):
+        with self._lock:
+            hits = self._stats["hits"]
+            misses = self._stats["misses"]
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+                "evictions": self._stats["evictions"],
+                "expirations": self._stats["expirations"],
+                "invalidations": self._stats["invalidations"],
+                "remote_invalidations": self._stats["remote_invalidations"],
+                "tracked_versions": len(self._versions),
+            }
+
+
+class SQLiteInvalidationChannel:
+    """
+    Cross-process invalidation log stored in a shared SQLite file.
+
+    Every worker appends (user_id, provider) when it saves a token and a
+    background thread in each worker replays entries written by others.
+    """
+
+    def __init__(self, path, cache, poll_interval=1.0, retention=3600.0, max_own=10000):
+        self.path = path
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.max_own = max_own
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread = None
+        self._published = 0
+        self._received = 0
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS token_invalidations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                provider TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        row = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM token_invalidations").fetchone()
+        self._last_seq = row[0]
+        # Entries this process published (seq -> created_at), skipped when
+        # polled. Trimmed on publish: past `retention` the row is gone, and
+        # beyond `max_own` the oldest are forgotten, so a process that never
+        # polls doesn't grow. A forgotten entry that is polled later only
+        # drops this process's own cached copy.
+        self._own_seqs = collections.OrderedDict()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def publish(self, user_id, provider):
+        self.publish_many([(user_id, provider)])
+
+    def publish_many(self, keys):
+        conn = self._conn()
+        now = time.time()
+        published = 0
+        for user_id, provider in keys:
+            cursor = conn.execute(
+                "INSERT INTO token_invalidations (user_id, provider, created_at) VALUES (?, ?, ?)",
+                (user_id, provider, now)
+            )
+            with self._lock:
+                self._own_seqs[cursor.lastrowid] = now
+            published += 1
+        conn.execute("DELETE FROM token_invalidations WHERE created_at < ?", (now - self.retention,))
+        conn.commit()
+        with self._lock:
+            self._published += published
+            while self._own_seqs and (
+                len(self._own_seqs) > self.max_own or next(iter(self._own_seqs.values())) < now - self.retention
+            ):
+                self._own_seqs.popitem(last=False)
+
+    def poll(self):
+        """Apply invalidations published since the last poll; returns how many."""
+        rows = self._conn().execute(
+            "SELECT seq, user_id, provider FROM token_invalidations WHERE seq > ? ORDER BY seq",
+            (self._last_seq,)
+        ).fetchall()
+        applied = 0
+        for seq, user_id, provider in rows:
+            self._last_seq = seq
+            with self._lock:
+                own = self._own_seqs.pop(seq, None) is not None
+            if own:
+                continue
+            self.cache.invalidate(user_id, provider, remote=True)
+            applied += 1
+        self._received += applied
+        return applied
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="token-cache-invalidation", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "published": self._published,
+            "received": self._received,
+            "last_seq": self._last_seq,
+            "unpolled_own": len(self._own_seqs),
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error("Token cache invalidation poll error: %s", e)
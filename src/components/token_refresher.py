@@ -0,0 +1,123 @@
+"""
+Background scheduler that refreshes OAuth tokens before they expire.
+
+Every `interval` seconds the scheduler asks for tokens expiring within
+`lead_time` seconds and refreshes them on a bounded thread pool. Each refresh
+starts after a random delay of up to `jitter` seconds so a batch of tokens
+issued together does not hit the token endpoint in one burst. A token whose
+refresh failed is not retried until `failure_backoff` seconds have passed.
+"""
+
+import collections
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRefresher:
+    """Periodically refreshes expiring tokens with bounded concurrency."""
+
+    def __init__(self, list_expiring, refresh, interval=60.0, lead_time=300.0,
+                 max_workers=4, jitter=5.0, failure_backoff=300.0):
+        # list_expiring(within_seconds) -> iterable of (user_id, provider, token_data)
+        # refresh(user_id, provider, token_data) -> truthy on success
+        self._list_expiring = list_expiring
+        self._refresh = refresh
+        self.interval = interval
+        self.lead_time = lead_time
+        self.max_workers = max_workers
+        self.jitter = jitter
+        self.failure_backoff = failure_backoff
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="token-refresh")
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._in_flight = set()
+        self._failed_at = {}
+        self._last_run = None
+        self._stats = collections.Counter()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="token-refresh-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self, wait_for_tasks=False):
+        self._stop.set()
+        self._executor.shutdown(wait=wait_for_tasks, cancel_futures=not wait_for_tasks)
+
+    def run_once(self):
+        """Scan for expiring tokens and submit refreshes; returns their futures."""
+        now = time.time()
+        futures = []
+        with self._lock:
+            self._last_run = now
+            self._stats["runs"] += 1
+        for user_id, provider, token_data in self._list_expiring(self.lead_time):
+            key = (user_id, provider)
+            with self._lock:
+                if key in self._in_flight:
+                    continue
+                failed_at = self._failed_at.get(key)
+                if failed_at is not None and now - failed_at < self.failure_backoff:
+                    self._stats["skipped_backoff"] += 1
+                    continue
+                self._in_flight.add(key)
+            delay = random.uniform(0, self.jitter) if self.jitter > 0 else 0
+            futures.append(self._executor.submit(self._refresh_one, key, token_data, delay))
+        return futures
+
+    def refresh_now(self):
+        """Run one scan and wait for its refreshes to finish (used by tests and tools)."""
+        futures = self.run_once()
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "interval": self.interval,
+                "lead_time": self.lead_time,
+                "max_workers": self.max_workers,
+                "last_run": self._last_run,
+                "in_flight": len(self._in_flight),
+                "runs": self._stats["runs"],
+                "refreshed": self._stats["refreshed"],
+                "failures": self._stats["failures"],
+                "skipped_backoff": self._stats["skipped_backoff"],
+            }
+
+    def _refresh_one(self, key, token_data, delay):
+        try:
+            if delay and self._stop.wait(delay):
+                return False
+            try:
+                ok = bool(self._refresh(key[0], key[1], token_data))
+            except Exception as e:
+                logger.error("Token refresh error for %s/%s: %s", key[0], key[1], e)
+                ok = False
+            with self._lock:
+                if ok:
+                    self._failed_at.pop(key, None)
+                    self._stats["refreshed"] += 1
+                else:
+                    self._failed_at[key] = time.time()
+                    self._stats["failures"] += 1
+            return ok
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception("Token refresh scan error: %s", e)
+            # Jitter the scan interval by +/-10% so workers don't scan in lockstep
+            if self._stop.wait(self.interval * random.uniform(0.9, 1.1)):
+                return
@@ -0,0 +1,67 @@
+"""
+Registry of the tools the MCP server can run.
+
+A tool is a callable taking a dict of parameters and returning
+(response_body, status_code), the same contract as the /tools/* endpoints.
+Workflows and other dispatchers look tools up here, so a new tool only has
+to be registered once to become available everywhere.
+"""
+
+import threading
+
+
+class Tool:
+    """A registered tool and the metadata advertised to clients."""
+
+    __slots__ = ("name", "handler", "description", "input_schema")
+
+    def __init__(self, name, handler, description="", input_schema=None):
+        self.name = name
+        self.handler = handler
+        self.description = description
+        self.input_schema = input_schema or {"type": "object"}
+
+    def describe(self):
+        return {"name": self.name, "description": self.description, "inputSchema": self.input_schema}
+
+
+class ToolRegistry:
+    """Name -> Tool mapping; safe to read from many threads."""
+
+    def __init__(self):
+        self._tools = {}
+        self._lock = threading.Lock()
+        # Built once and reused until the next registration
+        self._description = None
+
+    def register(self, name, handler, description="", input_schema=None, aliases=()):
+        tool = Tool(name, handler, description, input_schema)
+        with self._lock:
+            self._tools[name] = tool
+            for alias in aliases:
+                self._tools.setdefault(alias, tool)
+            self._description = None
+        return tool
+
+    def get(self, name):
+        return self._tools.get(name)
+
+    def __contains__(self, name):
+        return name in self._tools
+
+    def describe(self):
+        """Metadata for every tool, listed once even if it has aliases."""
+        description = self._description
+        if description is None:
+            with self._lock:
+                seen = {}
+                for tool in self._tools.values():
+                    seen.setdefault(tool.name, tool)
+                description = self._description = [tool.describe() for tool in seen.values()]
+        return description
+
+    def call(self, name, params):
+        tool = self._tools.get(name)
+        if tool is None:
+            raise KeyError(f"Unknown tool: {name}")
+        return tool.handler(params)
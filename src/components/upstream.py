@@ -0,0 +1,145 @@
+"""
+Shared HTTP client for every upstream Google call made by the MCP server.
+
+One requests.Session is reused across requests so connections (and their TLS
+sessions) are kept alive in per-host pools. Every call gets connect/read
+timeouts, idempotent failures are retried with exponential backoff, and
+latency and status codes are recorded per logical endpoint. requests itself
+is imported, and the session built, on the first call.
+"""
+
+import collections
+import threading
+import time
+
+from lazy_import import LazyModule
+
+requests = LazyModule("requests")
+urllib3 = LazyModule("urllib3")
+
+
+def is_connect_error(error):
+    """True if the requests exception `error` means the request never reached the server."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class UpstreamClient:
+    """Pooled, instrumented wrapper around requests.Session."""
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, connect_timeout=3.05,
+                 read_timeout=30.0, retries=2, backoff_factor=0.3, observer=None):
+        self.timeout = (connect_timeout, read_timeout)
+        # observer(endpoint, seconds, status_code or None), called after every request
+        self.observer = observer
+        self.retries = retries
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.backoff_factor = backoff_factor
+        self._session = None
+        self._lock = threading.Lock()
+        self._endpoints = collections.defaultdict(lambda: {
+            "count": 0,
+            "errors": 0,
+            "status_codes": collections.Counter(),
+            "total_seconds": 0.0,
+            "max_seconds": 0.0,
+            "last_seconds": None,
+        })
+
+    @property
+    def session(self):
+        session = self._session
+        if session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+                session = self._session
+        return session
+
+    def _build_session(self):
+        retry = urllib3.util.retry.Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            # Only methods that are safe to repeat are retried after the
+            # request reached the server; connect errors are retried for all.
+            allowed_methods=urllib3.util.retry.Retry.DEFAULT_ALLOWED_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        """Send a request; `endpoint` names the call in the latency stats."""
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = endpoint or f"{method.upper()} {url.split('?', 1)[0]}"
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            self._record(endpoint, time.perf_counter() - start, None)
+            # Read timeouts that used up the retries come back as a
+            # ConnectionError; report them as the timeouts they are
+            reason = getattr(e.args[0], "reason", None) if e.args else None
+            if isinstance(e, requests.ConnectionError) and isinstance(reason, urllib3.exceptions.ReadTimeoutError):
+                raise requests.ReadTimeout(*e.args, request=e.request, response=e.response) from e
+            raise
+        self._record(endpoint, time.perf_counter() - start, response.status_code)
+        return response
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request("GET", url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request("POST", url, endpoint=endpoint, **kwargs)
+
+    def mount(self, prefix, adapter):
+        """Route URLs starting with `prefix` through a custom transport adapter."""
+        self.session.mount(prefix, adapter)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for endpoint, entry in self._endpoints.items():
+                count = entry["count"]
+                stats[endpoint] = {
+                    "count": count,
+                    "errors": entry["errors"],
+                    "status_codes": {str(code): n for code, n in entry["status_codes"].items()},
+                    "avg_seconds": round(entry["total_seconds"] / count, 6) if count else None,
+                    "max_seconds": round(entry["max_seconds"], 6),
+                    "last_seconds": round(entry["last_seconds"], 6) if entry["last_seconds"] is not None else None,
+                }
+            return stats
+
+    def _record(self, endpoint, elapsed, status_code):
+        if self.observer is not None:
+            self.observer(endpoint, elapsed, status_code)
+        with self._lock:
+            entry = self._endpoints[endpoint]
+            entry["count"] += 1
+            entry["total_seconds"] += elapsed
+            entry["last_seconds"] = elapsed
+            if elapsed > entry["max_seconds"]:
+                entry["max_seconds"] = elapsed
+            if status_code is None:
+                entry["errors"] += 1
+                entry["status_codes"]["error"] += 1
+            else:
+                entry["status_codes"][status_code] += 1
+                if status_code >= 500:
+                    entry["errors"] += 1
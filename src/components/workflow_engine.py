@@ -0,0 +1,210 @@
+"""
+Server-side execution of workflow graphs built in SimpleWorkflowBuilder.
+
+A workflow is {"nodes": [...], "edges": [...]}. Each node names a registered
+tool and its parameters; each edge {"source", "target", "map"?} makes the
+target wait for the source and can copy values out of the source's output
+into the target's parameters. String parameters may also reference the
+output of any upstream node as "{{node_id.path.to.value}}".
+
+The graph is validated as a DAG up front, then nodes whose dependencies have
+finished run concurrently on a worker pool. Progress is reported through an
+`emit(event, data)` callback as nodes start, finish, fail or are skipped
+because something upstream failed.
+"""
+
+import contextvars
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+TEMPLATE_RE = re.compile(r"\{\{\s*([A-Za-z0-9_\-]+)((?:\.[A-Za-z0-9_\-]+)*)\s*\}\}")
+
+# Builder node services -> registered tool names
+SERVICE_TOOLS = {
+    "gmail": "send_email",
+    "calendar": "create_event",
+}
+
+
+class WorkflowError(ValueError):
+    """The submitted graph is not a valid, runnable workflow."""
+
+
+def node_tool(node):
+    """Tool name for a node: explicit "tool", else the builder's selected service."""
+    if node.get("tool"):
+        return node["tool"]
+    for tool in node.get("tools") or []:
+        service = tool.get("service") if isinstance(tool, dict) else None
+        if service in SERVICE_TOOLS:
+            return SERVICE_TOOLS[service]
+    return None
+
+
+def resolve_path(value, path):
+    for part in path:
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+
+def validate_workflow(graph, registry, max_nodes=100):
+    """
+    Check the graph and return (nodes_by_id, edges, dependencies).
+
+    Raises WorkflowError for malformed graphs, unknown tools and cycles.
+    """
+    if not isinstance(graph, dict):
+        raise WorkflowError("Workflow must be an object with 'nodes' and 'edges'")
+    nodes = graph.get("nodes")
+    # The builder calls edges "connections"
+    edges = graph.get("edges", graph.get("connections")) or []
+    if not isinstance(nodes, list) or not nodes:
+        raise WorkflowError("'nodes' must be a non-empty list")
+    if len(nodes) > max_nodes:
+        raise WorkflowError(f"Workflow exceeds {max_nodes} nodes")
+    if not isinstance(edges, list):
+        raise WorkflowError("'edges' must be a list")
+
+    nodes_by_id = {}
+    for node in nodes:
+        if not isinstance(node, dict) or node.get("id") in (None, ""):
+            raise WorkflowError("Every node must be an object with an 'id'")
+        node_id = str(node["id"])
+        if node_id in nodes_by_id:
+            raise WorkflowError(f"Duplicate node id '{node_id}'")
+        tool = node_tool(node)
+        if tool is None or tool not in registry:
+            raise WorkflowError(f"Node '{node_id}' has unknown tool '{tool}'")
+        nodes_by_id[node_id] = node
+
+    dependencies = {node_id: set() for node_id in nodes_by_id}
+    for edge in edges:
+        if not isinstance(edge, dict):
+            raise WorkflowError("Every edge must be an object with 'source' and 'target'")
+        source, target = str(edge.get("source")), str(edge.get("target"))
+        if source not in nodes_by_id or target not in nodes_by_id:
+            raise WorkflowError(f"Edge {source} -> {target} references an unknown node")
+        if source == target:
+            raise WorkflowError(f"Node '{source}' cannot depend on itself")
+        dependencies[target].add(source)
+
+    # Kahn's algorithm: anything left unvisited sits on a cycle
+    remaining = {node_id: len(deps) for node_id, deps in dependencies.items()}
+    dependents = {node_id: [] for node_id in nodes_by_id}
+    for target, deps in dependencies.items():
+        for source in deps:
+            dependents[source].append(target)
+    ready = [node_id for node_id, count in remaining.items() if count == 0]
+    visited = 0
+    while ready:
+        node_id = ready.pop()
+        visited += 1
+        for target in dependents[node_id]:
+            remaining[target] -= 1
+            if remaining[target] == 0:
+                ready.append(target)
+    if visited != len(nodes_by_id):
+        cyclic = sorted(node_id for node_id, count in remaining.items() if count > 0)
+        raise WorkflowError(f"Workflow contains a cycle through nodes: {', '.join(cyclic)}")
+
+    return nodes_by_id, edges, dependencies
+
+
+def build_params(node_id, node, edges, outputs, defaults):
+    params = dict(defaults)
+    params.update(node.get("params") or node.get("config") or {})
+
+    def substitute(value):
+        if not isinstance(value, str):
+            return value
+        whole = TEMPLATE_RE.fullmatch(value.strip())
+        if whole and whole.group(1) in outputs:
+            # A parameter that is just one reference keeps the value's type
+            return resolve_path(outputs[whole.group(1)], whole.group(2).split(".")[1:])
+
+        def replace(match):
+            if match.group(1) not in outputs:
+                return match.group(0)
+            resolved = resolve_path(outputs[match.group(1)], match.group(2).split(".")[1:])
+            return "" if resolved is None else str(resolved)
+        return TEMPLATE_RE.sub(replace, value)
+
+    params = {key: substitute(value) for key, value in params.items()}
+    for edge in edges:
+        if str(edge.get("target")) != node_id:
+            continue
+        source_output = outputs.get(str(edge.get("source")))
+        for param, path in (edge.get("map") or {}).items():
+            params[param] = resolve_path(source_output, str(path).split(".")) if path else source_output
+    return params
+
+
+def run_workflow(graph, registry, executor, emit=None, defaults=None, max_nodes=100):
+    """Run a validated workflow; returns a summary with every node's result."""
+    emit = emit or (lambda event, data: None)
+    nodes_by_id, edges, dependencies = validate_workflow(graph, registry, max_nodes)
+    defaults = defaults or {}
+    started_at = time.perf_counter()
+
+    outputs = {}
+    results = {}
+    pending = dict(dependencies)
+    running = {}
+    emit("workflow_started", {"nodes": list(nodes_by_id)})
+
+    def finish(node_id, status, **data):
+        results[node_id] = dict(data, status=status)
+        emit(f"node_{status}", dict(data, node_id=node_id))
+
+    def call_tool(tool, params):
+        start = time.perf_counter()
+        try:
+            body, code = registry.call(tool, params)
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}, 500, time.perf_counter() - start
+        return body, code, time.perf_counter() - start
+
+    while pending or running:
+        # Skip nodes downstream of a failure; start nodes whose inputs are ready
+        for node_id in list(pending):
+            deps = pending[node_id]
+            failed = [dep for dep in deps if results.get(dep, {}).get("status") in ("failed", "skipped")]
+            if failed:
+                del pending[node_id]
+                finish(node_id, "skipped", reason=f"Upstream node '{failed[0]}' did not succeed")
+            elif all(dep in outputs for dep in deps):
+                del pending[node_id]
+                node = nodes_by_id[node_id]
+                tool = node_tool(node)
+                params = build_params(node_id, node, edges, outputs, defaults)
+                emit("node_started", {"node_id": node_id, "tool": tool})
+                # In the caller's context, so the node's logs keep its correlation id
+                running[executor.submit(contextvars.copy_context().run, call_tool, tool, params)] = node_id
+        if not running:
+            # Only possible when everything left was skipped
+            continue
+        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for future in done:
+            node_id = running.pop(future)
+            body, code, elapsed = future.result()
+            if code < 400:
+                outputs[node_id] = body
+                finish(node_id, "completed", status_code=code, output=body, seconds=round(elapsed, 4))
+            else:
+                finish(node_id, "failed", status_code=code, error=body, seconds=round(elapsed, 4))
+
+    failed = sorted(node_id for node_id, result in results.items() if result["status"] != "completed")
+    summary = {
+        "success": not failed,
+        "failed_nodes": failed,
+        "seconds": round(time.perf_counter() - started_at, 4),
+        "results": results,
+    }
+    emit("workflow_completed", summary)
+    return summary